@@ -1,81 +1,171 @@
-import os
+"""
+Add missing artist and genre tags to mp3 files
+
+What it does:
+
+- Walks a music library looking for mp3s without an artist or genre tag
+- Prompts for a missing artist
+- Looks up a missing genre by artist on TheAudioDB, and prompts if nothing is found. Lookups for every
+  distinct artist in the folder are made concurrently up front, over one keep-alive session, and
+  cached on disk (misses too), so a run costs at most one request per artist
+- Writes tags in the background so the prompts never wait on the disk (or all at once with --defer-writes)
+
+Usage:
+    python3 add_genre.py /path/to/music/files
+    python3 add_genre.py /path/to/music/files --index /path/to/tags.sqlite
+    python3 add_genre.py /path/to/music/files --defer-writes
+    python3 add_genre.py /path/to/music/files --audiodb-url http://localhost:8000/search.php
+    python3 add_genre.py /path/to/music/files --metrics add_genre.json   # stage timings, see metrics.py
+"""
+
+import argparse
 import requests
-import sys
+from concurrent.futures import ThreadPoolExecutor
+
+from requests.adapters import HTTPAdapter
 
-from mutagen.mp3 import MP3
-from mutagen.id3 import ID3, ID3NoHeaderError, ID3NoHeaderError, ID3, ID3NoHeaderError, TCON, TPE1
-from tinytag import TinyTag
+from lookup_cache import DAY, DEFAULT_CACHE, MISS, LookupCache
+from metrics import add_metrics_arguments, instrumented, metrics
+from tag_index import get_tags, open_index
+from tag_writer import TagWriteQueue, write_id3_frames
+from walker import walk
 
-def add_artist_to_mp3(file_path, artist):
+AUDIODB_URL = "https://www.theaudiodb.com/api/v1/json/123/search.php"
+
+def add_artist_to_mp3(file_path, artist, writes=None):
+    if writes is not None:
+        writes.submit(file_path, artist=artist)
+        return
     try:
-        # Load the MP3 file
-        audio = MP3(file_path, ID3=ID3)
-        # Check if ID3 tags exist, if not, create them
-        if audio.tags is None:
-            audio.add_tags()
-        # Set the artist
-        audio.tags.add(TPE1(encoding=3, text=artist))
-        audio.save()
+        write_id3_frames(file_path, artist=artist)
         print(f'Added artist "{artist}" to {file_path}')
-    except ID3NoHeaderError:
-        print(f'No ID3 header found in {file_path}.')
     except Exception as e:
         print(f'Error processing {file_path}: {e}')
 
-def add_genre_to_mp3(file_path, genre):
+def add_genre_to_mp3(file_path, genre, writes=None):
+    if writes is not None:
+        writes.submit(file_path, genre=genre)
+        return
     try:
-        # Load the MP3 file
-        audio = MP3(file_path, ID3=ID3)
-        # Check if ID3 tags exist, if not, create them
-        if audio.tags is None:
-            audio.add_tags()
-        # Set the genre
-        audio.tags.add(TCON(encoding=3, text=genre))
-        audio.save()
+        write_id3_frames(file_path, genre=genre)
         print(f'Added genre "{genre}" to {file_path}')
-    except ID3NoHeaderError:
-        print(f'No ID3 header found in {file_path}.')
     except Exception as e:
         print(f'Error processing {file_path}: {e}')
 
-def find_mp3_without_genre_or_artist(directory):
-    for root, dirs, files in os.walk(directory):
-        for file in files:
-            if file.lower().endswith('.mp3'):
-                file_path = os.path.join(root, file)
-                tag = TinyTag.get(file_path)
-
-                print(f"{file_path}, Tag: {tag.genre}, Artist: {tag.artist}")
-                if not tag.artist:
-                    artist = input(f"Enter the artist for {file_path}: ")
-                    print(f"Artist is {artist}")
-                    add_artist_to_mp3(file_path, artist)
-                else:
-                    artist = tag.artist
-
-                if tag.genre is None or tag.genre == '' or tag.genre == ' ' or tag.genre.lower() in ['other', 'unknown']:
-                    genre = ""
-                    # Search by artist to get genre
-                    try:
-                        artist = artist.replace(" ", "%20")
-                    except Exception as e:
-                        print(artist, e)
-                    r = requests.get(f"https://www.theaudiodb.com/api/v1/json/123/search.php?s={artist}")
-                    result = r.json()
-                    print(f"RESULT for {artist}: {result}")
-                    if result['artists']:
-                        if result['artists'][0]['strGenre']:
-                            genre = result['artists'][0]['strGenre']
-                        else:
-                            genre = input(f"Enter the genre for {file_path}: ")
-                    else:
-                        genre = input(f"Enter the genre for {file_path}: ")
-                    print(f"Genre is {genre}")
-                    add_genre_to_mp3(file_path, genre)
+def needs_genre(genre):
+    return genre is None or genre == '' or genre == ' ' or genre.lower() in ['other', 'unknown']
+
+def normalize_artist(artist):
+    return " ".join(artist.casefold().split())
+
+class ArtistGenreLookup:
+    """
+    genre-by-artist lookups on TheAudioDB over one keep-alive session, cached on
+    disk per normalized artist (misses included) and in memory for the run
+    """
+    def __init__(self, cache=None, base_url=AUDIODB_URL, timeout=10, pool_size=8):
+        self.cache = cache
+        self.base_url = base_url
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=2)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.memo = {}
+        self.requests_made = 0
+
+    def fetch(self, artist):
+        self.requests_made += 1
+        metrics.count("audiodb_requests")
+        with metrics.stage("network"):
+            r = self.session.get(self.base_url, params={"s": artist}, timeout=self.timeout)
+            r.raise_for_status()
+            artists = r.json().get('artists')
+        if artists and artists[0].get('strGenre'):
+            return artists[0]['strGenre']
+        return None
+
+    def genre_for(self, artist):
+        key = normalize_artist(artist)
+        if key in self.memo:
+            return self.memo[key]
+        genre = self.cache.get("audiodb", key) if self.cache is not None else MISS
+        if genre is not MISS:
+            metrics.count("lookup_cache_hits")
+        else:
+            try:
+                genre = self.fetch(artist)
+            except Exception as e:
+                # network trouble: don't cache, the next run can try again
+                print(f"Lookup failed for {artist}: {e}")
+                metrics.count("lookup_errors")
+                return None
+            if self.cache is not None:
+                self.cache.put("audiodb", key, genre)
+        self.memo[key] = genre
+        return genre
+
+    def prefetch(self, artists, workers=8):
+        """look up every distinct artist concurrently, before any prompting"""
+        todo = {}
+        for artist in artists:
+            todo.setdefault(normalize_artist(artist), artist)
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            list(pool.map(self.genre_for, todo.values()))
+
+def find_mp3_without_genre_or_artist(directory, index=None, writes=None, lookup=None, prefetch_workers=8):
+    if lookup is None:
+        lookup = ArtistGenreLookup()
+
+    tracks = []
+    for file_path in metrics.timed("walk", walk(directory, exts={"mp3"})):
+        with metrics.stage("parse"):
+            tracks.append((file_path, get_tags(file_path, index)))
+    artists = [tag.artist for file_path, tag in tracks if tag.artist and needs_genre(tag.genre)]
+    print(f"Looking up genres for {len(set(map(normalize_artist, artists)))} artists...")
+    lookup.prefetch(artists, prefetch_workers)
+
+    for file_path, tag in tracks:
+        print(f"{file_path}, Tag: {tag.genre}, Artist: {tag.artist}")
+        if not tag.artist:
+            artist = input(f"Enter the artist for {file_path}: ")
+            print(f"Artist is {artist}")
+            add_artist_to_mp3(file_path, artist, writes)
+        else:
+            artist = tag.artist
+
+        if needs_genre(tag.genre):
+            # Search by artist to get genre
+            genre = lookup.genre_for(artist) if artist else None
+            print(f"Genre for {artist}: {genre}")
+            if not genre:
+                genre = input(f"Enter the genre for {file_path}: ")
+            print(f"Genre is {genre}")
+            add_genre_to_mp3(file_path, genre, writes)
+
+    print(f"[done] {lookup.requests_made} TheAudioDB requests")
 
 def main():
-    directory_path = sys.argv[1]  # (example: "/path/to/music/files")
-    find_mp3_without_genre_or_artist(directory_path)
+    ap = argparse.ArgumentParser(description="Add missing artist and genre tags to mp3 files.")
+    ap.add_argument("directory", help="Root folder (e.g., /path/to/music/files)")
+    ap.add_argument("--index", help="Tag index database (see tag_index.py)")
+    ap.add_argument("--defer-writes", action="store_true", help="Collect all edits and write them in one parallel batch at the end.")
+    ap.add_argument("--write-workers", type=int, default=4, help="Threads writing tags in the background (default: 4).")
+    ap.add_argument("--cache", default=DEFAULT_CACHE, help=f"Lookup cache database (default: {DEFAULT_CACHE})")
+    ap.add_argument("--cache-days", type=float, default=30, help="How long a found genre stays cached (default: 30 days).")
+    ap.add_argument("--negative-cache-days", type=float, default=1, help="How long a 'not found' stays cached (default: 1 day).")
+    ap.add_argument("--lookup-workers", type=int, default=8, help="Concurrent TheAudioDB lookups while prefetching (default: 8).")
+    ap.add_argument("--audiodb-url", default=AUDIODB_URL, help="TheAudioDB search endpoint (e.g. a local stub server for testing).")
+    add_metrics_arguments(ap)
+    args = ap.parse_args()
+
+    index = open_index(args.index)
+    with instrumented(args), LookupCache(args.cache, args.cache_days * DAY, args.negative_cache_days * DAY) as cache:
+        lookup = ArtistGenreLookup(cache, args.audiodb_url, pool_size=args.lookup_workers)
+        with TagWriteQueue(args.write_workers, defer=args.defer_writes) as writes:
+            find_mp3_without_genre_or_artist(args.directory, index, writes, lookup, args.lookup_workers)
+    if index is not None:
+        index.close()
 
 if __name__ == "__main__":
     main()
@@ -7,53 +7,230 @@ What it does:
 - Creates the storage path if it doesn't exist
 - Asks for verification before moving the file
 
+With --batch, it instead plans every move up front, shows the plan grouped by destination
+folder for bulk (or folder-by-folder) approval, creates each folder once, and moves the files.
+Progress is written to a journal, so an interrupted run picks up where it stopped without
+reading any tags again; a batch that finishes sets its journal aside (.done), and a journal left
+by a batch between other folders is refused rather than resumed. When the storage volume is a
+different filesystem, files are copied several at a time with kernel-side copies, checksummed,
+and only then deleted from the source (see transfer.py).
+
 Usage:
     python3 archive.py "/path/to/music/files" "/path/to/storage/volume"
+    python3 archive.py "/path/to/music/files" "/path/to/storage/volume" --index /path/to/tags.sqlite
+    python3 archive.py "/path/to/music/files" "/path/to/storage/volume" --batch --journal ingest.jsonl
+    python3 archive.py "/path/to/music/files" "/path/to/storage/volume" --batch --metrics archive.json   # see metrics.py
 """
 
+import argparse
+import json
 import os
 import shutil
 import sys
+from collections import defaultdict
+
+from metrics import add_metrics_arguments, instrumented, metrics
+from tag_index import get_tags, open_index
+from transfer import TransferEngine, existing_ancestor, move_file, same_filesystem
+from walker import walk
+
+IGNORE_GENRES = ['Soundtrack', 'Disney', 'Christmas', 'Jazz', 'Blues']
+
+def destination_for(file_path, tag, target_directory):
+    file = os.path.basename(file_path)
+    artist_folder = get_artist_folder(tag.genre, tag.artist, tag.album)
+
+    if not tag.genre in IGNORE_GENRES:
+        new_root = f"Alphabetical by Artist/{artist_folder[0]}"
+    else:
+        if tag.genre in ['Jazz', 'Blues']:
+            new_root = 'Jazz and Blues'
+        elif tag.genre == 'Christmas':
+            new_root = 'Holidays/Christmas'
+        elif tag.genre == 'Halloween':
+            new_root = 'Holidays/Halloween'
+        elif tag.genre in ['Broadway', 'Soundtrack']:
+            new_root = 'Soundtracks and Show Tunes'
+        else:
+            new_root = tag.genre
+
+    return os.path.join(target_directory, new_root, artist_folder, file)
+
+def sidecar_path(path):
+    return path.replace('.mp3', '_300.jpg')
+
+def identify(source_directory, target_directory, index=None):
+    for file_path in metrics.timed("walk", walk(source_directory, exts={"mp3"})):
+        with metrics.stage("parse"):
+            tag = get_tags(file_path, index)
+        new_path = destination_for(file_path, tag, target_directory)
+
+        print('\n', file_path)
+        move = input(f"Move to {new_path}? (y/n): ")
+        if move == 'y':
+            file_move(file_path, new_path)
+            original_image_path = sidecar_path(file_path)
+            new_image_path = sidecar_path(new_path)
+            if os.path.exists(original_image_path):
+                file_move(original_image_path, new_image_path)
+        else:
+            pass
+
+def plan_archive(source_directory, target_directory, index=None):
+    """read every file's tags once and work out where it (and its _300.jpg) should go"""
+    plan = []
+    for file_path in metrics.timed("walk", walk(source_directory, exts={"mp3"})):
+        try:
+            with metrics.stage("parse"):
+                tag = get_tags(file_path, index)
+            new_path = destination_for(file_path, tag, target_directory)
+        except Exception as e:
+            print(f"Skipping {file_path}: {e}")
+            continue
+        move = {"source": file_path, "target": new_path, "size": os.path.getsize(file_path)}
+        if os.path.exists(sidecar_path(file_path)):
+            move["sidecar"] = [sidecar_path(file_path), sidecar_path(new_path)]
+        plan.append(move)
+    return plan
+
+def group_by_folder(plan):
+    folders = defaultdict(list)
+    for move in plan:
+        folders[os.path.dirname(move["target"])].append(move)
+    return folders
+
+def approve_plan(plan):
+    """show the plan grouped by destination folder and return the moves the user approved"""
+    folders = group_by_folder(plan)
+    print(f"\n{len(plan)} files into {len(folders)} folders:")
+    for folder in sorted(folders):
+        print(f"{len(folders[folder]):6d}  {folder}")
+    answer = input("\nMove all (a), review folder by folder (r), or quit (q)? ").strip().lower()
+    if answer == 'a':
+        return plan
+    if answer != 'r':
+        return []
+    approved = []
+    for folder in sorted(folders):
+        print(f"\n{folder}")
+        for move in folders[folder]:
+            print(f"\t{move['source']}")
+        if input(f"Move these {len(folders[folder])} files? (y/n): ").strip().lower() == 'y':
+            approved.extend(folders[folder])
+    return approved
 
-from tinytag import TinyTag
-
-def identify(source_directory, target_directory):
-    ignore_genres = ['Soundtrack', 'Disney', 'Christmas', 'Jazz', 'Blues']
-
-    for root, dirs, files in os.walk(source_directory):
-        for file in files:
-            if file.lower().endswith('.mp3'):
-                file_path = os.path.join(root, file)
-                tag = TinyTag.get(file_path)
-
-                artist_folder = get_artist_folder(tag.genre, tag.artist, tag.album)
-
-                if not tag.genre in ignore_genres:
-                    new_root = f"Alphabetical by Artist/{artist_folder[0]}"
-                else:
-                    if tag.genre in ['Jazz', 'Blues']:
-                        new_root = 'Jazz and Blues'
-                    elif tag.genre == 'Christmas':
-                        new_root = 'Holidays/Christmas'
-                    elif tag.genre == 'Halloween':
-                        new_root = 'Holidays/Halloween'
-                    elif tag.genre in ['Broadway', 'Soundtrack']:
-                        new_root = 'Soundtracks and Show Tunes'
-                    else:
-                        new_root = tag.genre
-
-                new_path = os.path.join(target_directory, new_root, artist_folder, file)
-
-                print('\n', file_path)
-                move = input(f"Move to {new_path}? (y/n): ")
-                if move == 'y':
-                    file_move(file_path, new_path)
-                    original_image_path = file_path.replace('.mp3', '_300.jpg')
-                    new_image_path = new_path.replace('.mp3', '_300.jpg')
-                    if os.path.exists(original_image_path):
-                        file_move(original_image_path, new_image_path)
-                else:
-                    pass
+def read_journal(journal_path):
+    """return (plan record, sources already moved) from an archive journal, or (None, set())"""
+    plan = None
+    done = set()
+    if not os.path.exists(journal_path):
+        return plan, done
+    with open(journal_path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # a line cut short by the interruption
+                continue
+            if record["type"] == "plan":
+                plan = record
+            elif record["type"] == "moved":
+                done.add(record["source"])
+    return plan, done
+
+def already_moved(move):
+    """
+    True if the mp3 is at its target and gone from its source, i.e. moved by an
+    earlier run that stopped before it could journal the move
+    """
+    if os.path.exists(move["source"]) or not os.path.exists(move["target"]):
+        return False
+    return os.path.getsize(move["target"]) == move["size"]
+
+def move_group(move):
+    """the mp3 and its sidecar, moved together, less whatever an earlier run already moved"""
+    group = [] if already_moved(move) else [(move["source"], move["target"])]
+    if "sidecar" in move and os.path.exists(move["sidecar"][0]):
+        group.append(tuple(move["sidecar"]))
+    return group
+
+def same_fs_move(group):
+    moved = []
+    try:
+        for src, dst in group:
+            with metrics.stage("move"):
+                shutil.move(src, dst)
+            moved.append((src, dst))
+            metrics.count("files_moved")
+    except Exception as e:
+        return moved, e
+    return moved, None
+
+def execute_plan(plan, journal_path, done=frozenset(), workers=4):
+    """
+    create each destination folder once, then move the files, logging every
+    completed move to the journal so an interrupted run can pick up from there
+    """
+    todo = [move for move in plan if move["source"] not in done]
+    folders = group_by_folder(todo)
+    for folder in sorted(folders):
+        os.makedirs(folder, exist_ok=True)
+
+    moved = failed = 0
+    # a resumed plan's first source may be gone already, so look at the folder it was in
+    cross_device = bool(todo) and not same_filesystem(existing_ancestor(todo[0]["source"]), todo[0]["target"])
+    groups = {move["source"]: move_group(move) for move in todo}
+    with open(journal_path, "a", encoding="utf-8") as journal:
+        if cross_device:
+            # different filesystem: parallel kernel-side copies, verified before the source is deleted
+            engine = TransferEngine(workers)
+            results = engine.move_groups(groups.items())
+        else:
+            results = ((source,) + same_fs_move(group) for source, group in groups.items())
+        try:
+            for source, pairs, error in results:
+                if error is not None:
+                    failed += 1
+                    print(f"Error moving {source}: {error}")
+                    if pairs:
+                        # e.g. the mp3 moved but not its sidecar; a resume moves only what is left
+                        journal.write(json.dumps({"type": "partial", "source": source, "moved": [src for src, dst in pairs]}) + "\n")
+                        journal.flush()
+                    continue
+                moved += 1
+                journal.write(json.dumps({"type": "moved", "source": source}) + "\n")
+                journal.flush()
+        finally:
+            # on an interrupt, cancel the moves still queued
+            results.close()
+        if cross_device:
+            engine.report()
+    print(f"[done] Moved {moved} files into {len(folders)} folders, {failed} failed, {len(plan) - len(todo)} already moved")
+    return failed
+
+def batch_archive(source_directory, target_directory, journal_path, index=None, assume_yes=False, workers=4):
+    record, done = read_journal(journal_path)
+    source_directory, target_directory = os.path.abspath(source_directory), os.path.abspath(target_directory)
+    if record is not None:
+        if (record.get("source"), record.get("target")) != (source_directory, target_directory):
+            sys.exit(f"{journal_path} is an unfinished batch from {record.get('source')} to {record.get('target')}; "
+                     f"finish it with those folders, or pass another --journal")
+        plan = record["moves"]
+        print(f"Resuming {journal_path}: {len(done)} of {len(plan)} files already moved")
+    else:
+        plan = plan_archive(source_directory, target_directory, index)
+        if not assume_yes:
+            plan = approve_plan(plan)
+        if not plan:
+            print("Nothing to move")
+            return
+        with open(journal_path, "w", encoding="utf-8") as journal:
+            journal.write(json.dumps({"type": "plan", "source": source_directory, "target": target_directory,
+                                      "moves": plan}) + "\n")
+    if execute_plan(plan, journal_path, done, workers) == 0:
+        # finished: set the journal aside so the next batch starts a new plan
+        os.replace(journal_path, journal_path + ".done")
+        print(f"[info] Batch finished; journal set aside as {journal_path}.done")
 
 def get_artist_folder(genre_tag, artist_tag, album_tag):
     artist_folder = artist_tag
@@ -64,21 +241,43 @@ def get_artist_folder(genre_tag, artist_tag, album_tag):
     return artist_folder
 
 def file_move(old_path, new_path):
+    with metrics.stage("move"):
+        _file_move(old_path, new_path)
+
+def _file_move(old_path, new_path):
     try:
-        shutil.move(old_path, new_path)
+        folder = os.path.dirname(new_path)
+        if not os.path.isdir(folder):
+            print(f"\tCreate directory: {folder}")
+            os.makedirs(folder, exist_ok=True)
+        if same_filesystem(old_path, new_path):
+            shutil.move(old_path, new_path)
+        else:
+            # another volume: copy, verify the checksum, then delete the source
+            move_file(old_path, new_path)
     except Exception as e:
-        if 'No such file or directory' in str(e):
-            print(f"\tCreate directory: {new_path.rsplit('/', 1)[0]}")
-            try:
-                os.mkdir(new_path.rsplit('/', 1)[0])
-                shutil.move(old_path, new_path)
-            except Exception as e:
-                print(e)
+        print(e)
 
 def main():
-    source_directory = sys.argv[1]
-    target_directory = sys.argv[2]
-    identify(source_directory, target_directory)
+    ap = argparse.ArgumentParser(description="Move music files from a local folder to a storage volume.")
+    ap.add_argument("source_directory", help="Folder with new music files")
+    ap.add_argument("target_directory", help="Root of the storage volume")
+    ap.add_argument("--index", help="Tag index database (see tag_index.py)")
+    ap.add_argument("--batch", action="store_true", help="Plan every move up front, approve it in bulk, then move.")
+    ap.add_argument("--journal", default="archive_journal.jsonl", help="Batch journal; an interrupted batch run resumes from it (default: archive_journal.jsonl).")
+    ap.add_argument("--yes", action="store_true", help="With --batch, move without asking for approval.")
+    ap.add_argument("--transfers", type=int, default=4, help="With --batch onto another filesystem, copies in flight at once (default: 4).")
+    add_metrics_arguments(ap)
+    args = ap.parse_args()
+
+    index = open_index(args.index)
+    with instrumented(args):
+        if args.batch:
+            batch_archive(args.source_directory, args.target_directory, args.journal, index, args.yes, args.transfers)
+        else:
+            identify(args.source_directory, args.target_directory, index)
+    if index is not None:
+        index.close()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,136 @@
+"""
+Time the library scripts against synthetic libraries
+
+What it does:
+
+- Builds synthetic libraries with make_library.py (1k, 10k and 100k files by default) and keeps
+  them in --workdir, so later runs reuse them
+- Runs genre_census.py (with the default and the fast tag reader), find_duplicates.py, music_report.py, no_genre.py and tag-fixer.py --dry-run --auto
+  against each library, each as its own process with its output discarded
+- Reports wall time, files/sec (files in the library / wall time) and peak RSS of every run
+- With --json, saves the results so runs before and after a change can be compared
+
+Usage:
+    python3 benchmark.py
+    python3 benchmark.py --sizes 1000,10000 --only genre_census --only no_genre --repeat 3
+    python3 benchmark.py --extra genre_census="--workers 8" --json after.json
+"""
+
+import argparse
+import json
+import os
+import shlex
+import subprocess
+import sys
+import tempfile
+import time
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# name -> command line; {lib} is replaced with the library folder
+BENCHMARKS = {
+    "genre_census": ["genre_census.py", "{lib}", "--ext", "flac", "--ext", "m4a"],
+    "genre_census_fast": ["genre_census.py", "{lib}", "--ext", "flac", "--ext", "m4a", "--reader", "fast"],
+    "find_duplicates": ["find_duplicates.py", "{lib}"],
+    "music_report": ["music_report.py", "{lib}"],
+    "no_genre": ["no_genre.py", "{lib}"],
+    "tag-fixer": ["tag-fixer.py", "{lib}", "--dry-run", "--auto"],
+}
+
+DEFAULT_WORKDIR = os.path.join(tempfile.gettempdir(), "music-analysis-bench")
+
+
+def library(workdir, files, seed):
+    """return the folder of a synthetic library of the given size, building it if needed"""
+    path = os.path.join(workdir, f"lib-{files}-seed{seed}")
+    marker = os.path.join(path, ".complete")
+    if os.path.exists(marker):
+        return path
+    print(f"[info] building a {files}-file library in {path}")
+    # built in its own process so this one stays small (see run())
+    started = time.perf_counter()
+    subprocess.run([sys.executable, os.path.join(SCRIPT_DIR, "make_library.py"), path,
+                    "--files", str(files), "--seed", str(seed)], check=True)
+    print(f"[info] built in {time.perf_counter() - started:.1f}s")
+    open(marker, "w").close()
+    return path
+
+
+def run(command, cwd):
+    """run command; returns (seconds, peak RSS in MB, exit code)"""
+    with open(os.path.join(cwd, "stderr.log"), "ab") as stderr:
+        started = time.perf_counter()
+        proc = subprocess.Popen(command, cwd=cwd, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=stderr)
+        # wait4 gives the child's own resource usage, including its peak RSS. the kernel counts
+        # this process's RSS at the moment of the spawn too, so it is kept small
+        _, status, usage = os.wait4(proc.pid, 0)
+        elapsed = time.perf_counter() - started
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    # ru_maxrss is in kilobytes on Linux
+    return elapsed, usage.ru_maxrss / 1024, proc.returncode
+
+
+def benchmark(name, lib, files, extra, repeat, cwd):
+    command = [sys.executable, os.path.join(SCRIPT_DIR, BENCHMARKS[name][0])]
+    command += [arg.format(lib=lib) for arg in BENCHMARKS[name][1:]] + extra
+    runs = [run(command, cwd) for _ in range(repeat)]
+    seconds = min(r[0] for r in runs)
+    return {
+        "script": name,
+        "files": files,
+        "seconds": round(seconds, 3),
+        "files_per_sec": round(files / seconds, 1),
+        "peak_rss_mb": round(max(r[1] for r in runs), 1),
+        "exit_code": max((r[2] for r in runs), key=abs),
+        "args": extra,
+    }
+
+
+def parse_extra(values):
+    extra = {}
+    for value in values:
+        name, _, args = value.partition("=")
+        if name not in BENCHMARKS:
+            raise SystemExit(f"--extra: unknown script {name!r} (choose from {', '.join(BENCHMARKS)})")
+        extra[name] = shlex.split(args)
+    return extra
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Time the library scripts against synthetic libraries.")
+    ap.add_argument("--sizes", default="1000,10000,100000", help="Library sizes to test (default: 1000,10000,100000)")
+    ap.add_argument("--only", action="append", choices=sorted(BENCHMARKS), help="Only run these scripts (repeatable)")
+    ap.add_argument("--extra", action="append", default=[], metavar="SCRIPT=ARGS",
+                    help='Extra arguments for one script, e.g. genre_census="--workers 8" (repeatable)')
+    ap.add_argument("--repeat", type=int, default=1, help="Runs per script; the fastest is reported (default: 1)")
+    ap.add_argument("--seed", type=int, default=1, help="Seed for the synthetic libraries (default: 1)")
+    ap.add_argument("--workdir", default=DEFAULT_WORKDIR, help=f"Where libraries are built and kept (default: {DEFAULT_WORKDIR})")
+    ap.add_argument("--json", help="Also write the results to this JSON file")
+    args = ap.parse_args()
+
+    sizes = [int(s) for s in args.sizes.split(",")]
+    names = args.only or list(BENCHMARKS)
+    extra = parse_extra(args.extra)
+    os.makedirs(args.workdir, exist_ok=True)
+    # the scripts write their reports to the working directory
+    cwd = tempfile.mkdtemp(prefix="run-", dir=args.workdir)
+
+    results = []
+    print(f"{'files':>8}  {'script':<16} {'seconds':>9} {'files/sec':>10} {'peak RSS':>10}")
+    for files in sizes:
+        lib = library(args.workdir, files, args.seed)
+        for name in names:
+            result = benchmark(name, lib, files, extra.get(name, []), args.repeat, cwd)
+            results.append(result)
+            failed = f"  (exit {result['exit_code']}, see {cwd}/stderr.log)" if result["exit_code"] else ""
+            print(f"{files:>8}  {name:<16} {result['seconds']:>9.2f} {result['files_per_sec']:>10.0f} "
+                  f"{result['peak_rss_mb']:>8.1f}MB{failed}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"python": sys.version.split()[0], "seed": args.seed, "results": results}, f, indent=2)
+        print(f"[done] results written to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,425 @@
+"""
+Header-only tag reader for scans that need just artist, title, album and genre
+
+What it does:
+
+- Reads only the ID3v2 tag at the start of an mp3 (two preads: the 10-byte header, then the tag
+  itself), and the 128-byte ID3v1 trailer only when a field is still missing; no audio frames are
+  touched and no duration is computed
+- Decodes only TPE1/TIT2/TALB/TCON (TP1/TT2/TAL/TCO in ID3v2.2) from ID3v2.2, 2.3 and 2.4 tags,
+  handling unsynchronisation, extended headers, every text encoding and "(17)"-style genre references
+- For FLAC, steps over the metadata block headers and reads only the VORBIS_COMMENT block, stopping
+  before the first audio frame
+- For MP4/M4A, follows the atom headers straight down moov/udta/meta/ilst and reads only ilst;
+  mdat (the audio) is skipped by its size, never read
+- Gives the same answers as TinyTag: the first value of the first frame/comment/atom wins, numeric
+  genres are mapped to their ID3v1 names, and ID3v1 only fills fields the ID3v2 tag left empty
+- Is a --reader choice in genre_census.py and what tag-fixer.py parses with; --compare checks it
+  against TinyTag on a library
+
+Usage:
+    from fast_tags import read_tags
+    tags = read_tags("/path/to/song.mp3")   # Tags(artist=..., title=..., album=..., genre=...)
+
+    python3 fast_tags.py /path/to/music/files --compare   # report any file where TinyTag disagrees
+    python3 fast_tags.py /path/to/music/files --ext flac --ext m4a --compare
+"""
+
+import argparse
+import os
+import time
+from collections import namedtuple
+
+from walker import walk
+
+FIELDS = ("artist", "title", "album", "genre")
+
+Tags = namedtuple("Tags", FIELDS)
+
+# ID3v2.3/2.4 and ID3v2.2 frame ids for each field
+FRAMES = {
+    b"TPE1": "artist", b"TIT2": "title", b"TALB": "album", b"TCON": "genre",
+    b"TP1": "artist", b"TT2": "title", b"TAL": "album", b"TCO": "genre",
+}
+
+# ID3v1 genre numbers, with the Winamp extensions (the same list TinyTag uses)
+ID3V1_GENRES = (
+    'Blues', 'Classic Rock', 'Country', 'Dance', 'Disco', 'Funk', 'Grunge', 'Hip-Hop', 'Jazz', 'Metal',
+    'New Age', 'Oldies', 'Other', 'Pop', 'R&B', 'Rap', 'Reggae', 'Rock', 'Techno', 'Industrial',
+    'Alternative', 'Ska', 'Death Metal', 'Pranks', 'Soundtrack', 'Euro-Techno', 'Ambient', 'Trip-Hop',
+    'Vocal', 'Jazz+Funk', 'Fusion', 'Trance', 'Classical', 'Instrumental', 'Acid', 'House', 'Game',
+    'Sound Clip', 'Gospel', 'Noise', 'AlternRock', 'Bass', 'Soul', 'Punk', 'Space', 'Meditative',
+    'Instrumental Pop', 'Instrumental Rock', 'Ethnic', 'Gothic', 'Darkwave', 'Techno-Industrial',
+    'Electronic', 'Pop-Folk', 'Eurodance', 'Dream', 'Southern Rock', 'Comedy', 'Cult', 'Gangsta',
+    'Top 40', 'Christian Rap', 'Pop/Funk', 'Jungle', 'Native American', 'Cabaret', 'New Wave',
+    'Psychadelic', 'Rave', 'Showtunes', 'Trailer', 'Lo-Fi', 'Tribal', 'Acid Punk', 'Acid Jazz', 'Polka',
+    'Retro', 'Musical', 'Rock & Roll', 'Hard Rock',
+    'Folk', 'Folk-Rock', 'National Folk', 'Swing', 'Fast Fusion', 'Bebob', 'Latin', 'Revival', 'Celtic',
+    'Bluegrass', 'Avantgarde', 'Gothic Rock', 'Progressive Rock', 'Psychedelic Rock', 'Symphonic Rock',
+    'Slow Rock', 'Big Band', 'Chorus', 'Easy listening', 'Acoustic', 'Humour', 'Speech', 'Chanson',
+    'Opera', 'Chamber Music', 'Sonata', 'Symphony', 'Booty Bass', 'Primus', 'Porn Groove', 'Satire',
+    'Slow Jam', 'Club', 'Tango', 'Samba', 'Folklore', 'Ballad', 'Power Ballad', 'Rhythmic Soul',
+    'Freestyle', 'Duet', 'Punk Rock', 'Drum Solo', 'A capella', 'Euro-House', 'Dance Hall', 'Goa',
+    'Drum & Bass', 'Club-House', 'Hardcore Techno', 'Terror', 'Indie', 'BritPop', 'Afro-Punk',
+    'Polsk Punk', 'Beat', 'Christian Gangsta Rap', 'Heavy Metal', 'Black Metal', 'Contemporary Christian',
+    'Christian Rock',
+    'Merengue', 'Salsa', 'Thrash Metal', 'Anime', 'Jpop', 'Synthpop',
+    'Abstract', 'Art Rock', 'Baroque', 'Bhangra', 'Big Beat', 'Breakbeat', 'Chillout', 'Downtempo', 'Dub',
+    'EBM', 'Eclectic', 'Electro', 'Electroclash', 'Emo', 'Experimental', 'Garage', 'Illbient',
+    'Industro-Goth', 'Jam Band', 'Krautrock', 'Leftfield', 'Lounge', 'Math Rock', 'New Romantic',
+    'Nu-Breakz', 'Post-Punk', 'Post-Rock', 'Psytrance', 'Shoegaze', 'Space Rock', 'Trop Rock', 'World Music',
+    'Neoclassical', 'Audiobook', 'Audio Theatre', 'Neue Deutsche Welle', 'Podcast', 'Indie Rock', 'G-Funk',
+    'Dubstep', 'Garage Rock', 'Psybient',
+)
+
+# Vorbis comment keys (lowercased) for each field, as TinyTag maps them
+VORBIS_KEYS = {
+    b"artist": "artist", b"artists": "artist", b"author": "artist",
+    b"title": "title", b"album": "album", b"genre": "genre",
+}
+
+# iTunes ilst item atoms for each field; "gnre" holds an ID3v1 genre number plus one
+ILST_KEYS = {b"\xa9ART": "artist", b"\xa9nam": "title", b"\xa9alb": "album", b"\xa9gen": "genre"}
+
+FLAC_VORBIS_COMMENT = 4
+
+# tags bigger than this are almost all cover art; frames past it are not looked at
+MAX_TAG_BYTES = 16 * 1024 * 1024
+
+
+class UnsupportedFormat(ValueError):
+    pass
+
+
+def syncsafe(b):
+    return (b[0] & 0x7F) << 21 | (b[1] & 0x7F) << 14 | (b[2] & 0x7F) << 7 | (b[3] & 0x7F)
+
+
+def decode_text(data):
+    """an ID3v2 text frame body: an encoding byte, then the text; only the first value is kept"""
+    if not data:
+        return ""
+    encoding, text = data[0], data[1:]
+    if encoding == 1:
+        if text[:2] == b"\xfe\xff":
+            codec, text = "utf-16-be", text[2:]
+        else:
+            codec, text = "utf-16-le", text[2:] if text[:2] == b"\xff\xfe" else text
+        if len(text) % 2:
+            text = text[:-1]
+    elif encoding == 2:
+        codec = "utf-16-be"
+        if len(text) % 2:
+            text = text[:-1]
+    elif encoding == 3:
+        codec = "utf-8"
+    else:
+        codec = "latin-1"
+    value = text.decode(codec, "replace").strip("\x00")
+    return value.split("\x00", 1)[0]
+
+
+def genre_name(value):
+    """map "17" or "(17)..." to the ID3v1 genre name, as TinyTag does"""
+    genre_id = None
+    if value.isdecimal():
+        genre_id = int(value)
+    elif value.startswith("("):
+        end = value.find(")")
+        if end > 0 and value[1:end].isdecimal():
+            genre_id = int(value[1:end])
+    if genre_id is not None and genre_id < len(ID3V1_GENRES):
+        return ID3V1_GENRES[genre_id]
+    return value
+
+
+def parse_id3v2(tag, major, flags):
+    """the wanted fields from the body of an ID3v2 tag (everything after the 10-byte header)"""
+    found = {}
+    if flags & 0x80 and major < 4:
+        # whole-tag unsynchronisation (in 2.4 it is flagged per frame instead)
+        tag = tag.replace(b"\xff\x00", b"\xff")
+    pos = 0
+    if flags & 0x40 and major >= 3:
+        if major == 4:
+            pos = syncsafe(tag[:4])
+        else:
+            pos = 4 + int.from_bytes(tag[:4], "big")
+    id_len, header_len = (3, 6) if major == 2 else (4, 10)
+    end = len(tag)
+    while pos + header_len <= end and len(found) < 4:
+        header = tag[pos:pos + header_len]
+        frame_id = header[:id_len]
+        if frame_id[:1] == b"\x00":
+            break  # padding
+        if major == 2:
+            size = int.from_bytes(header[3:6], "big")
+            frame_flags = 0
+        elif major == 4:
+            size = syncsafe(header[4:8])
+            frame_flags = header[9]
+        else:
+            size = int.from_bytes(header[4:8], "big")
+            frame_flags = header[9]
+        pos += header_len
+        if size == 0 or pos + size > end:
+            break
+        field = FRAMES.get(frame_id)
+        if field is not None and field not in found:
+            body = tag[pos:pos + size]
+            skip = False
+            if major == 4:
+                if frame_flags & 0x0C:
+                    skip = True  # compressed or encrypted
+                if frame_flags & 0x40:
+                    body = body[1:]  # group id
+                if frame_flags & 0x01:
+                    body = body[4:]  # data length indicator
+                if frame_flags & 0x02 or flags & 0x80:
+                    body = body.replace(b"\xff\x00", b"\xff")
+            elif major == 3:
+                if frame_flags & 0xC0:
+                    skip = True
+                if frame_flags & 0x20:
+                    body = body[1:]
+            if not skip:
+                value = decode_text(body)
+                if value:
+                    found[field] = genre_name(value) if field == "genre" else value
+        pos += size
+    return found
+
+
+def parse_id3v1(trailer, found):
+    """fill the fields the ID3v2 tag didn't have from a 128-byte ID3v1 trailer"""
+    if trailer[:3] != b"TAG":
+        return
+    for field, start in (("title", 3), ("artist", 33), ("album", 63)):
+        if field not in found:
+            value = trailer[start:start + 30].decode("latin-1").strip("\x00")
+            if value:
+                found[field] = value
+    if "genre" not in found and trailer[127] < len(ID3V1_GENRES):
+        found["genre"] = ID3V1_GENRES[trailer[127]]
+
+
+def read_mp3(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        found = {}
+        header = os.pread(fd, 10, 0)
+        if len(header) == 10 and header[:3] == b"ID3":
+            size = min(syncsafe(header[6:10]), MAX_TAG_BYTES)
+            found = parse_id3v2(os.pread(fd, size, 10), header[3], header[5])
+        if len(found) < 4:
+            file_size = os.fstat(fd).st_size
+            if file_size >= 128:
+                parse_id3v1(os.pread(fd, 128, file_size - 128), found)
+    finally:
+        os.close(fd)
+    return Tags(*(found.get(field) for field in FIELDS))
+
+
+def parse_vorbis_comment(block, found):
+    """fill fields from a VORBIS_COMMENT block: a vendor string, then KEY=value comments"""
+    pos = 4 + int.from_bytes(block[:4], "little")
+    count = int.from_bytes(block[pos:pos + 4], "little")
+    pos += 4
+    for _ in range(count):
+        if pos + 4 > len(block):
+            break
+        length = int.from_bytes(block[pos:pos + 4], "little")
+        key, sep, value = block[pos + 4:pos + 4 + length].partition(b"=")
+        pos += 4 + length
+        field = VORBIS_KEYS.get(key.lower())
+        if sep and field is not None and field not in found:
+            value = value.decode("utf-8", "replace").split("\x00", 1)[0]
+            if value:
+                found[field] = value
+
+
+def read_flac(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        id3 = {}
+        pos = 0
+        header = os.pread(fd, 10, 0)
+        if header[:3] == b"ID3":
+            # some taggers put an ID3v2 tag in front of fLaC; it only fills what the comments leave empty
+            size = syncsafe(header[6:10])
+            id3 = parse_id3v2(os.pread(fd, min(size, MAX_TAG_BYTES), 10), header[3], header[5])
+            pos = 10 + size + (10 if header[5] & 0x10 else 0)
+        if os.pread(fd, 4, pos) != b"fLaC":
+            raise ValueError(f"not a FLAC file: {path}")
+        pos += 4
+        found = {}
+        while True:
+            block_header = os.pread(fd, 4, pos)
+            if len(block_header) < 4:
+                break
+            size = int.from_bytes(block_header[1:4], "big")
+            pos += 4
+            if block_header[0] & 0x7F == FLAC_VORBIS_COMMENT:
+                parse_vorbis_comment(os.pread(fd, size, pos), found)
+                break
+            if block_header[0] & 0x80:
+                break  # last metadata block; audio frames follow
+            pos += size
+    finally:
+        os.close(fd)
+    for field, value in id3.items():
+        found.setdefault(field, value)
+    return Tags(*(found.get(field) for field in FIELDS))
+
+
+def atoms(read, start, end):
+    """(type, body start, body end) for each MP4 atom between start and end; read(n, offset) gives bytes"""
+    while start + 8 <= end:
+        header = read(8, start)
+        if len(header) < 8:
+            break
+        size, header_len = int.from_bytes(header[:4], "big"), 8
+        if size == 1:
+            size, header_len = int.from_bytes(read(8, start + 8), "big"), 16
+        elif size == 0:
+            size = end - start  # runs to the end of the file
+        if size < header_len:
+            break
+        yield header[4:8], start + header_len, min(start + size, end)
+        start += size
+
+
+def mp4_data(data):
+    """the value of an ilst "data" atom body: utf-8 text or a big-endian integer"""
+    data_type = int.from_bytes(data[:4], "big")
+    value = data[8:]
+    if data_type == 1:
+        return value.decode("utf-8", "replace").split("\x00", 1)[0]
+    if data_type == 21 and len(value) in (1, 2, 4, 8):
+        return str(int.from_bytes(value, "big", signed=True))
+    return ""
+
+
+def parse_ilst(ilst, found):
+    def read(n, offset):
+        return ilst[offset:offset + n]
+
+    for kind, start, end in atoms(read, 0, len(ilst)):
+        if kind == b"----":
+            # freeform item: a "name" atom, then its values
+            name = None
+            for child, body, body_end in atoms(read, start, end):
+                if child == b"name":
+                    name = ilst[body + 4:body_end].lower()
+                elif child == b"data" and name == b"artists" and "artist" not in found:
+                    value = mp4_data(ilst[body:body_end])
+                    if value:
+                        found["artist"] = value
+            continue
+        if kind == b"gnre":
+            field = "genre"
+        else:
+            field = ILST_KEYS.get(kind)
+        if field is None or field in found:
+            continue
+        for child, body, body_end in atoms(read, start, end):
+            if child != b"data":
+                continue
+            if kind == b"gnre":
+                genre_id = int.from_bytes(ilst[body + 8:body_end], "big") - 1
+                value = ID3V1_GENRES[genre_id] if 0 <= genre_id < len(ID3V1_GENRES) else ""
+            else:
+                value = mp4_data(ilst[body:body_end])
+            if value:
+                found[field] = value
+                break
+
+
+def read_mp4(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        def read(n, offset):
+            return os.pread(fd, n, offset)
+
+        start, end = 0, os.fstat(fd).st_size
+        for wanted in (b"moov", b"udta", b"meta", b"ilst"):
+            for kind, body, body_end in atoms(read, start, end):
+                if kind == wanted:
+                    # meta is a full atom: a version/flags word comes before its children
+                    start, end = body + 4 if kind == b"meta" else body, body_end
+                    break
+            else:
+                return Tags(None, None, None, None)
+        found = {}
+        parse_ilst(os.pread(fd, end - start, start), found)
+    finally:
+        os.close(fd)
+    return Tags(*(found.get(field) for field in FIELDS))
+
+
+READERS = {
+    ".mp3": read_mp3,
+    ".flac": read_flac,
+    ".m4a": read_mp4,
+    ".mp4": read_mp4,
+    ".m4b": read_mp4,
+}
+
+
+def supports(path):
+    return os.path.splitext(path)[1].lower() in READERS
+
+
+def read_tags(path):
+    """Tags(artist, title, album, genre) for path; raises UnsupportedFormat for other file types"""
+    reader = READERS.get(os.path.splitext(path)[1].lower())
+    if reader is None:
+        raise UnsupportedFormat(f"no fast reader for {path}")
+    return reader(path)
+
+
+def compare(root, exts):
+    """
+    read every file with both readers and print the ones where they disagree,
+    then time each reader on its own over the (now cached) files
+    """
+    from tinytag import TinyTag
+
+    paths = [path for path in walk(root, exts=exts, sort=True) if supports(path)]
+    mismatched = 0
+    for path in paths:
+        fast = read_tags(path)
+        tag = TinyTag.get(path)
+        expected = Tags(*(getattr(tag, field, None) or None for field in FIELDS))
+        if fast != expected:
+            mismatched += 1
+            print(f"{path}\n\tfast:    {fast}\n\ttinytag: {expected}")
+
+    timings = {}
+    for name, reader in (("fast", read_tags), ("tinytag", TinyTag.get)):
+        started = time.perf_counter()
+        for path in paths:
+            reader(path)
+        timings[name] = time.perf_counter() - started
+    speedup = timings["tinytag"] / timings["fast"] if timings["fast"] else 0
+    print(f"[done] {len(paths)} files compared, {mismatched} mismatches; "
+          f"fast {timings['fast']:.2f}s, tinytag {timings['tinytag']:.2f}s ({speedup:.1f}x)")
+    return mismatched
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Header-only tag reader; print tags, or compare against TinyTag.")
+    ap.add_argument("root", help="A music file, or a folder to scan")
+    ap.add_argument("--ext", action="append", default=["mp3"], help="File extensions to include (default: mp3).")
+    ap.add_argument("--compare", action="store_true", help="Compare every file against TinyTag and report mismatches.")
+    args = ap.parse_args()
+
+    if args.compare:
+        raise SystemExit(1 if compare(args.root, args.ext) else 0)
+    paths = [args.root] if os.path.isfile(args.root) else walk(args.root, exts=args.ext, sort=True)
+    for path in paths:
+        print(f"{path}\t" + "\t".join(value or "" for value in read_tags(path)))
+
+
+if __name__ == "__main__":
+    main()
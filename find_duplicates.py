@@ -3,87 +3,368 @@ Identify duplicate music files based on artist, title and file length
 
 What it does:
 
-- Iterates over a collection of music files
-- Identifies duplicate files
-- Stores the list of duplicates in a local file
-- Iterates over the list of duplicates and gives the user the option to delete one or the other
+- Iterates over a collection of music files, reading each one once (optionally on several processes)
+- Identifies duplicate files: files are bucketed by length first, and only files that share a
+  length are compared on their normalized artist + title
+- In content mode, finds copies of the same rip regardless of tags: files are grouped by the size of
+  their audio payload, then by a hash of its first/last 64 KiB, and only files that still collide
+  get a full hash
+- In fuzzy mode, also finds copies whose tags differ a little ("Song (Remastered)", "Song - 2011 Remaster",
+  "Band, The", a second of length): titles and artists are normalized (see track_names.py), candidates
+  are blocked with MinHash LSH on their 3-grams (see minhash.py) and a length window, and only those
+  are scored; matches are reported as clusters with a score
+- Writes the duplicate groups to a JSON-lines report (--report) with the size, length, bitrate and
+  tags of every member; resolve_duplicates.py then decides which copy to keep without opening
+  any audio file again
 
 Usage:
     python3 find_duplicates.py /path/to/music/files
+    python3 find_duplicates.py /path/to/music/files --index /path/to/tags.sqlite
+    python3 find_duplicates.py /path/to/music/files --workers 16
+    python3 find_duplicates.py /path/to/music/files --mode content   # identical audio, ignoring tags
+    python3 find_duplicates.py /path/to/music/files --mode fuzzy --workers 16 --threshold 0.85
+    python3 find_duplicates.py /path/to/music/files --report /tmp/duplicates.jsonl
+    python3 find_duplicates.py /path/to/music/files --metrics duplicates.json   # stage timings, see metrics.py
 """
 
-import os
+import argparse
 import hashlib
-import sys
-
-from mutagen.mp3 import MP3
-from mutagen.id3 import ID3, ID3NoHeaderError, TPE1, TIT2
-from tinytag import TinyTag
-
-
-def get_file_hash(file_tuple):
-    hash_md5 = hashlib.md5(file_tuple)
-    print(hash_md5.hexdigest())
-    return hash_md5.hexdigest()
-
-def find_duplicate_files(directory):
-    file_hash_dict = {}
-    duplicate_files = []
-
-    for root, dirs, files in os.walk(directory):
-        for file_name in files:
-            if file_name.lower().endswith('.mp3'):
-                file_path = os.path.join(root, file_name)
-                tag = TinyTag.get(file_path)
-                audio = MP3(file_path, ID3=ID3)
-                print(f"Artist: {tag.artist}, Title: {tag.title}, Length: {int(audio.info.length)}")
-
-                file_tuple = (tag.artist, tag.title, int(audio.info.length))
-                file_hash = get_file_hash(str(file_tuple).encode())
-
-                if file_hash in file_hash_dict:
-                    duplicate_files.append((file_path, file_hash_dict[file_hash]))
-                else:
-                    file_hash_dict[file_hash] = file_path
-    return duplicate_files
-
-def fix_duplicates(directory, duplicates):
-    deletes = []
-    if duplicates:
-        for line in duplicates:
-            ft = eval(line.strip())
-            file_1 = directory + ft[0]
-            file_2 = directory + ft[1]
-            try:
-                audio_1 = MP3(file_1, ID3=ID3)
-                audio_2 = MP3(file_2, ID3=ID3)
-                tag_1 = TinyTag.get(file_1)
-                tag_2 = TinyTag.get(file_1)
-                print(f"File 1: Artist: {tag_1.artist}, Song: {tag_1.title}, Genre: {tag_1.genre}, Length: {int(audio_1.info.length)} {ft[0]} ")
-                print(f"File 2: Artist: {tag_2.artist}, Song: {tag_2.title}, Genre: {tag_2.genre}, Length: {int(audio_2.info.length)} {ft[1]} ")
-                which_delete = input("Delete 1, 2, or neither?")
-                if which_delete == '1':
-                    deletes.append(file_1)
-                elif which_delete == '2':
-                    deletes.append(file_2)
-                else:
-                    pass
-                print(deletes)
-                print('\n')
-            except Exception as e:
-                print(e)
-                pass
+import json
+import os
+from collections import defaultdict, namedtuple
+
+from metrics import add_metrics_arguments, instrumented, metrics
+from parallel import chunked, ordered_map
+from tag_index import get_tags, open_index
+from track_names import normalize_artist, title_key
+from walker import walk
+
+
+# everything the report needs about a file, so resolve_duplicates.py never has to open it
+Track = namedtuple("Track", ("path", "size", "artist", "title", "album", "genre", "duration", "bitrate"))
+
+def read_track(file_path, index=None):
+    """parse a file once: the tags, length and bitrate all come from the same read"""
+    try:
+        with metrics.stage("parse"):
+            tag = get_tags(file_path, index)
+            size = os.path.getsize(file_path)
+    except Exception as e:
+        print(f"Error reading {file_path}: {e}")
+        metrics.count("read_errors")
+        return None
+    return Track(file_path, size, tag.artist, tag.title, tag.album, tag.genre, tag.duration or 0, tag.bitrate or 0)
+
+# Per-process state for --workers; set up once by init_worker
+_worker_index = None
+
+def init_worker(index_path):
+    global _worker_index
+    metrics.reset()
+    _worker_index = open_index(index_path)
+
+def read_chunk(paths):
+    tracks = [read_track(path, _worker_index) for path in paths]
+    if _worker_index is not None:
+        _worker_index.commit()
+    # the worker's timings travel back with its results
+    return tracks, metrics.snapshot(reset=True)
+
+def read_tracks(directory, index=None, index_path=None, workers=1, chunk_size=256):
+    # absolute paths, so the report still means the same files when read from another folder
+    paths = metrics.timed("walk", walk(os.path.abspath(directory), exts={"mp3"}))
+    if workers > 1:
+        chunks = ordered_map(read_chunk, chunked(paths, chunk_size), workers,
+                             processes=True, initializer=init_worker, initargs=(index_path,))
+    else:
+        chunks = (([read_track(path, index)], None) for path in paths)
+    total = 0
+    for chunk, chunk_metrics in chunks:
+        if chunk_metrics is not None:
+            metrics.merge(chunk_metrics)
+        for track in chunk:
+            if track is not None:
+                total += 1
+                metrics.count("files")
+                yield track
+        if workers > 1:
+            print(f"Scanned {total} files")
+
+def normalize_key(artist, title):
+    return " ".join((artist or "").casefold().split()), " ".join((title or "").casefold().split())
+
+def find_duplicate_files(directory, index=None, index_path=None, workers=1, chunk_size=256):
+    """
+    group tracks by length first, then by normalized artist + title within each
+    length bucket. returns groups of Tracks, first seen first, in the walk order
+    of their first file
+    """
+    by_length = defaultdict(list)
+    for seq, track in enumerate(read_tracks(directory, index, index_path, workers, chunk_size)):
+        # files without a title or a length can't be told apart from other songs; leave them out
+        if not normalize_key(track.artist, track.title)[1] or track.duration <= 0:
+            metrics.count("untitled_skipped")
+            continue
+        by_length[int(track.duration)].append((seq, track))
+
+    groups = []
+    for bucket in by_length.values():
+        if len(bucket) < 2:
+            continue
+        same_song = defaultdict(list)
+        for seq, track in bucket:
+            same_song[normalize_key(track.artist, track.title)].append((seq, track))
+        groups.extend(members for members in same_song.values() if len(members) > 1)
+    groups.sort(key=lambda members: members[0][0])
+    return [[track for seq, track in members] for members in groups]
+
+# Fuzzy mode: near-duplicate tags
+FUZZY_THRESHOLD = 0.8
+LENGTH_TOLERANCE = 1.0
+# how much of the score comes from the title; the rest is the artist
+TITLE_WEIGHT = 0.6
+
+def window_pairs(group, lengths, tolerance):
+    """the pairs of indexes in a candidate group whose lengths are within tolerance of each other"""
+    group = sorted(group.tolist(), key=lambda i: lengths[i])
+    for n, a in enumerate(group):
+        for b in group[n + 1:]:
+            if lengths[b] - lengths[a] > tolerance:
+                break
+            yield (a, b) if a < b else (b, a)
+
+def find_fuzzy_duplicates(directory, index=None, index_path=None, workers=1, chunk_size=256,
+                          threshold=FUZZY_THRESHOLD, tolerance=LENGTH_TOLERANCE):
+    """
+    near-duplicate search: MinHash LSH over the normalized "artist|title" blocks
+    the candidates, a length window narrows them, and only those pairs are scored.
+    pairs scoring at least threshold are joined into clusters; returns
+    (weakest link score, [Tracks in walk order]) per cluster, in walk order
+    """
+    from minhash import candidate_groups, grams, jaccard, signatures
+
+    tracks = []
+    for track in read_tracks(directory, index, index_path, workers, chunk_size):
+        name, markers = title_key(track.title)
+        tracks.append((track, normalize_artist(track.artist), name, markers, float(track.duration)))
+    print(f"Read {len(tracks)} files")
+    if not tracks:
+        return []
+
+    with metrics.stage("minhash"):
+        sig = signatures([f"{artist}|{title}" for _, artist, title, _, _ in tracks])
+    lengths = [t[4] for t in tracks]
+    # files without a title or a length can't be told apart from other songs; leave them out
+    usable = [bool(t[2]) and t[4] > 0 for t in tracks]
+
+    with metrics.stage("block"):
+        candidates = set()
+        for group in candidate_groups(sig, mask=usable):
+            candidates.update(window_pairs(group, lengths, tolerance))
+    metrics.count("candidate_pairs", len(candidates))
+    print(f"{len(candidates)} candidate pairs")
+
+    gram_sets = {}
+    def similarity(x, y):
+        gx = gram_sets.get(x) or gram_sets.setdefault(x, grams(x))
+        gy = gram_sets.get(y) or gram_sets.setdefault(y, grams(y))
+        return jaccard(gx, gy)
+
+    parent = list(range(len(tracks)))
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    edges = []
+    with metrics.stage("score"):
+        for a, b in sorted(candidates):
+            _, artist_a, title_a, markers_a, _ = tracks[a]
+            _, artist_b, title_b, markers_b, _ = tracks[b]
+            if markers_a != markers_b:
+                continue  # e.g. "Song (Live)" and "Song" are different recordings
+            score = TITLE_WEIGHT * similarity(title_a, title_b) + (1 - TITLE_WEIGHT) * similarity(artist_a, artist_b)
+            if score >= threshold:
+                edges.append((a, b, score))
+                parent[find(b)] = find(a)
+
+    weakest = {}
+    for a, b, score in edges:
+        root = find(a)
+        weakest[root] = min(score, weakest.get(root, 1.0))
+    # members are added in walk order, so clusters come out in the walk order of their first file
+    clusters = defaultdict(list)
+    for i in range(len(tracks)):
+        root = find(i)
+        if root in weakest:
+            clusters[root].append(tracks[i][0])
+    return [(weakest[root], members) for root, members in clusters.items()]
+
+# Content mode: compare only the audio payload, ignoring the ID3v2 header, APEv2 and ID3v1 trailers
+EDGE_BYTES = 64 * 1024
+READ_BLOCK = 1024 * 1024
+
+def audio_payload_range(file_path):
+    """return (start, end) byte offsets of the audio between the tag blocks"""
+    with open(file_path, "rb") as f:
+        end = f.seek(0, os.SEEK_END)
+        start = 0
+        # ID3v2 header(s): 10-byte header + syncsafe size, plus a 10-byte footer if flagged
+        while True:
+            f.seek(start)
+            header = f.read(10)
+            if len(header) < 10 or header[:3] != b"ID3":
+                break
+            size = (header[6] & 0x7F) << 21 | (header[7] & 0x7F) << 14 | (header[8] & 0x7F) << 7 | (header[9] & 0x7F)
+            start += 10 + size + (10 if header[5] & 0x10 else 0)
+        if end - start >= 128:
+            f.seek(end - 128)
+            if f.read(3) == b"TAG":
+                end -= 128
+        if end - start >= 32:
+            f.seek(end - 32)
+            footer = f.read(32)
+            if footer[:8] == b"APETAGEX":
+                size = int.from_bytes(footer[12:16], "little")
+                flags = int.from_bytes(footer[20:24], "little")
+                end -= size + (32 if flags & 0x80000000 else 0)
+    return start, max(start, end)
+
+def hash_payload(file_path, start, end, edges_only=False):
+    digest = hashlib.blake2b(digest_size=20)
+    with metrics.stage("hash_edges" if edges_only else "hash"), open(file_path, "rb") as f:
+        if edges_only and end - start > 2 * EDGE_BYTES:
+            f.seek(start)
+            digest.update(f.read(EDGE_BYTES))
+            f.seek(end - EDGE_BYTES)
+            digest.update(f.read(EDGE_BYTES))
+        else:
+            f.seek(start)
+            remaining = end - start
+            while remaining > 0:
+                block = f.read(min(READ_BLOCK, remaining))
+                if not block:
+                    break
+                digest.update(block)
+                remaining -= len(block)
+    return digest.hexdigest()
+
+def _payload_entry(file_path):
+    try:
+        with metrics.stage("parse"):
+            return file_path, audio_payload_range(file_path)
+    except OSError as e:
+        print(f"Error reading {file_path}: {e}")
+        return file_path, None
+
+def _split_groups(groups, key_fn, workers):
+    """re-group every group of 2+ members on key_fn, computed on a thread pool"""
+    members = [m for group in groups if len(group) > 1 for m in group]
+    keys = ordered_map(key_fn, members, workers)
+    regrouped = defaultdict(list)
+    for member, key in zip(members, keys):
+        regrouped[key].append(member)
+    return [group for group in regrouped.values() if len(group) > 1]
+
+def find_content_duplicates(directory, workers=8):
+    """
+    staged exact-duplicate search on the audio payload:
+    1. group by payload size (reads only the tag headers/trailers)
+    2. hash the first and last 64 KiB of the payload for files that share a size
+    3. stream a full hash only for files that still collide
+    returns groups of paths, first seen first, in the walk order of their first file
+    """
+    by_size = defaultdict(list)
+    # absolute paths, so the report still means the same files when read from another folder
+    paths = metrics.timed("walk", walk(os.path.abspath(directory), exts={"mp3"}))
+    for seq, (file_path, payload) in enumerate(ordered_map(_payload_entry, paths, workers)):
+        if payload is not None:
+            start, end = payload
+            # tags and nothing else: every such file would hash the same
+            if end <= start:
+                metrics.count("empty_payload_skipped")
+                continue
+            by_size[end - start].append((seq, file_path, start, end))
+    groups = [g for g in by_size.values() if len(g) > 1]
+    print(f"Stage 1: {sum(len(g) for g in groups)} files share a payload size")
+
+    # the size stays in the key: payloads of different sizes can share their first and last 64 KiB
+    groups = _split_groups(groups, lambda m: (m[3] - m[2], hash_payload(m[1], m[2], m[3], edges_only=True)), workers)
+    print(f"Stage 2: {sum(len(g) for g in groups)} files share head/tail hashes")
+
+    groups = _split_groups(groups, lambda m: (m[3] - m[2], hash_payload(m[1], m[2], m[3])), workers)
+    print(f"Stage 3: {sum(len(g) for g in groups)} files have identical audio")
+
+    for group in groups:
+        group.sort()
+    groups.sort()
+    return [[file_path for seq, file_path, start, end in group] for group in groups]
+
+def describe(paths, workers=8):
+    """Tracks for content-mode duplicates, whose tags the scan itself never needed"""
+    tracks = ordered_map(read_track, paths, workers)
+    return [track or Track(path, os.path.getsize(path), None, None, None, None, 0, 0)
+            for path, track in zip(paths, tracks)]
+
+def write_report(report_path, mode, root, groups):
+    """
+    one JSON line per group with the path, size, length, bitrate and tags of
+    every member (first seen first), so resolving needs no second read
+    """
+    tmp = report_path + ".tmp"
+    with metrics.stage("report"), open(tmp, "w", encoding="utf-8") as f:
+        for n, (score, members) in enumerate(groups, 1):
+            f.write(json.dumps({"group": n, "mode": mode, "score": round(score, 3), "root": root,
+                                "members": [track._asdict() for track in members]}) + "\n")
+    os.replace(tmp, report_path)
 
 def main():
-    directory = sys.argv[1]
-    duplicates = find_duplicate_files(directory)
-    if duplicates:
-        print("Duplicate files found:")
-        for file1, file2 in duplicates:
-            print(f"File 1: {file1}")
-            print(f"File 2: {file2}")
-            print("-" * 30)
-    fix_duplicates(directory, duplicates)
+    ap = argparse.ArgumentParser(description="Identify duplicate music files based on artist, title and file length.")
+    ap.add_argument("directory", help="Root folder (e.g., /path/to/music/files)")
+    ap.add_argument("--mode", choices=["tags", "content", "fuzzy"], default="tags",
+                    help="tags: same artist/title/length; content: identical audio payload, whatever the tags say; "
+                         "fuzzy: similar artist/title once release noise is stripped, length within --length-tolerance")
+    ap.add_argument("--index", help="Tag index database (see tag_index.py)")
+    ap.add_argument("--workers", type=int, default=1, help="Parse tags on N processes, or N concurrent reads in content mode (0 = one per CPU, default: 1).")
+    ap.add_argument("--chunk-size", type=int, default=256, help="Files per batch handed to a worker (default: 256).")
+    ap.add_argument("--threshold", type=float, default=FUZZY_THRESHOLD, help=f"Fuzzy mode: lowest score (0-1) that counts as a match (default: {FUZZY_THRESHOLD}).")
+    ap.add_argument("--length-tolerance", type=float, default=LENGTH_TOLERANCE, help=f"Fuzzy mode: most seconds two copies' lengths may differ by (default: {LENGTH_TOLERANCE}).")
+    ap.add_argument("--report", default="duplicates.jsonl", help="Where to write the duplicate groups, one JSON object per line (default: duplicates.jsonl).")
+    add_metrics_arguments(ap)
+    args = ap.parse_args()
+    with instrumented(args):
+        scan(args)
+
+def scan(args):
+    directory = args.directory
+    workers = args.workers or os.cpu_count() or 1
+
+    if args.mode == "content":
+        groups = find_content_duplicates(directory, max(workers, 8))
+        groups = [(1.0, describe(paths, max(workers, 8))) for paths in groups]
+    else:
+        index = open_index(args.index) if workers == 1 else None
+        if args.mode == "fuzzy":
+            groups = find_fuzzy_duplicates(directory, index, args.index, workers, args.chunk_size,
+                                           args.threshold, args.length_tolerance)
+        else:
+            groups = [(1.0, members) for members in
+                      find_duplicate_files(directory, index, args.index, workers, args.chunk_size)]
+        if index is not None:
+            index.close()
+
+    duplicates = sum(len(members) - 1 for score, members in groups)
+    metrics.count("groups", len(groups))
+    metrics.count("duplicates", duplicates)
+    for n, (score, members) in enumerate(groups, 1):
+        print(f"Group {n} ({len(members)} files{f', score {score:.2f}' if args.mode == 'fuzzy' else ''}):")
+        for track in members:
+            print(f"    {track.path}")
+    write_report(args.report, args.mode, os.path.abspath(directory), groups)
+    print(f"[done] {len(groups)} groups, {duplicates} duplicate files; report written to {args.report}")
+    if groups:
+        print(f"[info] Review and resolve them with: python3 resolve_duplicates.py {args.report} --dry-run")
 
 if __name__ == "__main__":
     main()
@@ -17,96 +17,88 @@ Three options:
 
   Usage:
       python3 find_genre.py /path/to/music/files
+
+Pass --index /path/to/tags.sqlite to read tags from the tag index (see tag_index.py).
+On a NAS, pass --io-depth 32 to read the next files' tags while you answer the prompts.
+Tag edits are written in the background; pass --defer-writes to write them all in one batch at the end.
 """
 
-import os
-import sys
-import time
+import argparse
 
-from mutagen.mp3 import MP3
-from mutagen.id3 import ID3, ID3NoHeaderError, ID3NoHeaderError, ID3, ID3NoHeaderError, TCON, TPE1
-from tinytag import TinyTag
+from genres import is_valid_genre
+from tag_index import open_index, prefetch_tags
+from tag_writer import TagWriteQueue, write_id3_frames
+from walker import walk
 
-valid_genres = ['Rock', 'Soundtrack', 'Alternative', 'Christmas', 'Pop', 'Electronic', 'Folk', 'Disney', 'Indie', 'Jazz', 'Ambient', 'R&B', 'Punk', 'Country', 'Goth', 'Hip Hop', 'Dance', 'Blues', 'Classical', 'Mashup', 'Vocal', 'Industrial', 'Classic Rock', 'Indie Rock', 'Spoken Word', 'Disco', 'Metal', 'New Wave', 'Indie Pop', 'Halloween', 'World', 'Soul', 'Folk Pop', 'Experimental', 'House', 'Funk', 'Psychedelic Rock', 'Bluegrass', 'Synthpop', 'Progressive Rock', 'Grunge', 'Hard Rock', 'Exotica', 'Rap', 'Reggae', "Children's Music", 'French Pop', 'Lounge', 'Water Music', 'Rockabilly', 'Easy listening', 'Ska', 'Meditation', 'Lo-Fi', 'Post Punk', 'Acoustic', 'Comedy', 'Trip Hop', 'Dream Pop', 'Easy Listening', 'New Age', 'Garage Rock', 'Electroswing', 'Latin', 'Surf Rock', 'Celtic', 'Glam', 'Live', 'Space Age', 'Noise', 'Novelty', 'NerdCore', 'Protest', 'Choral', 'Southern Rock', 'Jam', 'Samba', 'Yacht Rock', 'Doo Wop', 'BritPop', 'Acappella', 'Barbershop', 'Soft Rock', 'Big Band', 'Swing', 'Zydeco', 'Baille Funk', 'Instrumental', 'Sports', 'Dark Cabaret', 'Emo', 'Gospel', 'Broadway', 'Honky Tonk', 'Flamenco', 'J-Pop', 'Bossa Nova', 'Polka', 'Cabaret', 'Christian', 'Swing Revival', 'Hawaiian', 'K-Pop', 'Ragtime', 'Marching Band', 'Advertisement', 'Calypso', 'Bhangra', 'Salsa', '50s', '60s', '70s', '80s', '90s']
 
-def add_genre_to_mp3(file_path, genre):
+def add_genre_to_mp3(file_path, genre, writes=None):
+    if writes is not None:
+        writes.submit(file_path, genre=genre)
+        return
     try:
-        # Load the MP3 file
-        audio = MP3(file_path, ID3=ID3)
-        # Check if ID3 tags exist, if not, create them
-        if audio.tags is None:
-            audio.add_tags()
-        # Set the genre
-        audio.tags.add(TCON(encoding=3, text=genre))
-        audio.save()
+        write_id3_frames(file_path, genre=genre)
         print(f'Added genre "{genre}" to {file_path}')
-    except ID3NoHeaderError:
-        print(f'No ID3 header found in {file_path}.')
     except Exception as e:
         print(f'Error processing {file_path}: {e}')
 
-def check_mp3_genre(directory):
-    for root, dirs, files in os.walk(directory):
-        for file in files:
-            if file.lower().endswith('.mp3'):
-                file_path = os.path.join(root, file)
-                tag = TinyTag.get(file_path)
-
-                print('\n')
-                print(file_path)
-                try:
-                    song_string = f"Artist: {tag.artist}\n Title: {tag.title}\n Album: {tag.album}\n Genre: {tag.genre}"
-                except Exception as e:
-                    song_string = f"Artist: {tag.artist}, Title: {tag.title}, Genre: {tag.genre}"
-                    print("No Album", e)
-                print(song_string)
-
-                if tag.genre in valid_genres:
-                    proceed = input(f"Is the genre {tag.genre.upper()} ok for {file_path}? (n or enter for y): ")
-                    if proceed == 'n':
-                        genre = input(f"Enter a new genre for {file_path}: ")
-                        print(f"New genre is {genre}")
-                        add_genre_to_mp3(file_path, genre)
-                else:
-                    genre = input(f"{tag.genre} is not valid, enter a new one: ")
-                    print(f"New genre is {genre}")
-                    add_genre_to_mp3(file_path, genre)
-
-
-def find_specific_genre(directory, genre):
+def check_mp3_genre(directory, index=None, writes=None, io_depth=0):
+    for file_path, tag in prefetch_tags(walk(directory, exts={"mp3"}), index, io_depth):
+        print('\n')
+        print(file_path)
+        try:
+            song_string = f"Artist: {tag.artist}\n Title: {tag.title}\n Album: {tag.album}\n Genre: {tag.genre}"
+        except Exception as e:
+            song_string = f"Artist: {tag.artist}, Title: {tag.title}, Genre: {tag.genre}"
+            print("No Album", e)
+        print(song_string)
+
+        if is_valid_genre(tag.genre):
+            proceed = input(f"Is the genre {tag.genre.upper()} ok for {file_path}? (n or enter for y): ")
+            if proceed == 'n':
+                genre = input(f"Enter a new genre for {file_path}: ")
+                print(f"New genre is {genre}")
+                add_genre_to_mp3(file_path, genre, writes)
+        else:
+            genre = input(f"{tag.genre} is not valid, enter a new one: ")
+            print(f"New genre is {genre}")
+            add_genre_to_mp3(file_path, genre, writes)
+
+
+def find_specific_genre(directory, genre, index=None, io_depth=0):
     specifics = []
-    for root, dirs, files in os.walk(directory):
-        for file in files:
-            if file.lower().endswith('.mp3'):
-                file_path = os.path.join(root, file)
-                tag = TinyTag.get(file_path)
-
-                if tag.genre == genre:
-                    print(f"Artist: {tag.artist}, Title: {tag.title}, Genre: {tag.genre}")
-                    specifics.append(file_path)
+    for file_path, tag in prefetch_tags(walk(directory, exts={"mp3"}), index, io_depth):
+        if tag.genre == genre:
+            print(f"Artist: {tag.artist}, Title: {tag.title}, Genre: {tag.genre}")
+            specifics.append(file_path)
     print(specifics)
 
-def list_genres(directory):
-    for root, dirs, files in os.walk(directory):
-        files.sort()
-        for file in files:
-            if file.lower().endswith('.mp3'):
-                file_path = os.path.join(root, file)
-                tag = TinyTag.get(file_path)
-
-                print('\n')
-                song_string = f"Artist: {tag.artist}\n Title: {tag.title}\n Album: {tag.album}\n Genre: {tag.genre}"
-                print(song_string)
+def list_genres(directory, index=None, io_depth=0):
+    for file_path, tag in prefetch_tags(walk(directory, exts={"mp3"}, sort=True), index, io_depth):
+        print('\n')
+        song_string = f"Artist: {tag.artist}\n Title: {tag.title}\n Album: {tag.album}\n Genre: {tag.genre}"
+        print(song_string)
 
 def main():
-    directory = sys.argv[1]
-
-    check_mp3_genre(directory)
+    ap = argparse.ArgumentParser(description="Identify and optionally change genre tags on music files.")
+    ap.add_argument("directory", help="Root folder (e.g., /path/to/music/files)")
+    ap.add_argument("--index", help="Tag index database (see tag_index.py)")
+    ap.add_argument("--defer-writes", action="store_true", help="Collect all edits and write them in one parallel batch at the end.")
+    ap.add_argument("--io-depth", type=int, default=0, help="Header reads kept in flight at once, for libraries on a NAS (default: 0, one at a time).")
+    ap.add_argument("--write-workers", type=int, default=4, help="Threads writing tags in the background (default: 4).")
+    args = ap.parse_args()
+    directory = args.directory
+    index = open_index(args.index)
+
+    with TagWriteQueue(args.write_workers, defer=args.defer_writes) as writes:
+        check_mp3_genre(directory, index, writes, args.io_depth)
 
     # specific_genre = sys.argv[2]
-    # find_specific_genre(directory, specific_genre)
+    # find_specific_genre(directory, specific_genre, index, args.io_depth)
+
+    # list_genres(directory, index, args.io_depth)
 
-    # list_genres(directory)
+    if index is not None:
+        index.close()
 
 if __name__ == "__main__":
     main()
@@ -9,14 +9,15 @@ Usage:
 import os
 import sys
 
+from walker import walk
+
 def find_non_mp3(directory):
     allnon = []
-    for root, dirs, files in os.walk(directory):
-        for file in files:
-            if not file.lower().endswith('.mp3'):
-                file_path = os.path.join(root, file)
-                print(file_path)
-                allnon.append(file_path)
+    for file_path in walk(directory):
+        # the extension of the file itself; walk's exclude would also skip a folder named "x.mp3"
+        if os.path.splitext(file_path)[1].lower() != '.mp3':
+            print(file_path)
+            allnon.append(file_path)
     return allnon
 
 def main():
@@ -3,87 +3,239 @@ Correct genre tags using the discogs API to identify genre by artist
 
 Usage:
     python3 fix_genre.py /path/to/music/files discogs_token
+    python3 fix_genre.py /path/to/music/files discogs_token --defer-writes
+    python3 fix_genre.py /path/to/music/files discogs_token --metrics fix_genre.json   # stage timings, see metrics.py
+
+Tag edits are written in the background; --defer-writes holds them and writes each pass's edits in
+one batch when the pass ends, so the second pass reads the genres the first one set.
+
+Discogs suggestions are fetched in the background, ahead of the file being prompted for, within a
+requests-per-minute budget (--requests-per-minute). Each distinct artist + title is looked up once,
+and results (empty ones included) are cached on disk, so files already seen cost no API calls next
+run. A lookup that fails is not cached, so it is tried again next run.
 """
 
-import os
-import sys
+import argparse
+import threading
+import time
 
 import discogs_client
-from mutagen.mp3 import MP3
-from mutagen.id3 import ID3, ID3NoHeaderError, ID3NoHeaderError, ID3, ID3NoHeaderError, TCON
 from tinytag import TinyTag
 
-valid_genres = ['Rock', 'Soundtrack', 'Alternative', 'Christmas', 'Pop', 'Electronic', 'Folk', 'Disney', 'Indie', 'Jazz', 'Ambient', 'R&B', 'Punk', 'Country', 'Goth', 'Hip Hop', 'Dance', 'Blues', 'Classical', 'Mashup', 'Vocal', 'Industrial', 'Classic Rock', 'Indie Rock', 'Spoken Word', 'Disco', 'Metal', 'New Wave', 'Hip-Hop', 'Indie Pop', 'Halloween', 'World', 'Soul', 'Folk Pop', 'Experimental', 'House', 'Funk', 'Psychedelic Rock', 'Bluegrass', 'Synthpop', 'Progressive Rock', 'Grunge', 'Hard Rock', 'Exotica', 'Rap', 'Reggae', "Children's Music", 'French Pop', 'Lounge', 'Water Music', 'Rockabilly', 'Easy listening', 'Ska', 'Meditation', 'Lo-Fi', 'Post Punk', 'Acoustic', 'Comedy', 'Trip Hop', 'Dream Pop', 'Easy Listening', 'New Age', 'Garage Rock', 'Electroswing', 'Latin', 'Surf Rock', 'Celtic', 'Glam', 'Live', 'Space Age', 'Noise', 'Novelty', 'NerdCore', 'Protest', 'Choral', 'Southern Rock', 'Jam', 'Samba', 'Yacht Rock', 'Doo Wop', 'BritPop', 'Acappella', 'Barbershop', 'Soft Rock', 'Big Band', 'Swing', 'Zydeco', 'Baille Funk', 'Instrumental', 'Sports', 'Dark Cabaret', 'Emo', 'Gospel', 'Broadway', 'Honky Tonk', 'Flamenco', 'J-Pop', 'Bossa Nova', 'Polka', 'Cabaret', 'Christian', 'Swing Revival', 'Hawaiian', 'K-Pop', 'Ragtime', 'Marching Band', 'Advertisement', 'Calypso', 'Bhangra', 'Salsa', '50s', '60s', '70s', '80s', '90s']
+from genres import is_valid_genre
+from lookup_cache import DAY, DEFAULT_CACHE, MISS, LookupCache
+from metrics import add_metrics_arguments, instrumented, metrics
+from tag_writer import TagWriteQueue, write_id3_frames
+from walker import walk
+
 
-def replace_mp3_genre(file_path, genre):
+def replace_mp3_genre(file_path, genre, writes=None):
+    if writes is not None:
+        writes.submit(file_path, genre=genre)
+        return
     try:
-        # Load the MP3 file
-        audio = MP3(file_path, ID3=ID3)
-        # Check if ID3 tags exist, if not, create them
-        if audio.tags is None:
-            audio.add_tags()
-        # Set the genre
-        audio.tags.add(TCON(encoding=3, text=genre))
-        audio.save()
+        write_id3_frames(file_path, genre=genre)
         print(f'Added genre "{genre}" to {file_path}')
-    except ID3NoHeaderError:
-        print(f'No ID3 header found in {file_path}.')
     except Exception as e:
         print(f'Error processing {file_path}: {e}')
 
-def find_mp3_genre(directory, discogs):
-    for root, dirs, files in os.walk(directory):
-        for file in files:
-            if file.lower().endswith('.mp3'):
-                file_path = os.path.join(root, file)
-                tag = TinyTag.get(file_path)
-
-                print(f"{tag.title}, Artist: {tag.artist}, Tag: {tag.genre}")
-                try:
-                    results = discogs.search(tag.title, artist=tag.artist, type='release')
-                    suggested_genres = results[0].genres
-                    suggested_styles = results[0].styles
-                    discog_suggestion = suggested_genres + suggested_styles
-                    print(f"Discogs suggests using one of these: {discog_suggestion}")
-                except Exception as e:
-                    print(e)
-
-                if tag.genre:
-                    if tag.genre not in valid_genres:
-                        genre = input(f"Enter the genre for {file_path}: ")
-                        print(f"Changing genre to: {genre}")
-                        replace_mp3_genre(file_path, genre)
-                    else:
-                        proceed = input(f"Is the genre {tag.genre.upper()} ok for {file_path}? (n or enter for y): ")
-                        if proceed == 'n':
-                            genre = input(f"Enter a new genre for {file_path}: ")
-                            print(f"New genre is {genre}")
-                            replace_mp3_genre(file_path, genre)
-                            print(f"Adding genre: {genre}")
-                else:
-                    genre = input(f"Enter the genre for {file_path}: ")
-                    print(f"Changing genre to: {genre}")
-                    replace_mp3_genre(file_path, genre)
-
-
-def change_mp3_genre(directory):
-    for root, dirs, files in os.walk(directory):
-        for file in files:
-            if file.lower().endswith('.mp3'):
-                file_path = os.path.join(root, file)
-                tag = TinyTag.get(file_path)
-
-                print(f"{tag.title}, Artist: {tag.artist}, Tag: {tag.genre}")
-                genre = input(f"Enter the new genre for {file_path}: ")
+def suggestion_key(artist, title):
+    return " ".join((artist or "").casefold().split()) + "\x1f" + " ".join((title or "").casefold().split())
+
+def discogs_search(discogs):
+    """a search function for DiscogsScheduler: the genres + styles of the best release match"""
+    def search(artist, title):
+        results = discogs.search(title, artist=artist, type='release')
+        try:
+            best = results[0]
+        except IndexError:
+            return None
+        return best.genres + best.styles
+    return search
+
+class RateLimiter:
+    def __init__(self, per_minute):
+        self.interval = 60.0 / per_minute
+        self.next_at = 0.0
+        self.lock = threading.Lock()
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            delay = max(0.0, self.next_at - now)
+            self.next_at = max(now, self.next_at) + self.interval
+        if delay:
+            time.sleep(delay)
+
+class DiscogsScheduler:
+    """
+    fetches Discogs suggestions on a background thread, a bounded distance ahead
+    of the file being prompted for, within a requests-per-minute budget.
+    each distinct (artist, title) is looked up once; results, empty ones too,
+    are kept in the lookup cache, so later runs make no calls for tracks already
+    seen. failures are only kept for this run
+    """
+    def __init__(self, search, cache=None, per_minute=25, lookahead=20):
+        self.search = search
+        self.cache = cache
+        self.limiter = RateLimiter(per_minute)
+        self.lookahead = lookahead
+        self.todo = []
+        self.position = {}
+        self.results = {}
+        self.cursor = 0
+        self.closed = False
+        self.stopped = False
+        self.requests_made = 0
+        self.cond = threading.Condition()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self, pairs):
+        for artist, title in pairs:
+            key = suggestion_key(artist, title)
+            if key not in self.position:
+                self.position[key] = len(self.todo)
+                self.todo.append((key, artist, title))
+        self.thread.start()
+
+    def _lookup(self, key, artist, title):
+        value = self.cache.get("discogs", key) if self.cache is not None else MISS
+        if value is not MISS:
+            metrics.count("lookup_cache_hits")
+            return value
+        with metrics.stage("rate_limit"):
+            self.limiter.wait()
+        # the prefetch thread and get() both look things up
+        with self.cond:
+            self.requests_made += 1
+        metrics.count("discogs_requests")
+        try:
+            with metrics.stage("network"):
+                value = self.search(artist, title)
+        except Exception as e:
+            # most likely transient (a timeout, a 429); caching it would hide the track for days
+            metrics.count("lookup_errors")
+            return {"error": str(e)}
+        if self.cache is not None:
+            self.cache.put("discogs", key, value)
+        return value
+
+    def _run(self):
+        try:
+            for pos, (key, artist, title) in enumerate(self.todo):
+                with self.cond:
+                    self.cond.wait_for(lambda: self.closed or pos < self.cursor + self.lookahead)
+                    if self.closed:
+                        return
+                    if key in self.results:
+                        continue
+                value = self._lookup(key, artist, title)
+                with self.cond:
+                    self.results[key] = value
+                    self.cond.notify_all()
+        finally:
+            # wake a get() waiting on a key this thread will never fetch now
+            with self.cond:
+                self.stopped = True
+                self.cond.notify_all()
+
+    def get(self, artist, title):
+        """the suggestion for (artist, title), waiting for the background fetch if needed"""
+        key = suggestion_key(artist, title)
+        with self.cond:
+            if key not in self.position:
+                self.position[key] = len(self.todo)
+                self.todo.append((key, artist, title))
+            self.cursor = max(self.cursor, self.position[key])
+            self.cond.notify_all()
+            self.cond.wait_for(lambda: key in self.results or self.stopped)
+            if key in self.results:
+                return self.results[key]
+        # the background thread has stopped; look it up here instead
+        value = self._lookup(key, artist, title)
+        with self.cond:
+            self.results[key] = value
+        return value
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+
+def find_mp3_genre(directory, discogs, writes=None, scheduler=None):
+    tracks = []
+    for file_path in metrics.timed("walk", walk(directory, exts={"mp3"})):
+        with metrics.stage("parse"):
+            tracks.append((file_path, TinyTag.get(file_path)))
+    if scheduler is None:
+        scheduler = DiscogsScheduler(discogs_search(discogs))
+    scheduler.start((tag.artist, tag.title) for file_path, tag in tracks)
+
+    for file_path, tag in tracks:
+        print(f"{tag.title}, Artist: {tag.artist}, Tag: {tag.genre}")
+        # time the prompt spends waiting on a lookup that wasn't ready yet
+        with metrics.stage("lookup_wait"):
+            discog_suggestion = scheduler.get(tag.artist, tag.title)
+        if isinstance(discog_suggestion, dict):
+            print(discog_suggestion["error"])
+        elif discog_suggestion:
+            print(f"Discogs suggests using one of these: {discog_suggestion}")
+        else:
+            print("Discogs has no suggestion")
+
+        if tag.genre:
+            if not is_valid_genre(tag.genre):
+                genre = input(f"Enter the genre for {file_path}: ")
                 print(f"Changing genre to: {genre}")
-                replace_mp3_genre(file_path, genre)
+                replace_mp3_genre(file_path, genre, writes)
+            else:
+                proceed = input(f"Is the genre {tag.genre.upper()} ok for {file_path}? (n or enter for y): ")
+                if proceed == 'n':
+                    genre = input(f"Enter a new genre for {file_path}: ")
+                    print(f"New genre is {genre}")
+                    replace_mp3_genre(file_path, genre, writes)
+                    print(f"Adding genre: {genre}")
+        else:
+            genre = input(f"Enter the genre for {file_path}: ")
+            print(f"Changing genre to: {genre}")
+            replace_mp3_genre(file_path, genre, writes)
+
+    scheduler.close()
+    print(f"[done] {scheduler.requests_made} Discogs requests")
+
+
+def change_mp3_genre(directory, writes=None):
+    for file_path in metrics.timed("walk", walk(directory, exts={"mp3"})):
+        with metrics.stage("parse"):
+            tag = TinyTag.get(file_path)
+
+        print(f"{tag.title}, Artist: {tag.artist}, Tag: {tag.genre}")
+        genre = input(f"Enter the new genre for {file_path}: ")
+        print(f"Changing genre to: {genre}")
+        replace_mp3_genre(file_path, genre, writes)
 
 def main():
-    directory = sys.argv[1]
-    discogs_token = sys.argv[2]
-    d = discogs_client.Client('ExampleApplication/0.1', user_token=discogs_token)
-    find_mp3_genre(directory, d)
-    change_mp3_genre(directory)
+    ap = argparse.ArgumentParser(description="Correct genre tags using the discogs API.")
+    ap.add_argument("directory", help="Root folder (e.g., /path/to/music/files)")
+    ap.add_argument("discogs_token", help="Discogs user token")
+    ap.add_argument("--defer-writes", action="store_true", help="Collect all edits and write them in one parallel batch at the end.")
+    ap.add_argument("--write-workers", type=int, default=4, help="Threads writing tags in the background (default: 4).")
+    ap.add_argument("--cache", default=DEFAULT_CACHE, help=f"Lookup cache database (default: {DEFAULT_CACHE})")
+    ap.add_argument("--cache-days", type=float, default=30, help="How long a Discogs suggestion stays cached (default: 30 days).")
+    ap.add_argument("--negative-cache-days", type=float, default=7, help="How long a lookup that found nothing stays cached (default: 7 days).")
+    ap.add_argument("--requests-per-minute", type=float, default=25, help="Discogs request budget (default: 25; authenticated clients get 60).")
+    ap.add_argument("--lookahead", type=int, default=20, help="How many files ahead of the prompt to prefetch (default: 20).")
+    add_metrics_arguments(ap)
+    args = ap.parse_args()
+
+    d = discogs_client.Client('ExampleApplication/0.1', user_token=args.discogs_token)
+    with instrumented(args), LookupCache(args.cache, args.cache_days * DAY, args.negative_cache_days * DAY) as cache, \
+            TagWriteQueue(args.write_workers, defer=args.defer_writes) as writes:
+        scheduler = DiscogsScheduler(discogs_search(d), cache, args.requests_per_minute, args.lookahead)
+        find_mp3_genre(args.directory, d, writes, scheduler)
+        # let the first pass land before re-reading tags; with --defer-writes that means writing its batch now
+        writes.flush()
+        change_mp3_genre(args.directory, writes)
 
 if __name__ == "__main__":
     main()
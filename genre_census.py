@@ -5,7 +5,14 @@ Genre census for a music library
 What it does:
 
 - Walks your music library and reads Artist + Genre tags.
-- Normalizes common genre variants (e.g., *alt rock* → *alternative rock*, *hip hop* → *hip-hop*).
+- Normalizes common genre variants (e.g., *alt rock* → *alternative rock*, *hip hop* → *hip-hop*)
+  with the shared rules in genres.json (see genres.py).
+- With --state, keeps the census (and each file's contribution to it) between runs, and only applies
+  the files that were added, removed or retagged since the last run
+- With --shard I/N (or --top), censuses only part of the top-level folders and writes a partial-result
+  file instead of the reports; --merge combines the partials from every shard (on any number of hosts,
+  with the library at the same path) into the same reports a single --sorted run over the whole
+  library writes, and refuses a set of shards with one missing or from another library
 - Produces these reports:
   - artists_majority_genre.tsv  (Artist -> majority genre across files)
   - genre_histogram.tsv         (Genre -> file count)
@@ -13,18 +20,45 @@ What it does:
 
 Usage:
     python3 genre_census.py "/path/to/music/files" --ext mp3 --withbuckets
+    python3 genre_census.py "/path/to/music/files" --workers 16   # parse tags on 16 processes
+    python3 genre_census.py "/path/to/music/files" --reader fast   # header-only ID3 reads, see fast_tags.py
+    python3 genre_census.py "/path/to/music/files" --state census.sqlite   # only read what changed since last run
+    python3 genre_census.py "/path/to/music/files" --index tags.sqlite --from-index   # no walk; see watch.py
+    python3 genre_census.py "/path/to/music/files" --snapshot library.npz   # no walk; see snapshot.py
+    python3 genre_census.py "/path/to/music/files" --metrics census.prom --profile census.prof   # see metrics.py
+    python3 genre_census.py "/path/to/music/files" --shard 0/3   # writes genre_census.shard0of3.json
+    python3 genre_census.py "/mnt/volume2" --top "Jazz and Blues" --partial jazz.json
+    python3 genre_census.py --merge genre_census.shard*.json --withbuckets
 """
 
 import argparse
+import json
 import os
+import sqlite3
 import sys
+import zlib
 from collections import Counter, defaultdict
 
+from genres import bucket_for, bucket_many, normalize_genre
+from metrics import add_metrics_arguments, instrumented, metrics
+from parallel import chunked, ordered_map
+from tag_index import open_index
+from walker import WalkState, scan_dir, walk
 
-def try_import_tag_readers():
+
+READERS = ("auto", "tinytag", "mutagen", "fast")
+
+
+def try_import_tag_readers(prefer="auto"):
+    if prefer == "fast":
+        # header-only reader (see fast_tags.py); files it can't read go to tinytag/mutagen
+        fallback_lib, fallback = try_import_tag_readers()
+        return f"fast (falling back to {fallback_lib})", fast_reader(fallback)
     tag_lib = None
     reader = None
     try:
+        if prefer == "mutagen":
+            raise ImportError("mutagen requested")
         from tinytag import TinyTag  # type: ignore
         tag_lib = "tinytag"
 
@@ -72,161 +106,512 @@ def try_import_tag_readers():
     return tag_lib, reader
 
 
-def normalize_genre(g: str) -> str:
-    g0 = g.strip()
-    if not g0:
-        return ""
-    g1 = g0.lower()
-    repl = {
-        "alt rock": "alternative rock",
-        "alternative": "alternative rock",
-        "alternative/indie": "indie rock",
-        "indie": "indie rock",
-        "indie-rock": "indie rock",
-        "indie rock": "indie rock",
-        "synth pop": "synth-pop",
-        "synthpop": "synth-pop",
-        "hip hop": "hip-hop",
-        "hiphop": "hip-hop",
-        "electronica": "electronic",
-        "edm": "electronic",
-        "dance": "dance",
-        "hard core": "hardcore",
-        "post hardcore": "post-hardcore",
-        "r&b": "rnb",
-        "r&b/soul": "rnb",
-        "soul": "soul",
-        "classical": "classical",
-        "soundtrack": "soundtrack",
-        "ost": "soundtrack",
-        "film score": "film/score",
-        "score": "film/score",
-        "world": "world/traditional",
-        "folk": "folk",
-        "blues": "blues",
-        "jazz": "jazz",
-        "ambient": "ambient",
-        "new wave": "new wave",
-        "punk": "punk",
-        "pop punk": "pop-punk",
-        "hard rock": "hard rock",
-        "metal": "metal",
-        "black metal": "black metal",
-        "death metal": "death metal",
-        "house": "house",
-        "techno": "techno",
-        "idm": "idm",
-        "downtempo": "downtempo",
-        "trip hop": "trip-hop",
-        "trip-hop": "trip-hop",
-        "shoegaze": "shoegaze",
-        "dream pop": "dream pop",
-        "post rock": "post-rock",
-        "post-rock": "post-rock",
-        "bluegrass": "bluegrass",
-        "zydeco": "zydeco",
-        "electro swing": "electroswing",
-        "electro-swing": "electroswing",
+def fast_reader(fallback):
+    import fast_tags
+
+    def read_tags(path):
+        if not fast_tags.supports(path):
+            return fallback(path) if fallback is not None else ("", "")
+        try:
+            t = fast_tags.read_tags(path)
+        except Exception:
+            # a header the fast parser doesn't handle; the full library may still read it
+            return fallback(path) if fallback is not None else ("", "")
+        return (t.artist or "").strip(), (t.genre or "").strip()
+
+    return read_tags
+
+
+def open_census_index(index_path, prefer="auto"):
+    """the tag index for --index, parsing misses with the --reader library (fast only reads
+    artist and genre, so the index parses with auto then)"""
+    return open_index(index_path, "auto" if prefer == "fast" else prefer)
+
+
+def index_reader(index):
+    def read_tags(path):
+        try:
+            t = index.get(path)
+            return (t.artist or "").strip(), (t.genre or "").strip()
+        except Exception:
+            return "", ""
+
+    return read_tags
+
+
+def walk_music(root, exts, state=None, sort=False):
+    return metrics.timed("walk", walk(root, exts=exts, state=state, sort=sort))
+
+def file_contribution(path, reader):
+    """the (artist, genre) a file adds to the census"""
+    with metrics.stage("parse"):
+        artist, genre = reader(path)
+    metrics.count("files")
+    if not artist: # guess artist based on path
+        artist = os.path.basename(os.path.dirname(path)).strip()
+    norm_genre = normalize_genre(genre)
+    key_genre = genre if genre else "Unknown"
+    return artist, key_genre
+
+
+def count_file(path, reader, genre_counter, artist_genre_counts):
+    add_contribution(file_contribution(path, reader), genre_counter, artist_genre_counts)
+
+
+def add_contribution(contribution, genre_counter, artist_genre_counts, n=1):
+    artist, key_genre = contribution
+    genre_counter[key_genre] += n
+    if artist:
+        artist_genre_counts[artist][key_genre] += n
+
+
+def remove_contribution(contribution, genre_counter, artist_genre_counts):
+    artist, key_genre = contribution
+    add_contribution(contribution, genre_counter, artist_genre_counts, -1)
+    if genre_counter[key_genre] <= 0:
+        del genre_counter[key_genre]
+    if artist:
+        gcounts = artist_genre_counts[artist]
+        if gcounts[key_genre] <= 0:
+            del gcounts[key_genre]
+        if not gcounts:
+            del artist_genre_counts[artist]
+
+
+# Per-process state for --workers; set up once by init_worker
+_worker_reader = None
+_worker_index = None
+
+
+def init_worker(index_path, prefer="auto"):
+    global _worker_reader, _worker_index
+    metrics.reset()
+    _, _worker_reader = try_import_tag_readers(prefer)
+    if index_path:
+        _worker_index = open_census_index(index_path, prefer)
+        _worker_reader = index_reader(_worker_index)
+
+
+def census_chunk(paths):
+    genre_counter = Counter()
+    artist_genre_counts = defaultdict(Counter)
+    for path in paths:
+        count_file(path, _worker_reader, genre_counter, artist_genre_counts)
+        if _worker_index is not None:
+            # the workers share the index: a write held open for the whole chunk locks
+            # the others out, so each re-parsed file is committed on its own (a commit
+            # with nothing written is free)
+            _worker_index.commit()
+    # the worker's timings travel back with its results
+    return len(paths), genre_counter, artist_genre_counts, metrics.snapshot(reset=True)
+
+
+def parallel_census(paths, workers, chunk_size, index_path=None, prefer="auto"):
+    """
+    census paths on a process pool. chunks are merged in walk order, so every
+    counter ends up with the same insertion order as a serial run and ties in
+    the reports come out the same way
+    """
+    total_files = 0
+    genre_counter = Counter()
+    artist_genre_counts = defaultdict(Counter)
+    results = ordered_map(census_chunk, chunked(paths, chunk_size), workers,
+                          processes=True, initializer=init_worker, initargs=(index_path, prefer))
+    for n, chunk_genres, chunk_artists, chunk_metrics in results:
+        metrics.merge(chunk_metrics)
+        total_files += n
+        genre_counter.update(chunk_genres)
+        for artist, gcounts in chunk_artists.items():
+            artist_genre_counts[artist].update(gcounts)
+        print(f"Analyzed {total_files} files")
+    return total_files, genre_counter, artist_genre_counts
+
+
+def parse_shard(value):
+    """"I/N" -> (I, N)"""
+    try:
+        i, n = (int(x) for x in value.split("/"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected I/N, e.g. 0/4, not {value!r}")
+    if not 0 <= i < n:
+        raise argparse.ArgumentTypeError(f"shard {i} is not one of 0..{n - 1}")
+    return i, n
+
+
+def in_shard(name, shard=None, tops=None):
+    """whether the top-level entry name belongs to this shard: a stable hash of the name picks one of N"""
+    if tops and name not in tops:
+        return False
+    if shard is not None:
+        i, n = shard
+        return zlib.crc32(name.encode("utf-8", "surrogateescape")) % n == i
+    return True
+
+
+def shard_blocks(root, exts, shard=None, tops=None):
+    """
+    ("file" or "dir", name, paths) for every top-level entry of root in the
+    shard, in the order a sorted walk of the whole library reaches them
+    """
+    files, subdirs = scan_dir(root)
+    for name in sorted(files):
+        if os.path.splitext(name)[1].lower().lstrip(".") in exts and in_shard(name, shard, tops):
+            yield "file", name, [os.path.join(root, name)]
+    for name in sorted(subdirs):
+        if in_shard(name, shard, tops):
+            yield "dir", name, walk_music(os.path.join(root, name), exts, sort=True)
+
+
+def census_block_chunk(item):
+    block, paths = item
+    return (block,) + census_chunk(paths)
+
+
+def shard_census(root, exts, reader, shard=None, tops=None, workers=1, chunk_size=256, index_path=None, prefer="auto"):
+    """
+    census one shard, keeping a separate census per top-level entry so that
+    merge_partials() can replay them in the order of a whole-library walk
+    """
+    blocks = []
+
+    def entries():
+        for kind, name, paths in shard_blocks(os.path.abspath(root), exts, shard, tops):
+            blocks.append({"kind": kind, "name": name, "files": 0, "genres": Counter(), "artists": defaultdict(Counter)})
+            yield len(blocks) - 1, paths
+
+    if workers > 1:
+        # chunks never span two entries, and come back in the order they were handed out
+        chunks = ((i, chunk) for i, paths in entries() for chunk in chunked(paths, chunk_size))
+        results = ordered_map(census_block_chunk, chunks, workers,
+                              processes=True, initializer=init_worker, initargs=(index_path, prefer))
+        total_files = 0
+        for i, n, chunk_genres, chunk_artists, chunk_metrics in results:
+            metrics.merge(chunk_metrics)
+            block = blocks[i]
+            block["files"] += n
+            block["genres"].update(chunk_genres)
+            for artist, gcounts in chunk_artists.items():
+                block["artists"][artist].update(gcounts)
+            total_files += n
+            print(f"Analyzed {total_files} files")
+    else:
+        for i, paths in entries():
+            block = blocks[i]
+            for path in paths:
+                print(f"Analyzing path {path}")
+                block["files"] += 1
+                count_file(path, reader, block["genres"], block["artists"])
+    return [b for b in blocks if b["files"]]
+
+
+def write_partial(path, root, exts, shard, blocks, tops=None):
+    partial = {
+        "root": os.path.abspath(root),
+        "exts": sorted(exts),
+        "shard": f"{shard[0]}/{shard[1]}" if shard else None,
+        "top": sorted(tops) if tops else None,
+        # Counters and dicts keep their insertion (walk) order through JSON, which the merge relies on
+        "blocks": blocks,
     }
-    if g1 in repl:
-        return repl[g1]
-    if "hip" in g1 and "hop" in g1:
-        return "hip-hop"
-    if "synth" in g1 and "pop" in g1:
-        return "synth-pop"
-    if "alt" in g1 and "rock" in g1:
-        return "alternative rock"
-    if "electro" in g1 and "swing" in g1:
-        return "electroswing"
-    return g0
-
-
-def bucket_for(genre: str) -> str:
-    g = genre.lower().strip()
-    if not g:
-        return "unknown"
-    if "classical" in g:
-        return "classical"
-    if "soundtrack" in g or "score" in g:
-        return "film/score"
-    if "jazz" in g or "blues" in g:
-        return "jazz/blues"
-    if "world" in g or "cajun" in g or ("folk" in g and "indie" not in g):
-        return "world/folk/traditional"
-    if "hip-hop" in g or "rap" in g:
-        return "hip-hop"
-    if "metal" in g or "hardcore" in g:
-        return "metal/hardcore"
-    if any(k in g for k in ["house", "techno", "idm", "downtempo", "electronic", "trip-hop", "ambient", "synth"]):
-        return "electronic"
-    if any(k in g for k in ["indie", "alternative", "post-rock", "shoegaze", "dream pop", "punk", "new wave", "rock", "power pop", "garage"]):
-        return "rock/alt"
-    if "pop" in g:
-        return "pop"
-    return "other"
-
-def walk_music(root, exts):
-    for dirpath, dirnames, filenames in os.walk(root):
-        dirnames[:] = [d for d in dirnames]
-        for fn in filenames:
-            ext = os.path.splitext(fn)[1].lower().lstrip(".")
-            if exts and ext not in exts:
-                continue
-            yield os.path.join(dirpath, fn)
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(partial, f, ensure_ascii=False)
+    os.replace(tmp, path)
 
-def main():
-    ap = argparse.ArgumentParser(description="Census genres in a music library (uses TinyTag or Mutagen).")
-    ap.add_argument("root", help="Root folder (e.g., /path/to/music/files)")
-    ap.add_argument("--ext", action="append", default=["mp3"], help="File extensions to include (default: mp3).")
-    ap.add_argument("--withbuckets", action="store_true", help="Also emit macro bucket histogram.")
-    args = ap.parse_args()
 
-    tag_lib, reader = try_import_tag_readers()
-    if reader is None:
-        print("Error: Could not import tinytag or mutagen.\nInstall one:\n  pip3 install tinytag\n  pip3 install mutagen", file=sys.stderr)
-        sys.exit(1)
-    print(f"[info] Using tag reader: {tag_lib}")
+def merge_partials(paths):
+    """
+    combine shard partials into (total files, genre counter, artist counters)
+    built in the same order as one sorted walk over all of them, so ties in
+    the reports come out exactly as in a single run. --shard partials must
+    cover every shard of one split exactly once; --top partials only merge
+    with each other
+    """
+    exts = root = None
+    shards = {}
+    tops = []
+    blocks = {}
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            partial = json.load(f)
+        if exts is None:
+            exts, root = partial["exts"], partial["root"]
+        elif partial["exts"] != exts:
+            raise SystemExit(f"{path} counts {', '.join(partial['exts'])} files, the other partials {', '.join(exts)}")
+        elif partial["root"] != root:
+            raise SystemExit(f"{path} is a census of {partial['root']}, the other partials of {root}")
+        if partial.get("top"):
+            tops.append(path)
+        elif partial["shard"]:
+            shards.setdefault(partial["shard"], []).append(path)
+        else:
+            raise SystemExit(f"{path} is not a --shard or --top partial")
+        for block in partial["blocks"]:
+            # a sorted walk lists a folder's files before its subfolders
+            key = (block["kind"] == "dir", block["name"])
+            if key in blocks:
+                raise SystemExit(f"{block['name']} is in both {blocks[key][0]} and {path}; the partials overlap")
+            blocks[key] = (path, block)
+
+    if tops and shards:
+        raise SystemExit(f"{tops[0]} is a --top partial; it can't be merged with --shard partials")
+    if shards:
+        split = {int(shard.split("/")[1]) for shard in shards}
+        if len(split) > 1:
+            raise SystemExit(f"the partials come from different splits ({', '.join(sorted(shards))})")
+        n = split.pop()
+        for shard, shard_paths in shards.items():
+            if len(shard_paths) > 1:
+                raise SystemExit(f"shard {shard} is in both {shard_paths[0]} and {shard_paths[1]}")
+        missing = [f"{i}/{n}" for i in range(n) if f"{i}/{n}" not in shards]
+        if missing:
+            raise SystemExit(f"missing shard {', '.join(missing)}; the totals would be short")
 
     total_files = 0
     genre_counter = Counter()
     artist_genre_counts = defaultdict(Counter)
+    for key in sorted(blocks):
+        block = blocks[key][1]
+        total_files += block["files"]
+        genre_counter.update(block["genres"])
+        for artist, gcounts in block["artists"].items():
+            artist_genre_counts[artist].update(gcounts)
+    return total_files, genre_counter, artist_genre_counts
+
+
+CENSUS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    inode INTEGER NOT NULL,
+    artist TEXT NOT NULL,
+    genre TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS genre_counts (genre TEXT NOT NULL, n INTEGER NOT NULL);
+CREATE TABLE IF NOT EXISTS artist_genre_counts (artist TEXT NOT NULL, genre TEXT NOT NULL, n INTEGER NOT NULL);
+"""
+
+
+def incremental_census(root, exts, reader, state_path, walk_state=None):
+    """
+    update a stored census with only what changed since the last run: new and
+    retagged files are read, deleted files are subtracted, unchanged files only
+    cost a stat. the counters and per-file contributions live in state_path
+    """
+    conn = sqlite3.connect(state_path)
+    conn.executescript(CENSUS_SCHEMA)
+    files = {row[0]: row[1:] for row in conn.execute("SELECT path, size, mtime_ns, inode, artist, genre FROM files")}
+    genre_counter = Counter()
+    for genre, n in conn.execute("SELECT genre, n FROM genre_counts ORDER BY rowid"):
+        genre_counter[genre] = n
+    artist_genre_counts = defaultdict(Counter)
+    for artist, genre, n in conn.execute("SELECT artist, genre, n FROM artist_genre_counts ORDER BY rowid"):
+        artist_genre_counts[artist][genre] = n
 
-    for path in walk_music(args.root, set([e.lower() for e in args.ext])):
+    seen = set()
+    changed = []
+    added = 0
+    for path in walk_music(os.path.abspath(root), exts, walk_state):
+        seen.add(path)
+        try:
+            with metrics.stage("stat"):
+                st = os.stat(path)
+        except OSError:
+            continue
+        old = files.get(path)
+        if old is not None and old[:3] == (st.st_size, st.st_mtime_ns, st.st_ino):
+            metrics.count("unchanged")
+            continue
         print(f"Analyzing path {path}")
-        total_files += 1
-        artist, genre = reader(path)
-        if not artist: # guess artist based on path
-            artist = os.path.basename(os.path.dirname(path)).strip()
-        norm_genre = normalize_genre(genre)
-        key_genre = genre if genre else "Unknown"
-        genre_counter[key_genre] += 1
-        if artist:
-            artist_genre_counts[artist][key_genre] += 1
+        if old is not None:
+            remove_contribution(old[3:], genre_counter, artist_genre_counts)
+        else:
+            added += 1
+        contribution = file_contribution(path, reader)
+        add_contribution(contribution, genre_counter, artist_genre_counts)
+        changed.append((path, st.st_size, st.st_mtime_ns, st.st_ino) + contribution)
+
+    removed = [path for path in files if path not in seen]
+    for path in removed:
+        remove_contribution(files[path][3:], genre_counter, artist_genre_counts)
+
+    conn.executemany("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?)", changed)
+    conn.executemany("DELETE FROM files WHERE path = ?", [(p,) for p in removed])
+    conn.execute("DELETE FROM genre_counts")
+    conn.executemany("INSERT INTO genre_counts VALUES (?, ?)", genre_counter.items())
+    conn.execute("DELETE FROM artist_genre_counts")
+    conn.executemany("INSERT INTO artist_genre_counts VALUES (?, ?, ?)",
+                     ((a, g, n) for a, gcounts in artist_genre_counts.items() for g, n in gcounts.items()))
+    conn.commit()
+    conn.close()
+
+    print(f"[info] Census delta: {added} added, {len(changed) - added} retagged, {len(removed)} removed")
+    return len(seen), genre_counter, artist_genre_counts
 
+
+def write_reports(genre_counter, artist_genre_counts, withbuckets):
     majority = {}
     for artist, gcounts in artist_genre_counts.items():
         best = max(gcounts.items(), key=lambda kv: kv[1])
         majority[artist] = best[0] if best else "Unknown"
 
+    bucket_rows = None
+    if withbuckets:
+        bucket_counts = Counter()
+        buckets = bucket_many(genre_counter)
+        for g, c in genre_counter.items():
+            bucket_counts[buckets[g]] += c
+        bucket_rows = sorted(bucket_counts.items(), key=lambda kv: kv[1], reverse=True)
+    write_report_files(majority.items(), sorted(genre_counter.items(), key=lambda kv: kv[1], reverse=True), bucket_rows)
+
+
+def write_report_files(majority, genre_rows, bucket_rows=None):
+    """write the TSVs from (artist, genre) pairs and (name, count) rows, most common first"""
     with open("artists_majority_genre.tsv", "w", encoding="utf-8") as f:
-        for artist in sorted(majority, key=lambda x: x.lower()):
-            f.write(f"{artist}\t{majority[artist]}\n")
+        for artist, genre in sorted(majority, key=lambda kv: kv[0].lower()):
+            f.write(f"{artist}\t{genre}\n")
 
     with open("genre_histogram.tsv", "w", encoding="utf-8") as f:
-        for g, c in sorted(genre_counter.items(), key=lambda kv: kv[1], reverse=True):
+        for g, c in genre_rows:
             f.write(f"{g}\t{c}\n")
 
-    if args.withbuckets:
-        bucket_counts = Counter()
-        for g, c in genre_counter.items():
-            bucket_counts[bucket_for(g)] += c
+    if bucket_rows is not None:
         with open("bucket_histogram.tsv", "w", encoding="utf-8") as f:
-            for b, c in sorted(bucket_counts.items(), key=lambda kv: kv[1], reverse=True):
+            for b, c in bucket_rows:
                 f.write(f"{b}\t{c}\n")
 
-    print(f"[done] Scanned {total_files} files")
+
+def snapshot_census(ap, args):
+    from snapshot import Snapshot, genre_census
+
+    snapshot = Snapshot.load(args.snapshot)
+    if snapshot.root != os.path.abspath(args.root):
+        ap.error(f"{args.snapshot} is a snapshot of {snapshot.root}")
+    print(f"[info] Reading {len(snapshot)} files from snapshot: {args.snapshot}")
+    majority, genre_rows, bucket_rows = genre_census(snapshot, set(e.lower().lstrip(".") for e in args.ext),
+                                                     bucket_for if args.withbuckets else None)
+    write_report_files(majority, genre_rows, bucket_rows)
+    print(f"[done] Scanned {sum(n for _, n in genre_rows)} files")
     print(f"[done] Wrote: artists_majority_genre.tsv, genre_histogram.tsv" + (", bucket_histogram.tsv" if args.withbuckets else ""))
 
 
+def main():
+    ap = argparse.ArgumentParser(description="Census genres in a music library (uses TinyTag or Mutagen).")
+    ap.add_argument("root", nargs="?", help="Root folder (e.g., /path/to/music/files)")
+    ap.add_argument("--ext", action="append", default=["mp3"], help="File extensions to include (default: mp3).")
+    ap.add_argument("--withbuckets", action="store_true", help="Also emit macro bucket histogram.")
+    ap.add_argument("--index", help="Tag index database (see tag_index.py); only new or changed files are re-parsed.")
+    ap.add_argument("--reader", choices=READERS, default="auto",
+                    help="Tag reader: tinytag, mutagen, or fast (header-only, see fast_tags.py); auto = tinytag, else mutagen.")
+    ap.add_argument("--walk-state", help="Walk state database (see walker.py); unchanged folders are not re-listed.")
+    ap.add_argument("--workers", type=int, default=1, help="Parse tags on N processes (0 = one per CPU, default: 1).")
+    ap.add_argument("--chunk-size", type=int, default=256, help="Files per batch handed to a worker (default: 256).")
+    ap.add_argument("--state", help="Census state database; update the stored census with only added, removed and retagged files.")
+    ap.add_argument("--from-index", action="store_true", help="Answer from the tag index (kept current by watch.py) without walking the library.")
+    ap.add_argument("--snapshot", help="Answer from a library snapshot (see snapshot.py) without touching the library.")
+    ap.add_argument("--sorted", action="store_true", help="Walk each folder in name order, so ties in the reports come out the same on every run (and as in --merge).")
+    ap.add_argument("--shard", type=parse_shard, metavar="I/N", help="Census only the top-level folders whose name hashes to shard I of N, and write a partial result.")
+    ap.add_argument("--top", action="append", help="Census only this top-level folder or file, and write a partial result (repeatable).")
+    ap.add_argument("--partial", help="Where --shard/--top write the partial result (default: genre_census.shardIofN.json, or genre_census.partial.json).")
+    ap.add_argument("--merge", nargs="+", metavar="PARTIAL", help="Write the reports from the partial results of --shard/--top runs instead of scanning.")
+    add_metrics_arguments(ap)
+    args = ap.parse_args()
+    with instrumented(args):
+        census(ap, args)
+
+
+def census(ap, args):
+    if args.merge:
+        total_files, genre_counter, artist_genre_counts = merge_partials(args.merge)
+        print(f"[info] Merged {len(args.merge)} partial results")
+        return finish(total_files, genre_counter, artist_genre_counts, args.withbuckets)
+    if not args.root:
+        ap.error("the root folder is required unless --merge is given")
+    sharded = args.shard is not None or args.top
+    if sharded and (args.state or args.from_index or args.snapshot or args.walk_state):
+        ap.error("--shard/--top can't be combined with --state, --from-index, --snapshot or --walk-state")
+    if args.snapshot:
+        return snapshot_census(ap, args)
+    tag_lib, reader = try_import_tag_readers(args.reader)
+    if reader is None:
+        print("Error: Could not import tinytag or mutagen.\nInstall one:\n  pip3 install tinytag\n  pip3 install mutagen", file=sys.stderr)
+        sys.exit(1)
+    index = open_census_index(args.index, args.reader)
+    if index is not None:
+        reader = index_reader(index)
+        print(f"[info] Using tag index: {args.index}")
+    else:
+        print(f"[info] Using tag reader: {tag_lib}")
+
+    total_files = 0
+    genre_counter = Counter()
+    artist_genre_counts = defaultdict(Counter)
+    walk_state = WalkState(args.walk_state) if args.walk_state else None
+    paths = walk_music(args.root, set([e.lower() for e in args.ext]), walk_state, args.sorted)
+    workers = args.workers or os.cpu_count() or 1
+
+    if sharded:
+        exts = set(e.lower().lstrip(".") for e in args.ext)
+        blocks = shard_census(args.root, exts, reader, args.shard, set(args.top or ()), workers,
+                              args.chunk_size, args.index, args.reader)
+        if index is not None:
+            index.close()
+        partial = args.partial or (f"genre_census.shard{args.shard[0]}of{args.shard[1]}.json" if args.shard else "genre_census.partial.json")
+        write_partial(partial, args.root, exts, args.shard, blocks, args.top)
+        print(f"[done] Scanned {sum(b['files'] for b in blocks)} files in {len(blocks)} top-level entries")
+        print(f"[done] Wrote: {partial}")
+        return
+
+    if args.from_index:
+        if index is None:
+            ap.error("--from-index needs --index")
+        exts = set(e.lower().lstrip(".") for e in args.ext)
+        indexed = {path: (t.artist or "", t.genre or "") for path, t in index.items(args.root)
+                   if os.path.splitext(path)[1].lower().lstrip(".") in exts}
+        paths = list(indexed)
+        parse = reader
+
+        def reader(path):
+            if path not in indexed:
+                # walked by --state but not in the index yet: parse it (and index it) now
+                return parse(path)
+            artist, genre = indexed[path]
+            return artist.strip(), genre.strip()
+
+        workers = 1
+        print(f"[info] Reading {len(paths)} files from the tag index")
+
+    if args.state:
+        print(f"[info] Updating census state: {args.state}")
+        total_files, genre_counter, artist_genre_counts = incremental_census(
+            args.root, set([e.lower() for e in args.ext]), reader, args.state, walk_state)
+    elif workers > 1:
+        print(f"[info] Using {workers} worker processes")
+        total_files, genre_counter, artist_genre_counts = parallel_census(paths, workers, args.chunk_size, args.index, args.reader)
+    else:
+        for path in paths:
+            print(f"Analyzing path {path}")
+            total_files += 1
+            count_file(path, reader, genre_counter, artist_genre_counts)
+
+    if walk_state is not None:
+        print(f"[info] Walk: {walk_state.reused} folders unchanged, {walk_state.scanned} re-listed")
+        walk_state.close()
+    if index is not None:
+        if workers == 1 or args.state:
+            print(f"[info] Index: {index.hits} unchanged, {index.misses} re-parsed")
+        index.close()
+
+    finish(total_files, genre_counter, artist_genre_counts, args.withbuckets)
+
+
+def finish(total_files, genre_counter, artist_genre_counts, withbuckets):
+    write_reports(genre_counter, artist_genre_counts, withbuckets)
+
+    print(f"[done] Scanned {total_files} files")
+    print(f"[done] Wrote: artists_majority_genre.tsv, genre_histogram.tsv" + (", bucket_histogram.tsv" if withbuckets else ""))
+
+
 if __name__ == "__main__":
     main()
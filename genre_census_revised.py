@@ -9,34 +9,31 @@ What it does:
 
 Usage:
     python3 genre_census_revised.py /path/to/music/files
+    python3 genre_census_revised.py /path/to/music/files --index /path/to/tags.sqlite
+    python3 genre_census_revised.py /mnt/nas/music --io-depth 32   # overlap the network latency of the reads
 """
 
 import argparse
-import os
-import sys
-from collections import Counter, defaultdict
+from collections import Counter
 
-from tinytag import TinyTag
+from tag_index import open_index, prefetch_tags
+from walker import walk
 
 
-def walk_music(directory):
+def walk_music(directory, index=None, io_depth=0):
     total_files = 0
     genre_counter = Counter()
     all_genres = []
     all_counters = []
 
-    for root, dirs, files in os.walk(directory):
-        for file in files:
-            if file.lower().endswith('.mp3'):
-                file_path = os.path.join(root, file)
-                tags = TinyTag.get(file_path)
-                print(f"Analyzing path {file_path}")
+    for file_path, tags in prefetch_tags(walk(directory, exts={"mp3"}), index, io_depth):
+        print(f"Analyzing path {file_path}")
 
-                total_files += 1
-                genre = tags.genre
-                if not genre in all_genres:
-                    all_genres.append(genre)
-                genre_counter[genre] += 1
+        total_files += 1
+        genre = tags.genre
+        if not genre in all_genres:
+            all_genres.append(genre)
+        genre_counter[genre] += 1
 
     for g in all_genres:
         counter_tuple = (g, genre_counter[g])
@@ -46,9 +43,16 @@ def walk_music(directory):
     return all_counters
 
 def main():
-    directory = sys.argv[1]
-
-    all_counters = walk_music(directory)
+    ap = argparse.ArgumentParser(description="Count files per genre in a music library.")
+    ap.add_argument("directory", help="Root folder (e.g., /path/to/music/files)")
+    ap.add_argument("--index", help="Tag index database (see tag_index.py)")
+    ap.add_argument("--io-depth", type=int, default=0, help="Header reads kept in flight at once, for libraries on a NAS (default: 0, one at a time).")
+    args = ap.parse_args()
+
+    index = open_index(args.index)
+    all_counters = walk_music(args.directory, index, args.io_depth)
+    if index is not None:
+        index.close()
     counters = sorted(all_counters, key=lambda x: x[1], reverse=True)
 
     for c in counters:
@@ -0,0 +1,157 @@
+"""
+Shared genre normalization, bucketing and validation
+
+What it does:
+
+- Loads the genre rules from genres.json: the alias table for normalizing tags, the substring rules
+  tried when no alias matches, the rules that roll genres up into macro buckets, and the list of
+  genres the tag editors accept as valid
+- Compiles each rule's words into a single regex and the valid genres into a set when the config
+  is loaded, so nothing is rebuilt per call
+- Remembers the answer for every distinct raw string, so a library with a million tags costs about
+  as much as its number of distinct genre strings
+- Is what genre_census.py (normalize_genre, bucket_for), find_genre.py and fix_genre.py (valid
+  genres) and snapshot.py use
+
+Usage:
+    from genres import bucket_for, is_valid_genre, normalize_genre, normalize_many
+    normalize_genre("Alt Rock")           # "alternative rock"
+    bucket_for("shoegaze")                # "rock/alt"
+    is_valid_genre("Hip Hop")             # True
+    normalize_many(tags)                  # {raw: normalized} for every distinct raw string
+
+    python3 genres.py "alt rock" "Hip Hop" "indie folk"   # show what the rules make of some tags
+    python3 genres.py --config my_genres.json "alt rock"
+"""
+
+import argparse
+import json
+import os
+import re
+from functools import lru_cache
+
+DEFAULT_CONFIG = os.path.join(os.path.dirname(os.path.abspath(__file__)), "genres.json")
+
+
+def compile_words(words):
+    """one regex matching any of words as a substring, or None for no words"""
+    if not words:
+        return None
+    return re.compile("|".join(re.escape(w) for w in sorted(words, key=len, reverse=True)))
+
+
+class Rule:
+    """
+    matches a lowercased genre that contains any of "any" (when given), all of
+    "all" and none of "none"
+    """
+    __slots__ = ("result", "any_of", "all_of", "none_of")
+
+    def __init__(self, spec):
+        self.result = spec["result"]
+        self.any_of = compile_words(spec.get("any"))
+        self.all_of = tuple(spec.get("all", ()))
+        self.none_of = compile_words(spec.get("none"))
+
+    def matches(self, g):
+        return ((self.any_of is None or self.any_of.search(g) is not None)
+                and all(w in g for w in self.all_of)
+                and (self.none_of is None or self.none_of.search(g) is None))
+
+
+class GenreRules:
+    def __init__(self, config):
+        self.aliases = {k.lower(): v for k, v in config["aliases"].items()}
+        self.alias_rules = [Rule(r) for r in config.get("alias_rules", [])]
+        self.bucket_rules = [Rule(r) for r in config.get("buckets", [])]
+        self.default_bucket = config.get("default_bucket", "other")
+        self.empty_bucket = config.get("empty_bucket", "unknown")
+        self.valid = frozenset(config.get("valid", []))
+        # one cache per distinct raw string
+        self.normalize = lru_cache(maxsize=None)(self._normalize)
+        self.bucket = lru_cache(maxsize=None)(self._bucket)
+
+    @classmethod
+    def load(cls, path=DEFAULT_CONFIG):
+        with open(path, encoding="utf-8") as f:
+            return cls(json.load(f))
+
+    def _normalize(self, g):
+        g0 = g.strip()
+        if not g0:
+            return ""
+        g1 = g0.lower()
+        alias = self.aliases.get(g1)
+        if alias is not None:
+            return alias
+        for rule in self.alias_rules:
+            if rule.matches(g1):
+                return rule.result
+        return g0
+
+    def _bucket(self, genre):
+        g = genre.lower().strip()
+        if not g:
+            return self.empty_bucket
+        for rule in self.bucket_rules:
+            if rule.matches(g):
+                return rule.result
+        return self.default_bucket
+
+    def is_valid(self, genre):
+        return genre in self.valid
+
+    def normalize_many(self, values):
+        """{raw: normalized} for every distinct value"""
+        return {g: self.normalize(g) for g in set(values)}
+
+    def bucket_many(self, values):
+        """{genre: bucket} for every distinct value"""
+        return {g: self.bucket(g) for g in set(values)}
+
+
+_rules = None
+
+
+def rules():
+    """the rules from genres.json, loaded on first use"""
+    global _rules
+    if _rules is None:
+        _rules = GenreRules.load()
+    return _rules
+
+
+def normalize_genre(g: str) -> str:
+    return rules().normalize(g)
+
+
+def bucket_for(genre: str) -> str:
+    return rules().bucket(genre)
+
+
+def is_valid_genre(genre) -> bool:
+    return rules().is_valid(genre)
+
+
+def normalize_many(values):
+    return rules().normalize_many(values)
+
+
+def bucket_many(values):
+    return rules().bucket_many(values)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Show how the genre rules normalize, bucket and validate some tags.")
+    ap.add_argument("genres", nargs="+", help="Genre tags to check")
+    ap.add_argument("--config", default=DEFAULT_CONFIG, help=f"Genre rules (default: {DEFAULT_CONFIG})")
+    args = ap.parse_args()
+
+    r = GenreRules.load(args.config)
+    for g in args.genres:
+        normalized = r.normalize(g)
+        print(f"{g}\t{normalized}\t{r.bucket(normalized)}\t{'valid' if r.is_valid(g) else 'not valid'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""
+On-disk cache for web lookups (TheAudioDB, Discogs)
+
+What it does:
+
+- Stores lookup results as JSON in a SQLite database, grouped by namespace (e.g. "audiodb", "discogs")
+- Expires hits after a TTL, and caches misses/failures too (with a shorter TTL) so they aren't retried every run
+- Is safe to use from the threads that prefetch lookups
+
+Usage:
+    from lookup_cache import LookupCache, MISS
+    cache = LookupCache("/path/to/lookups.sqlite")
+    value = cache.get("audiodb", "the beatles")
+    if value is MISS:
+        value = fetch(...)
+        cache.put("audiodb", "the beatles", value)
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+
+DEFAULT_CACHE = os.path.expanduser("~/.cache/music-analysis/lookups.sqlite")
+
+DAY = 24 * 60 * 60
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS lookups (
+    namespace TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT,
+    expires_at REAL NOT NULL,
+    PRIMARY KEY (namespace, key)
+)
+"""
+
+# Returned by get() when there is no usable entry; None is a valid (negative) cached value
+MISS = object()
+
+
+class LookupCache:
+    def __init__(self, db_path=DEFAULT_CACHE, ttl=30 * DAY, negative_ttl=DAY):
+        db_dir = os.path.dirname(os.path.abspath(db_path))
+        os.makedirs(db_dir, exist_ok=True)
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, timeout=60, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(SCHEMA)
+        self.conn.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def get(self, namespace, key):
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT value, expires_at FROM lookups WHERE namespace = ? AND key = ?", (namespace, key)
+            ).fetchone()
+        if row is None or row[1] < time.time():
+            return MISS
+        return json.loads(row[0]) if row[0] is not None else None
+
+    def put(self, namespace, key, value, ttl=None):
+        """cache value for key; None is stored as a negative entry with the negative TTL"""
+        if ttl is None:
+            ttl = self.negative_ttl if value is None else self.ttl
+        stored = json.dumps(value) if value is not None else None
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO lookups VALUES (?, ?, ?, ?)", (namespace, key, stored, time.time() + ttl)
+            )
+            self.conn.commit()
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
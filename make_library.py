@@ -0,0 +1,289 @@
+"""
+Build a synthetic music library for benchmarking, without any real audio
+
+What it does:
+
+- Writes N small but well-formed MP3 (ID3v2.3/2.4, some with an ID3v1 trailer), FLAC (STREAMINFO +
+  VORBIS_COMMENT) and M4A (moov/udta/meta/ilst) files, built byte by byte, so TinyTag and mutagen
+  read them like real files
+- Lays them out like an archived library (see archive.py): Alphabetical by Artist/<Letter>/<Artist>,
+  Holidays/Christmas and Holidays/Halloween, Soundtracks and Show Tunes, Jazz and Blues
+- Mixes in a configurable share of missing genres, odd genre spellings ("alt rock", "hiphop", "(17)"),
+  "The ..." / "..., The" artists, and duplicates (re-tagged copies with identical audio, or the same
+  artist/title/length with different audio)
+- Is deterministic for a given --seed, so runs can be compared
+
+Usage:
+    python3 make_library.py /tmp/synthetic-library --files 10000
+    python3 make_library.py /tmp/synthetic-library --files 100000 --formats mp3=8,flac=1,m4a=1 --duplicates 0.05
+"""
+
+import argparse
+import os
+import random
+import struct
+
+FIRST_WORDS = ["Silver", "Black", "Electric", "Velvet", "Midnight", "Crystal", "Lonely", "Golden", "Broken",
+               "Neon", "Paper", "Wild", "Cosmic", "Iron", "Hollow", "Northern", "Violet", "Static", "Lucky", "Glass"]
+SECOND_WORDS = ["Hearts", "Rivers", "Machines", "Foxes", "Lanterns", "Tigers", "Ghosts", "Satellites", "Kings",
+                "Wolves", "Echoes", "Sparrows", "Engines", "Shadows", "Pilots", "Horses", "Giants", "Saints"]
+TITLE_WORDS = ["love", "night", "road", "fire", "rain", "summer", "home", "heart", "dream", "light", "city",
+               "blue", "gone", "dance", "wait", "again", "sky", "run", "forever", "tonight", "train", "river"]
+
+GENRES = ["Rock", "Pop", "Hip-Hop", "Electronic", "Country", "Classical", "Metal", "Folk", "R&B", "Reggae",
+          "Alternative Rock", "Indie Rock", "Punk", "House", "Ambient", "Soul"]
+ODD_GENRES = ["alt rock", "Alternative", "hip hop", "hiphop", "Hip Hop/Rap", "synthpop", "Synth Pop", "electronica",
+              "  Indie  ", "R&B/Soul", "(17)", "(13)", "Rock/Pop", "rock; pop", "OST", "Other", "Unknown", "genre"]
+
+# library folder -> genres tagged on files stored there
+SECTIONS = [
+    ("Holidays/Christmas", ["Christmas"]),
+    ("Holidays/Halloween", ["Halloween"]),
+    ("Soundtracks and Show Tunes", ["Soundtrack", "Broadway", "Disney"]),
+    ("Jazz and Blues", ["Jazz", "Blues"]),
+]
+# share of tracks that go into SECTIONS instead of Alphabetical by Artist
+SECTION_SHARE = 0.15
+
+ID3V1_GENRES = ["Blues", "Classic Rock", "Country", "Dance", "Disco", "Funk", "Grunge", "Hip-Hop", "Jazz",
+                "Metal", "New Age", "Oldies", "Other", "Pop", "R&B", "Rap", "Reggae", "Rock"]
+
+# MPEG-1 layer III, 128 kbit/s, 44.1 kHz, no padding: 417-byte frames of 1152 samples
+MP3_FRAME_HEADER = b"\xff\xfb\x90\x64"
+MP3_FRAME_SIZE = 417
+SAMPLE_RATE = 44100
+
+
+def audio_for(track):
+    # audio is regenerated from its seed, so duplicates can share it without keeping it in memory
+    return random.Random(track["audio_seed"]).randbytes(track["frames"] * (MP3_FRAME_SIZE - 4))
+
+
+def syncsafe(n):
+    return bytes([(n >> 21) & 0x7F, (n >> 14) & 0x7F, (n >> 7) & 0x7F, n & 0x7F])
+
+
+def id3v2_tag(fields, version=4, padding=256):
+    frames = []
+    for frame_id, value in fields:
+        if version == 4:
+            data = b"\x03" + value.encode("utf-8")
+            size = syncsafe(len(data))
+        else:
+            data = b"\x01" + value.encode("utf-16")
+            size = struct.pack(">I", len(data))
+        frames.append(frame_id.encode("ascii") + size + b"\x00\x00" + data)
+    body = b"".join(frames) + b"\x00" * padding
+    return b"ID3" + bytes([version, 0, 0]) + syncsafe(len(body)) + body
+
+
+def id3v1_tag(track):
+    def field(value, size):
+        return value.encode("latin-1", "replace")[:size].ljust(size, b"\x00")
+    genre = ID3V1_GENRES.index(track["genre"]) if track["genre"] in ID3V1_GENRES else 255
+    return (b"TAG" + field(track["title"], 30) + field(track["artist"], 30) + field(track["album"], 30)
+            + b"2001" + field("", 28) + b"\x00" + bytes([track["number"] % 256, genre]))
+
+
+def mp3_file(track):
+    fields = [("TPE1", track["artist"]), ("TIT2", track["title"]), ("TALB", track["album"]),
+              ("TRCK", str(track["number"]))]
+    if track["genre"] is not None:
+        fields.append(("TCON", track["genre"]))
+    version = 3 if track["number"] % 3 == 0 else 4
+    payload = audio_for(track)
+    audio = b"".join(MP3_FRAME_HEADER + payload[i:i + MP3_FRAME_SIZE - 4]
+                     for i in range(0, len(payload), MP3_FRAME_SIZE - 4))
+    data = id3v2_tag(fields, version) + audio
+    if track["number"] % 5 == 0:
+        data += id3v1_tag(track)
+    return data
+
+
+def flac_block(block_type, body, last=False):
+    return bytes([(0x80 if last else 0) | block_type]) + struct.pack(">I", len(body))[1:] + body
+
+
+def flac_file(track):
+    samples = track["frames"] * 1152
+    # 16 bits of min/max block size, 24 of min/max frame size, then 20 rate, 3 channels-1, 5 bps-1, 36 samples
+    packed = (SAMPLE_RATE << 44) | (1 << 41) | (15 << 36) | samples
+    streaminfo = struct.pack(">HH", 4096, 4096) + b"\x00" * 6 + packed.to_bytes(8, "big") + b"\x00" * 16
+    comments = [("ARTIST", track["artist"]), ("TITLE", track["title"]), ("ALBUM", track["album"]),
+                ("TRACKNUMBER", str(track["number"]))]
+    if track["genre"] is not None:
+        comments.append(("GENRE", track["genre"]))
+    vendor = b"make_library"
+    body = struct.pack("<I", len(vendor)) + vendor + struct.pack("<I", len(comments))
+    for key, value in comments:
+        entry = f"{key}={value}".encode("utf-8")
+        body += struct.pack("<I", len(entry)) + entry
+    return (b"fLaC" + flac_block(0, streaminfo) + flac_block(4, body) + flac_block(1, b"\x00" * 128, last=True)
+            + b"\xff\xf8" + audio_for(track))
+
+
+def atom(name, body):
+    return struct.pack(">I", len(body) + 8) + name + body
+
+
+def m4a_file(track):
+    samples = track["frames"] * 1152
+    mvhd = (struct.pack(">IIIII", 0, 0, 0, 1000, samples * 1000 // SAMPLE_RATE) + struct.pack(">IH", 0x10000, 0x100)
+            + b"\x00" * 10 + struct.pack(">9I", 0x10000, 0, 0, 0, 0x10000, 0, 0, 0, 0x40000000) + b"\x00" * 24
+            + struct.pack(">I", 2))
+    mdhd = struct.pack(">IIIIIHH", 0, 0, 0, SAMPLE_RATE, samples, 0x55C4, 0)
+    hdlr = struct.pack(">II", 0, 0) + b"soun" + b"\x00" * 12 + b"\x00"
+    mp4a = (b"\x00" * 6 + struct.pack(">H", 1) + b"\x00" * 8 + struct.pack(">HHHH", 2, 16, 0, 0)
+            + struct.pack(">I", SAMPLE_RATE << 16))
+    decoder_config = b"\x40\x15" + b"\x00" * 3 + struct.pack(">II", 128000, 128000) + b"\x05\x02\x12\x10"
+    es = b"\x00\x01\x00" + b"\x04" + bytes([len(decoder_config)]) + decoder_config + b"\x06\x01\x02"
+    esds = struct.pack(">I", 0) + b"\x03" + bytes([len(es)]) + es
+    stsd = struct.pack(">II", 0, 1) + atom(b"mp4a", mp4a + atom(b"esds", esds))
+    trak = atom(b"trak", atom(b"mdia", atom(b"mdhd", mdhd) + atom(b"hdlr", hdlr)
+                              + atom(b"minf", atom(b"stbl", atom(b"stsd", stsd)))))
+
+    def text(name, value):
+        return atom(name, atom(b"data", struct.pack(">II", 1, 0) + value.encode("utf-8")))
+    items = (text(b"\xa9ART", track["artist"]) + text(b"\xa9nam", track["title"]) + text(b"\xa9alb", track["album"])
+             + atom(b"trkn", atom(b"data", struct.pack(">IIHHHH", 0, 0, 0, track["number"], 0, 0))))
+    if track["genre"] is not None:
+        items += text(b"\xa9gen", track["genre"])
+    meta_hdlr = atom(b"hdlr", struct.pack(">II", 0, 0) + b"mdir" + b"appl" + b"\x00" * 9)
+    udta = atom(b"udta", atom(b"meta", struct.pack(">I", 0) + meta_hdlr + atom(b"ilst", items)))
+    moov = atom(b"moov", atom(b"mvhd", mvhd) + trak + udta)
+    ftyp = atom(b"ftyp", b"M4A " + struct.pack(">I", 0) + b"M4A mp42isom")
+    return ftyp + moov + atom(b"mdat", audio_for(track))
+
+
+WRITERS = {"mp3": mp3_file, "flac": flac_file, "m4a": m4a_file}
+
+
+def safe_name(name):
+    return name.replace("/", "_").replace(":", "_")
+
+
+def make_artists(rng, count, the_share):
+    artists = set()
+    while len(artists) < count:
+        name = f"{rng.choice(FIRST_WORDS)} {rng.choice(SECOND_WORDS)}"
+        if rng.random() < 0.3:
+            name += f" {rng.randint(2, 99)}"
+        artists.add(name)
+    result = []
+    for name in sorted(artists):
+        if rng.random() < the_share:
+            # tag it either way round, as real libraries do
+            name = f"The {name}" if rng.random() < 0.7 else f"{name}, The"
+        result.append(name)
+    return result
+
+
+def pick_genre(rng, section_genres, missing, odd):
+    r = rng.random()
+    if r < missing:
+        return None if rng.random() < 0.8 else ""
+    if section_genres:
+        return rng.choice(section_genres)
+    if r < missing + odd:
+        return rng.choice(ODD_GENRES)
+    return rng.choice(GENRES)
+
+
+def folder_for(artist, section):
+    folder = safe_name(artist)
+    if section:
+        return os.path.join(section, folder)
+    letter = folder[4] if folder.startswith("The ") else folder[0]
+    return os.path.join("Alphabetical by Artist", letter.upper(), folder)
+
+
+def generate(out_dir, files, rng, formats, missing=0.1, odd=0.1, duplicates=0.05, the_share=0.2):
+    """write the library; returns a Counter-like dict of how many files of each kind were made"""
+    names, weights = zip(*formats.items())
+    artists = make_artists(rng, max(files // 12, 1), the_share)
+    sections = {artist: (rng.choice(SECTIONS) if rng.random() < SECTION_SHARE else (None, None)) for artist in artists}
+    made = {"files": 0, "duplicates": 0, "missing_genre": 0}
+    written = []
+
+    while made["files"] < files:
+        if written and rng.random() < duplicates:
+            duplicate = True
+            original = rng.choice(written)
+            track = dict(original)
+            if rng.random() < 0.5:
+                # same audio, different tags and name: a content duplicate
+                track["genre"] = pick_genre(rng, None, missing, odd)
+                track["number"] = original["number"] + 1
+            else:
+                # same artist/title/length, different audio: a tag duplicate
+                track["audio_seed"] = rng.getrandbits(64)
+            section = sections[track["artist"]][0]
+            name = f"{track['title']} (copy {made['duplicates'] + 1}).{track['ext']}"
+        else:
+            duplicate = False
+            artist = rng.choice(artists)
+            section, section_genres = sections[artist]
+            frames = rng.randint(8, 64)
+            number = rng.randint(1, 18)
+            title = " ".join(rng.choice(TITLE_WORDS) for _ in range(rng.randint(1, 4))).title()
+            ext = rng.choices(names, weights)[0]
+            track = {
+                "artist": artist,
+                "title": title,
+                "album": f"{rng.choice(FIRST_WORDS)} {rng.choice(TITLE_WORDS).title()}",
+                "genre": pick_genre(rng, section_genres, missing, odd),
+                "number": number,
+                "frames": frames,
+                "ext": ext,
+                "audio_seed": rng.getrandbits(64),
+            }
+            name = f"{number:02d} - {title}.{ext}" if rng.random() < 0.7 else f"{artist} - {title}.{ext}"
+
+        folder = os.path.join(out_dir, folder_for(track["artist"], section))
+        path = os.path.join(folder, safe_name(name))
+        if os.path.exists(path):
+            continue
+        os.makedirs(folder, exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(WRITERS[track["ext"]](track))
+        if duplicate:
+            made["duplicates"] += 1
+        else:
+            written.append(track)
+        made["files"] += 1
+        if not track["genre"]:
+            made["missing_genre"] += 1
+    return made
+
+
+def parse_formats(value):
+    formats = {}
+    for part in value.split(","):
+        name, _, weight = part.partition("=")
+        if name not in WRITERS:
+            raise argparse.ArgumentTypeError(f"unknown format {name!r} (choose from {', '.join(WRITERS)})")
+        formats[name] = float(weight or 1)
+    return formats
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Build a synthetic music library for benchmarking.")
+    ap.add_argument("out_dir", help="Folder to create the library in")
+    ap.add_argument("--files", type=int, default=1000, help="Number of files to write (default: 1000)")
+    ap.add_argument("--formats", type=parse_formats, default="mp3=8,flac=1,m4a=1",
+                    help="Formats and their weights (default: mp3=8,flac=1,m4a=1)")
+    ap.add_argument("--missing-genre", type=float, default=0.1, help="Share of files with no genre (default: 0.1)")
+    ap.add_argument("--odd-genre", type=float, default=0.1, help="Share of files with an odd genre spelling (default: 0.1)")
+    ap.add_argument("--duplicates", type=float, default=0.05, help="Share of files that duplicate another (default: 0.05)")
+    ap.add_argument("--the-artists", type=float, default=0.2, help="Share of artists named \"The ...\" (default: 0.2)")
+    ap.add_argument("--seed", type=int, default=1, help="Random seed (default: 1)")
+    args = ap.parse_args()
+
+    made = generate(args.out_dir, args.files, random.Random(args.seed), args.formats,
+                    args.missing_genre, args.odd_genre, args.duplicates, args.the_artists)
+    print(f"[done] {made['files']} files in {args.out_dir}: {made['duplicates']} duplicates, "
+          f"{made['missing_genre']} without a genre")
+
+
+if __name__ == "__main__":
+    main()
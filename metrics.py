@@ -0,0 +1,198 @@
+"""
+Stage timers, counters and latency histograms for the library scripts
+
+What it does:
+
+- Times each stage of a run (walk, stat, parse, hash, network, write, move) per call, keeping a
+  count, total, maximum and a latency histogram for each
+- Keeps named counters (files, cache hits, lookups, errors, ...)
+- Lets worker processes hand their numbers back with their results (snapshot/merge)
+- On exit, writes everything as JSON, or as a Prometheus textfile when the path ends in .prom
+  (for node_exporter's textfile collector)
+- With --profile, also dumps cProfile stats for the whole run
+
+Usage:
+    from metrics import add_metrics_arguments, instrumented, metrics
+    add_metrics_arguments(ap)
+    with instrumented(args):
+        for path in metrics.timed("walk", walk(root)):
+            with metrics.stage("parse"):
+                tag = TinyTag.get(path)
+
+    python3 genre_census.py /path/to/music/files --metrics census.json --profile census.prof
+    python3 -m pstats census.prof
+"""
+
+import bisect
+import cProfile
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+# histogram bucket upper bounds, in seconds
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Stage:
+    __slots__ = ("count", "seconds", "max", "buckets")
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.max = 0.0
+        # one slot per bucket plus one for anything slower than the last bound
+        self.buckets = [0] * (len(BUCKETS) + 1)
+
+    def observe(self, seconds):
+        self.count += 1
+        self.seconds += seconds
+        self.max = max(self.max, seconds)
+        self.buckets[bisect.bisect_left(BUCKETS, seconds)] += 1
+
+    def merge(self, data):
+        self.count += data["count"]
+        self.seconds += data["seconds"]
+        self.max = max(self.max, data["max"])
+        self.buckets = [a + b for a, b in zip(self.buckets, data["buckets"])]
+
+    def as_dict(self):
+        return {"count": self.count, "seconds": self.seconds, "max": self.max, "buckets": list(self.buckets)}
+
+
+class Metrics:
+    def __init__(self):
+        self.stages = {}
+        self.counters = Counter()
+        self.lock = threading.Lock()
+        self.started = time.perf_counter()
+
+    def observe(self, name, seconds):
+        with self.lock:
+            stage = self.stages.get(name)
+            if stage is None:
+                stage = self.stages[name] = Stage()
+            stage.observe(seconds)
+
+    @contextmanager
+    def stage(self, name):
+        """time the body of a with block as one call of stage name"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def timed(self, name, iterable):
+        """yield from iterable, timing how long each item took to produce (e.g. a walk)"""
+        it = iter(iterable)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(it)
+            except StopIteration:
+                return
+            self.observe(name, time.perf_counter() - start)
+            yield item
+
+    def count(self, name, n=1):
+        with self.lock:
+            self.counters[name] += n
+
+    def snapshot(self, reset=False):
+        """the numbers recorded so far, as plain data that can cross a process boundary"""
+        with self.lock:
+            data = {"stages": {name: stage.as_dict() for name, stage in self.stages.items()},
+                    "counters": dict(self.counters)}
+            if reset:
+                self.stages = {}
+                self.counters = Counter()
+        return data
+
+    def reset(self):
+        """forget everything; worker processes call this so they don't re-report what they inherited"""
+        self.snapshot(reset=True)
+
+    def merge(self, data):
+        """add a snapshot taken in a worker process"""
+        with self.lock:
+            for name, stage in data["stages"].items():
+                self.stages.setdefault(name, Stage()).merge(stage)
+            self.counters.update(data["counters"])
+
+    def as_json(self, script):
+        data = self.snapshot()
+        data["script"] = script
+        data["elapsed_seconds"] = time.perf_counter() - self.started
+        data["buckets"] = list(BUCKETS)
+        return json.dumps(data, indent=2, sort_keys=True)
+
+    def as_prometheus(self, script):
+        lines = [
+            "# HELP music_stage_seconds Time spent per call in each stage.",
+            "# TYPE music_stage_seconds histogram",
+        ]
+        data = self.snapshot()
+        for name, stage in sorted(data["stages"].items()):
+            labels = f'script="{script}",stage="{name}"'
+            cumulative = 0
+            for bound, n in zip(BUCKETS + ("+Inf",), stage["buckets"]):
+                cumulative += n
+                lines.append(f'music_stage_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f"music_stage_seconds_sum{{{labels}}} {stage['seconds']}")
+            lines.append(f"music_stage_seconds_count{{{labels}}} {stage['count']}")
+        lines += ["# HELP music_events_total Events counted during the run.", "# TYPE music_events_total counter"]
+        for name, n in sorted(data["counters"].items()):
+            lines.append(f'music_events_total{{script="{script}",event="{name}"}} {n}')
+        lines += ["# HELP music_run_seconds Wall time of the run.", "# TYPE music_run_seconds gauge",
+                  f'music_run_seconds{{script="{script}"}} {time.perf_counter() - self.started}']
+        return "\n".join(lines) + "\n"
+
+    def write(self, path, script):
+        """write JSON, or a Prometheus textfile if path ends in .prom; replaced atomically"""
+        text = self.as_prometheus(script) if path.endswith(".prom") else self.as_json(script)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(tmp, path)
+
+    def summary(self):
+        data = self.snapshot()
+        for name, stage in sorted(data["stages"].items(), key=lambda kv: kv[1]["seconds"], reverse=True):
+            mean = stage["seconds"] / stage["count"] * 1000 if stage["count"] else 0
+            print(f"[metrics] {name}: {stage['count']} calls, {stage['seconds']:.2f}s total, "
+                  f"{mean:.2f} ms mean, {stage['max'] * 1000:.1f} ms max")
+        for name, n in sorted(data["counters"].items()):
+            print(f"[metrics] {name}: {n}")
+
+
+# One per process; the scripts and the shared modules all record into it
+metrics = Metrics()
+
+
+def add_metrics_arguments(ap):
+    ap.add_argument("--metrics", help="On exit, write stage timings and counters to this file (Prometheus textfile if it ends in .prom, else JSON).")
+    ap.add_argument("--profile", help="Write cProfile stats for the run to this file (read with: python3 -m pstats FILE).")
+
+
+@contextmanager
+def instrumented(args, script=None):
+    """profile the body if --profile was given, and write --metrics when it exits (even on error)"""
+    script = script or os.path.splitext(os.path.basename(sys.argv[0]))[0]
+    profiler = cProfile.Profile() if getattr(args, "profile", None) else None
+    if profiler is not None:
+        profiler.enable()
+    try:
+        yield metrics
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(args.profile)
+            print(f"[info] Profile written to {args.profile}")
+        if getattr(args, "metrics", None):
+            metrics.summary()
+            metrics.write(args.metrics, script)
+            print(f"[info] Metrics written to {args.metrics}")
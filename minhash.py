@@ -0,0 +1,118 @@
+"""
+MinHash signatures and LSH banding over character 3-grams, vectorized with NumPy
+
+What it does:
+
+- Turns every string into the set of its character 3-grams and computes a MinHash signature for it,
+  for all strings at once (no per-string Python loop over the grams)
+- Splits the signatures into bands and returns the groups of strings that share a band, i.e. the
+  candidates likely to be similar; strings with 3-gram Jaccard similarity s end up sharing a band
+  with probability 1 - (1 - s^rows)^bands, so the pairs that need a real comparison stay few
+- jaccard() gives the exact 3-gram similarity for scoring the candidates
+
+Usage:
+    from minhash import candidate_groups, jaccard, signatures
+    sig = signatures(["the band|song", "band|song", "other|thing"])
+    for group in candidate_groups(sig, bands=8, rows=4):
+        ...   # indexes into the list of strings
+
+    python3 minhash.py   # print the chance of becoming candidates at each similarity
+"""
+
+import numpy as np
+
+BANDS = 8
+ROWS = 4
+
+SEED = 0x5EED
+
+# strings hashed per step in signatures()
+BLOCK = 1024
+
+
+def pad(s):
+    """s with a space either side, so even "" and one-letter strings have a 3-gram"""
+    return f" {s} " if s else "   "
+
+
+def grams(s):
+    """the set of character 3-grams of s"""
+    s = pad(s)
+    return {s[i:i + 3] for i in range(len(s) - 2)}
+
+
+def jaccard(a, b):
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+
+def signatures(strings, num_hashes=BANDS * ROWS, seed=SEED):
+    """
+    (len(strings), num_hashes) uint32 MinHash signatures. all strings are laid
+    out in one code point array, every 3-gram is packed into a 63-bit integer
+    and hashed with num_hashes multiply-shift functions
+    """
+    padded = [pad(s) for s in strings]
+    codes = np.frombuffer("\x00".join(padded).encode("utf-32-le"), dtype=np.uint32).astype(np.uint64)
+    lengths = np.array([len(s) for s in padded], dtype=np.int64)
+    starts = np.concatenate(([0], np.cumsum(lengths + 1)[:-1]))
+    # gram positions: every position with two more characters of the same string after it
+    within = np.ones(len(codes), dtype=bool)
+    within[-2:] = False
+    separators = np.flatnonzero(codes == 0)
+    within[separators] = False
+    within[np.clip(separators - 1, 0, None)] = False
+    within[np.clip(separators - 2, 0, None)] = False
+    positions = np.flatnonzero(within)
+    packed = (codes[positions] << np.uint64(42)) | (codes[positions + 1] << np.uint64(21)) | codes[positions + 2]
+    # each string's grams are contiguous, and pad() gives every string at least one
+    segment_starts = np.searchsorted(positions, starts)
+
+    rng = np.random.default_rng(seed)
+    a = rng.integers(1, 2 ** 63, size=num_hashes, dtype=np.uint64) | np.uint64(1)
+    b = rng.integers(0, 2 ** 63, size=num_hashes, dtype=np.uint64)
+    sig = np.empty((len(strings), num_hashes), dtype=np.uint32)
+    segment_ends = np.append(segment_starts[1:], len(packed))
+    with np.errstate(over="ignore"):
+        # a block of strings at a time, all hash functions at once, so the temporaries stay in cache
+        for first in range(0, len(strings), BLOCK):
+            last = min(first + BLOCK, len(strings))
+            lo, hi = segment_starts[first], segment_ends[last - 1]
+            hashed = packed[lo:hi, None] * a
+            hashed += b
+            hashed >>= np.uint64(32)
+            sig[first:last] = np.minimum.reduceat(hashed, segment_starts[first:last] - lo, axis=0)
+    return sig
+
+
+def candidate_groups(sig, bands=BANDS, rows=ROWS, mask=None):
+    """
+    yield arrays of row indexes that share at least one band of their
+    signatures; a pair can turn up in more than one group
+    """
+    index = np.arange(len(sig)) if mask is None else np.flatnonzero(mask)
+    mix = np.random.default_rng(SEED + 1).integers(1, 2 ** 63, size=rows, dtype=np.uint64) | np.uint64(1)
+    for band in range(bands):
+        # the band's rows folded into one 64-bit key
+        with np.errstate(over="ignore"):
+            keys = (sig[index, band * rows:(band + 1) * rows].astype(np.uint64) * mix).sum(axis=1, dtype=np.uint64)
+        order = np.argsort(keys, kind="stable")
+        sorted_keys = keys[order]
+        boundaries = np.flatnonzero(sorted_keys[1:] != sorted_keys[:-1]) + 1
+        starts = np.concatenate(([0], boundaries))
+        ends = np.concatenate((boundaries, [len(order)]))
+        shared = ends - starts > 1
+        for start, end in zip(starts[shared].tolist(), ends[shared].tolist()):
+            yield index[order[start:end]]
+
+
+def main():
+    print(f"{BANDS} bands of {ROWS} rows")
+    print("similarity  chance of being a candidate")
+    for s in (0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1.0):
+        print(f"{s:10.1f}  {1 - (1 - s ** ROWS) ** BANDS:.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -5,37 +5,67 @@ Move music files to artist-based folders
 - Creates a folder based on the artist name if one does not exist
 - Moves the file to the artist-based folder
 
+All tags are read before anything moves, so the walk never runs into the folders it creates. The
+moves are then checked as one plan (files that would land on the same name, or on a file that is
+already there, are reported and left alone), each artist folder is created once, and every move is
+recorded in a journal that --rollback undoes (see rename_plan.py).
+
 Note: This script is intended to move files that are grouped by something other than artist, such as compilation albums or soundtracks. You probably don't want it iterating over your entire library, so I suggest passing in a file path to the specific compilation folder.
 
 Usage:
+    python3 move_to_artists.py /path/to/music/compilation --dry-run
     python3 move_to_artists.py /path/to/music/compilation
+    python3 move_to_artists.py /mnt/nas/music/compilation --io-depth 32   # overlap the network latency of the reads
+    python3 move_to_artists.py --rollback --journal move_to_artists_journal.jsonl
 """
 
+import argparse
 import os
-import shutil
-import sys
-
-from tinytag import TinyTag
-
-def make_folders(directory):
-    for root, dirs, files in os.walk(directory):
-        for file_name in files:
-            if file_name.lower().endswith('.mp3'):
-                file_path = os.path.join(root, file_name)
-                tag = TinyTag.get(file_path)
-                print(f"Artist: {tag.artist}, Title: {tag.title}")
-                make_path = os.path.join(root, tag.artist)
-                print(f"Make this path: {make_path}")
-                if not os.path.exists(make_path):
-                    os.makedirs(make_path)
-                print(f"Move this file into it: {file_path}")
-                new_file_path = os.path.join(make_path, file_name)
-                os.rename(file_path, new_file_path)
-                print('/n')
+
+from metrics import add_metrics_arguments, instrumented
+from rename_plan import apply_plan, check_plan, read_all, rollback
+from walker import walk
+
+def artist_folder_move(file_path, artist):
+    """where file_path goes for artist: a folder named after the artist next to it"""
+    root, file_name = os.path.split(file_path)
+    if not artist:
+        return None
+    # a folder name can't hold a path separator
+    artist = artist.replace(os.sep, "-")
+    if os.path.basename(root) == artist:
+        return None  # already in its artist folder
+    return os.path.join(root, artist, file_name)
+
+def plan_moves(directory, workers=1, io_depth=0):
+    tags = read_all(walk(directory, exts={"mp3"}), workers=workers, io_depth=io_depth)
+    moves = [(file_path, artist_folder_move(file_path, tag.artist)) for file_path, tag in tags]
+    print(f"[info] Read {len(tags)} files")
+    return check_plan(moves)
 
 def main():
-    directory = sys.argv[1]
-    make_folders(directory)
+    ap = argparse.ArgumentParser(description="Move music files into folders named after their artist tag.")
+    ap.add_argument("directory", nargs="?", help="Folder to sort (e.g., /path/to/music/compilation)")
+    ap.add_argument("--dry-run", action="store_true", help="Only show the moves.")
+    ap.add_argument("--journal", default="move_to_artists_journal.jsonl", help="Where moves are recorded for --rollback (default: move_to_artists_journal.jsonl).")
+    ap.add_argument("--rollback", action="store_true", help="Undo the moves recorded in --journal.")
+    ap.add_argument("--workers", type=int, default=1, help="Read tags on N processes (0 = one per CPU, default: 1).")
+    ap.add_argument("--io-depth", type=int, default=0, help="Header reads kept in flight at once, for libraries on a NAS (default: 0, one at a time).")
+    add_metrics_arguments(ap)
+    args = ap.parse_args()
+
+    with instrumented(args):
+        if args.rollback:
+            if not os.path.exists(args.journal):
+                ap.error(f"no journal at {args.journal}")
+            rollback(args.journal, args.dry_run)
+            return
+        if not args.directory:
+            ap.error("the folder is required unless --rollback is given")
+        plan = plan_moves(args.directory, args.workers or os.cpu_count() or 1, args.io_depth)
+        plan.report(verbose=args.dry_run)
+        if not args.dry_run and plan.moves:
+            apply_plan(plan, args.journal)
 
 if __name__ == "__main__":
     main()
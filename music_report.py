@@ -1,36 +1,60 @@
 """
 Usage:
     python3 music_report.py /path/to/music/files
+    python3 music_report.py /path/to/music/files --walk-state /path/to/walk_state.sqlite
+    python3 music_report.py /path/to/music/files --index /path/to/tags.sqlite --from-index
+    python3 music_report.py /path/to/music/files --snapshot library.npz   # no walk; see snapshot.py
 """
 
 import argparse
 import os
-from collections import Counter, defaultdict
+from collections import Counter
+
+from tag_index import open_index
+from walker import WalkState, walk
 
 def is_mp3(path: str) -> bool:
     return path.lower().endswith(".mp3")
 
-def walk_files(root: str):
-    for dirpath, dirnames, filenames in os.walk(root):
-        for f in filenames:
-            yield os.path.join(dirpath, f)
+def walk_files(root: str, state=None):
+    return walk(root, state=state)
 
 def main():
     ap = argparse.ArgumentParser(description="Summarize a music library by category and artist.")
     ap.add_argument("root", help="Library root (e.g., /Volumes/Drive/Library)")
     ap.add_argument("--top-artists", type=int, default=50, help="How many top artists to show (overall)")
     ap.add_argument("--top-cat-artists", type=int, default=100, help="How many category|artist rows to show")
+    ap.add_argument("--walk-state", help="Walk state database (see walker.py); only folders that changed since the last run are re-listed")
+    ap.add_argument("--index", help="Tag index database (see tag_index.py)")
+    ap.add_argument("--from-index", action="store_true", help="List files from the tag index (kept current by watch.py) without walking the library")
+    ap.add_argument("--snapshot", help="Report from a library snapshot (see snapshot.py) without touching the library")
     args = ap.parse_args()
 
     root = os.path.abspath(args.root)
+    if args.snapshot:
+        from snapshot import Snapshot, music_report
+
+        snapshot = Snapshot.load(args.snapshot)
+        if snapshot.root != root:
+            ap.error(f"{args.snapshot} is a snapshot of {snapshot.root}")
+        print_report(root, *music_report(snapshot), args)
+        return
 
     total = 0
     cat_counts = Counter()
     top_artists = Counter()
     cat_artist_counts = Counter()
     holidays_counts = Counter()
-
-    for path in walk_files(root):
+    state = WalkState(args.walk_state) if args.walk_state else None
+    index = open_index(args.index)
+    if args.from_index:
+        if index is None:
+            ap.error("--from-index needs --index")
+        paths = [path for path, tags in index.items(root)]
+    else:
+        paths = walk_files(root, state)
+
+    for path in paths:
         if not is_mp3(path):
             continue
 
@@ -54,28 +78,41 @@ def main():
             # Holidays/<Subcat>/Artist/track.mp3
             holidays_counts[parts[1]] += 1
 
+    if state is not None:
+        state.close()
+    if index is not None:
+        index.close()
+
+    print_report(root, total, ranked(cat_counts), ranked(top_artists), ranked(cat_artist_counts),
+                 ranked(holidays_counts) if "Holidays" in cat_counts else [], args)
+
+def ranked(counter):
+    return sorted(counter.items(), key=lambda kv: kv[1], reverse=True)
+
+def print_report(root, total, categories, artists, cat_artists, holidays, args):
+    """print the report from (name, count) rows, most common first"""
     print("== Music Report ==")
     print(f"Root: {root}\n")
     print(f"Total MP3 files: {total}\n")
 
     print("-- MP3s per Category{} --")
-    for cat, n in sorted(cat_counts.items(), key=lambda kv: kv[1], reverse=True):
+    for cat, n in categories:
         print(f"{n:7d}  {cat}")
     print()
 
     print("-- Top Artists overall{} --")
-    for artist, n in top_artists.most_common(args.top_artists):
+    for artist, n in artists[:args.top_artists]:
         print(f"{n:7d}  {artist}")
     print()
 
     print("-- Top Artists within each Category{} --")
-    for key, n in sorted(cat_artist_counts.items(), key=lambda kv: kv[1], reverse=True)[:args.top_cat_artists]:
+    for key, n in cat_artists[:args.top_cat_artists]:
         print(f"{n:7d}  {key}")
     print()
 
-    if "Holidays" in cat_counts and holidays_counts:
+    if holidays:
         print("-- Holidays sub-breakdown --")
-        for sub, n in sorted(holidays_counts.items(), key=lambda kv: kv[1], reverse=True):
+        for sub, n in holidays:
             print(f"{n:7d}  {sub}")
         print()
 
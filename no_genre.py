@@ -3,27 +3,46 @@ Find mp3 files that are missing a genre tag
 
 Usage:
     python3 no_genre.py /path/to/music/files
+    python3 no_genre.py /path/to/music/files --index /path/to/tags.sqlite
+    python3 no_genre.py /path/to/music/files --index /path/to/tags.sqlite --from-index
+    python3 no_genre.py /mnt/nas/music --io-depth 32   # overlap the network latency of the reads
 """
 
-import os
-from tinytag import TinyTag
-
-def find_mp3_without_genre(directory):
-    # Iterate over all subdirectories and files
-    for root, dirs, files in os.walk(directory):
-        for file in files:
-            # Check if the file is an MP3
-            if file.lower().endswith('.mp3'):
-                file_path = os.path.join(root, file)
-                tag = TinyTag.get(file_path)
-                
-                # Check if genre metadata is missing
-                if tag.genre is None:
-                    print(file_path)
+import argparse
+
+from tag_index import open_index, prefetch_tags
+from walker import walk
+
+def find_mp3_without_genre_in_index(directory, index):
+    # Answer from the tag index (kept current by watch.py) without walking the library
+    for file_path, tag in index.items(directory):
+        if file_path.lower().endswith('.mp3') and tag.genre is None:
+            print(file_path)
+
+def find_mp3_without_genre(directory, index=None, io_depth=0):
+    # Iterate over every mp3 in the library
+    for file_path, tag in prefetch_tags(walk(directory, exts={"mp3"}), index, io_depth):
+        # Check if genre metadata is missing
+        if tag.genre is None:
+            print(file_path)
 
 def main():
-    directory = sys.argv[1]
-    find_mp3_without_genre(directory)
+    ap = argparse.ArgumentParser(description="Find mp3 files that are missing a genre tag.")
+    ap.add_argument("directory", help="Root folder (e.g., /path/to/music/files)")
+    ap.add_argument("--index", help="Tag index database (see tag_index.py)")
+    ap.add_argument("--from-index", action="store_true", help="Answer from the tag index (kept current by watch.py) without walking the library.")
+    ap.add_argument("--io-depth", type=int, default=0, help="Header reads kept in flight at once, for libraries on a NAS (default: 0, one at a time).")
+    args = ap.parse_args()
+
+    index = open_index(args.index)
+    if args.from_index:
+        if index is None:
+            ap.error("--from-index needs --index")
+        find_mp3_without_genre_in_index(args.directory, index)
+    else:
+        find_mp3_without_genre(args.directory, index, args.io_depth)
+    if index is not None:
+        index.close()
 
 if __name__ == "__main__":
     main()
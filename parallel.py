@@ -0,0 +1,49 @@
+"""
+Helpers for spreading per-file work over a pool of threads or processes
+
+What it does:
+
+- chunked() splits a stream of paths into fixed-size batches
+- ordered_map() runs a function over a stream on a pool and yields the results in input order,
+  keeping only a bounded number of calls in flight so memory stays flat on large libraries
+
+Usage:
+    from parallel import chunked, ordered_map
+    for result in ordered_map(read_chunk, chunked(paths, 256), workers=8, processes=True):
+        ...
+"""
+
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from itertools import islice
+
+
+def chunked(iterable, size):
+    it = iter(iterable)
+    while True:
+        chunk = list(islice(it, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def ordered_map(fn, iterable, workers, depth=None, processes=False, initializer=None, initargs=()):
+    """
+    yield fn(item) for every item, in the order the items were produced.
+    at most depth calls (default: two per worker) are queued at once, so a
+    slow consumer applies backpressure instead of letting results pile up
+    """
+    depth = depth or workers * 2
+    pool_cls = ProcessPoolExecutor if processes else ThreadPoolExecutor
+    with pool_cls(max_workers=workers, initializer=initializer, initargs=initargs) as pool:
+        pending = deque()
+        try:
+            for item in iterable:
+                pending.append(pool.submit(fn, item))
+                if len(pending) >= depth:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+        finally:
+            for future in pending:
+                future.cancel()
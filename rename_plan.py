@@ -0,0 +1,331 @@
+"""
+Plan-then-apply engine for bulk renames and moves
+
+What it does:
+
+- Reads the tags of every file before anything is touched, on several processes (--workers) or with
+  several reads in flight on threads (--io-depth) for a NAS
+- Takes the new path of every file and checks the whole plan up front: two files wanting the same
+  name, names taken by files that stay where they are, and moves onto another filesystem are
+  reported and left out
+- Orders chains of renames (a -> b while b -> c) so no file is overwritten, and breaks cycles
+  (a -> b, b -> a) with a temporary name
+- Applies the plan in one pass: every missing folder is created once, then each file is moved with a
+  single same-filesystem rename
+- Appends every folder it creates and every rename to a JSON-lines journal as it happens, so
+  rollback() can put everything back, also after an interrupted run
+- Used by song_rename.py and move_to_artists.py
+
+Usage:
+    from rename_plan import apply_plan, check_plan, read_all, rollback
+    plan = check_plan((path, new_path(path, tag)) for path, tag in read_all(paths, workers=8))
+    plan.report()
+    apply_plan(plan, "rename_journal.jsonl")
+    rollback("rename_journal.jsonl")
+"""
+
+import json
+import os
+
+from metrics import metrics
+from parallel import chunked, ordered_map
+from tag_index import FIELDS, Tags, get_tags, open_index
+from transfer import same_filesystem
+
+# fsync the journal after this many records (each record is flushed to the os as it is written)
+JOURNAL_SYNC_EVERY = 256
+
+
+def read_tag(path, index=None):
+    try:
+        with metrics.stage("parse"):
+            tag = get_tags(path, index)
+    except Exception as e:
+        print(f"Error reading {path}: {e}")
+        metrics.count("read_errors")
+        return None
+    return Tags(*(getattr(tag, field, None) for field in FIELDS))
+
+
+# Per-process state for workers; set up once by init_worker
+_worker_index = None
+
+
+def init_worker(index_path):
+    global _worker_index
+    metrics.reset()
+    _worker_index = open_index(index_path)
+
+
+def read_chunk(paths):
+    tags = [(path, read_tag(path, _worker_index)) for path in paths]
+    if _worker_index is not None:
+        _worker_index.commit()
+    return tags, metrics.snapshot(reset=True)
+
+
+def read_all(paths, index=None, index_path=None, workers=1, chunk_size=256, io_depth=0):
+    """(path, Tags) for every path that could be read, in the order of paths"""
+    if workers > 1:
+        chunks = ordered_map(read_chunk, chunked(paths, chunk_size), workers,
+                             processes=True, initializer=init_worker, initargs=(index_path,))
+        tags = []
+        for chunk, chunk_metrics in chunks:
+            metrics.merge(chunk_metrics)
+            tags.extend(chunk)
+            print(f"Read {len(tags)} files")
+        return [(path, tag) for path, tag in tags if tag is not None]
+    if io_depth > 0 and index is None:
+        tags = ordered_map(lambda path: (path, read_tag(path)), paths, io_depth)
+    else:
+        # the index is only used from this thread
+        tags = ((path, read_tag(path, index)) for path in paths)
+    return [(path, tag) for path, tag in tags if tag is not None]
+
+
+def temp_name(path):
+    """a free name next to path to park it on while a cycle of renames goes round"""
+    folder, name = os.path.split(path)
+    n = 0
+    while True:
+        candidate = os.path.join(folder, f".{name}.renaming{n or ''}")
+        if not os.path.lexists(candidate):
+            return candidate
+        n += 1
+
+
+class Plan:
+    """the checked, ordered renames of a bulk rename, and the moves left out with the reason"""
+
+    def __init__(self):
+        self.moves = []
+        self.folders = []
+        self.skipped = []
+
+    def __len__(self):
+        return len(self.moves)
+
+    def report(self, verbose=False):
+        for source, target, reason in self.skipped:
+            print(f"Skipping {source}: {reason}")
+        if verbose:
+            for source, target in self.moves:
+                print(f"{source} -> {target}")
+        print(f"[info] Plan: {len(self.moves)} renames, {len(self.folders)} new folders, {len(self.skipped)} skipped")
+
+
+def listing(folder, cache):
+    """the names in folder (an empty set if it doesn't exist yet), listed once"""
+    names = cache.get(folder)
+    if names is None:
+        try:
+            names = set(os.listdir(folder))
+        except FileNotFoundError:
+            names = set()
+        cache[folder] = names
+    return names
+
+
+def missing_folders(folders):
+    """every folder in folders or above them that doesn't exist yet, parents first"""
+    missing = set()
+    for folder in folders:
+        # up to the first folder that exists, or one already on the list
+        while folder and folder not in missing and not os.path.isdir(folder):
+            missing.add(folder)
+            parent = os.path.dirname(folder)
+            if parent == folder:
+                break
+            folder = parent
+    return sorted(missing, key=lambda f: (f.count(os.sep), f))
+
+
+def check_plan(moves):
+    """
+    turn (source, new path) pairs into a Plan of absolute paths. a pair whose
+    new path is None or unchanged is dropped; collisions, names already taken
+    and cross-device moves are skipped with a reason; the rest are ordered so
+    each rename finds its target free
+    """
+    plan = Plan()
+    with metrics.stage("plan"):
+        wanted = []
+        claimed = {}
+        for source, target in moves:
+            if not target:
+                continue
+            # absolute, so a file in the current folder has a folder too ("song.mp3" has none)
+            source, target = os.path.abspath(source), os.path.abspath(target)
+            if target == source:
+                continue
+            if target in claimed:
+                plan.skipped.append((source, target, f"{claimed[target]} gets the same name"))
+                continue
+            claimed[target] = source
+            wanted.append((source, target))
+
+        devices = {}
+        listings = {}
+        kept = []
+        for source, target in wanted:
+            folders = (os.path.dirname(source), os.path.dirname(target))
+            if folders not in devices:
+                try:
+                    devices[folders] = same_filesystem(source, target)
+                except OSError as e:
+                    plan.skipped.append((source, target, str(e)))
+                    continue
+            if not devices[folders]:
+                plan.skipped.append((source, target, "the new folder is on another filesystem (see archive.py)"))
+            else:
+                kept.append((source, target))
+
+        # a taken name is only free if the file there moves away itself; skipping one move can
+        # take that away from another, so repeat until nothing changes
+        while True:
+            moving = {source for source, target in kept}
+            ok = []
+            for source, target in kept:
+                folder, name = os.path.split(target)
+                if name in listing(folder, listings) and target not in moving:
+                    plan.skipped.append((source, target, f"{target} already exists"))
+                else:
+                    ok.append((source, target))
+            if len(ok) == len(kept):
+                break
+            kept = ok
+
+        plan.moves = order_moves(kept)
+        plan.folders = missing_folders({os.path.dirname(target) for source, target in kept})
+    metrics.count("renames_planned", len(plan.moves))
+    return plan
+
+
+def order_moves(moves):
+    """
+    order renames so every target is free when its turn comes: along a chain
+    the last move goes first, and a cycle parks one file on a temporary name
+    """
+    by_source = {source: (source, target) for source, target in moves}
+    done = set()
+    ordered = []
+    for source, target in moves:
+        if source in done:
+            continue
+        chain = [(source, target)]
+        while True:
+            after = by_source.get(chain[-1][1])
+            if after is None or after[0] in done or after[0] == source:
+                break
+            chain.append(after)
+        done.update(s for s, t in chain)
+        if chain[-1][1] == source:
+            # a cycle: park the first file, go round backwards, then unpark it
+            parked = temp_name(source)
+            ordered.append((source, parked))
+            ordered.extend(reversed(chain[1:]))
+            ordered.append((parked, target))
+        else:
+            ordered.extend(reversed(chain))
+    return ordered
+
+
+class RenameJournal:
+    """append-only json-lines record of created folders and renames, written as each one happens"""
+
+    def __init__(self, path, sync_every=JOURNAL_SYNC_EVERY):
+        self.fh = open(path, "a", encoding="utf-8")
+        self.sync_every = sync_every
+        self.unsynced = 0
+
+    def record(self, entry):
+        self.fh.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        self.fh.flush()
+        self.unsynced += 1
+        if self.unsynced >= self.sync_every:
+            self.sync()
+
+    def sync(self):
+        with metrics.stage("journal_sync"):
+            os.fsync(self.fh.fileno())
+        self.unsynced = 0
+
+    def close(self):
+        self.sync()
+        self.fh.close()
+
+
+def apply_plan(plan, journal_path):
+    """create the plan's folders once each, then rename, journaling every step"""
+    journal = RenameJournal(journal_path)
+    renamed = failed = 0
+    try:
+        for folder in plan.folders:
+            with metrics.stage("mkdir"):
+                os.mkdir(folder)
+            journal.record({"type": "mkdir", "path": folder})
+        # a source that couldn't be moved still occupies its name, so the move into it must wait
+        stuck = set()
+        for source, target in plan.moves:
+            if target in stuck:
+                print(f"Not moving {source}: {target} is still there")
+                stuck.add(source)
+                failed += 1
+                continue
+            try:
+                with metrics.stage("rename"):
+                    os.rename(source, target)
+            except OSError as e:
+                print(f"Error moving {source}: {e}")
+                stuck.add(source)
+                failed += 1
+                continue
+            journal.record({"type": "rename", "source": source, "target": target})
+            renamed += 1
+    finally:
+        journal.close()
+    metrics.count("renamed", renamed)
+    print(f"[done] {renamed} renames, {len(plan.folders)} folders created, {failed} failed; journal: {journal_path}")
+
+
+def read_rename_journal(journal_path):
+    entries = []
+    with open(journal_path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                entries.append(json.loads(line))
+            except ValueError:
+                # a line cut short by the interruption
+                continue
+    return entries
+
+
+def rollback(journal_path, dry_run=False):
+    """
+    undo a journal newest first: rename every file back and remove the folders
+    that were created, if they are empty again. the journal is then set aside
+    as journal_path + ".undone"
+    """
+    restored = failed = 0
+    for entry in reversed(read_rename_journal(journal_path)):
+        if entry["type"] == "rename":
+            source, target = entry["source"], entry["target"]
+            if dry_run:
+                print(f"(dry-run) would move back: {target} -> {source}")
+                continue
+            if os.path.lexists(source) or not os.path.lexists(target):
+                print(f"Can't move back {target}: {'it is gone' if not os.path.lexists(target) else f'{source} exists again'}")
+                failed += 1
+                continue
+            with metrics.stage("rename"):
+                os.rename(target, source)
+            restored += 1
+        elif entry["type"] == "mkdir" and not dry_run:
+            try:
+                os.rmdir(entry["path"])
+            except OSError:
+                print(f"Leaving folder {entry['path']}: not empty")
+    if dry_run:
+        return
+    os.replace(journal_path, journal_path + ".undone")
+    print(f"[done] Moved back {restored} files, {failed} failed; journal set aside as {journal_path}.undone")
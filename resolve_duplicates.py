@@ -0,0 +1,183 @@
+"""
+Resolve the duplicate groups found by find_duplicates.py in one batch
+
+What it does:
+
+- Reads the JSON-lines report written by find_duplicates.py; every member already carries its size,
+  length, bitrate and tags, so no audio file is opened again
+- Picks the copy to keep in each group with a chain of keep-policies, tried in order until one
+  prefers a copy: highest bitrate, in a preferred folder (--prefer), best tagged, largest file;
+  when every policy ties, the copy seen first is kept
+- With --dry-run, only prints what it would keep and remove
+- Otherwise deletes the other copies, or moves them under a quarantine folder (keeping their path
+  relative to the library root) with --quarantine, several files at a time
+- Skips a group when its keeper is gone or, unless it was found by content, when a copy has no title,
+  and any copy whose size changed since the scan
+
+Usage:
+    python3 resolve_duplicates.py duplicates.jsonl --dry-run
+    python3 resolve_duplicates.py duplicates.jsonl --keep folder,bitrate --prefer "/music/Alphabetical by Artist"
+    python3 resolve_duplicates.py duplicates.jsonl --quarantine /music/.duplicates --workers 16
+    python3 resolve_duplicates.py duplicates.jsonl --metrics resolve.json   # see metrics.py
+"""
+
+import argparse
+import json
+import os
+import shutil
+
+from metrics import add_metrics_arguments, instrumented, metrics
+from parallel import ordered_map
+
+TAG_FIELDS = ("artist", "title", "album", "genre")
+
+
+def in_preferred(member, preferred):
+    """0 for the first preferred folder, -1 for the second, ... and -len(preferred) for none"""
+    for rank, folder in enumerate(preferred):
+        if member["path"].startswith(folder):
+            return -rank
+    return -len(preferred)
+
+
+# policy -> how good a copy is; higher wins
+POLICIES = {
+    "bitrate": lambda member, preferred: member.get("bitrate") or 0,
+    "folder": in_preferred,
+    "tagged": lambda member, preferred: sum(1 for field in TAG_FIELDS if member.get(field)),
+    "size": lambda member, preferred: member.get("size") or 0,
+}
+
+DEFAULT_POLICIES = "bitrate,folder,tagged"
+
+
+def read_report(report_path):
+    with open(report_path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                group = json.loads(line)
+                if len(group["members"]) > 1:
+                    yield group
+
+
+def preferred_folders(folders, root):
+    """--prefer folders as absolute path prefixes; relative ones are taken from the library root"""
+    return [os.path.join(os.path.abspath(os.path.join(root, folder)), "") for folder in folders]
+
+
+def choose_keeper(members, policies, preferred):
+    """the best member by the policy chain; max() keeps the first of equals, i.e. the first seen"""
+    return max(members, key=lambda member: tuple(POLICIES[p](member, preferred) for p in policies))
+
+
+def plan(groups, policies, prefer, quarantine=None):
+    """
+    (keeper, [(member, destination or None)]) per group; groups whose keeper
+    is no longer there are skipped, so the last copy of a song is never removed
+    """
+    resolved = []
+    for group in groups:
+        # untitled files only matched on their length; they may well be different songs
+        if group.get("mode") != "content" and not all((member.get("title") or "").strip() for member in group["members"]):
+            print(f"Skipping group {group['group']}: a copy has no title")
+            metrics.count("groups_skipped")
+            continue
+        preferred = preferred_folders(prefer, group["root"])
+        keeper = choose_keeper(group["members"], policies, preferred)
+        if not os.path.exists(keeper["path"]):
+            print(f"Skipping group {group['group']}: {keeper['path']} is gone")
+            metrics.count("groups_skipped")
+            continue
+        removals = []
+        for member in group["members"]:
+            if member is keeper:
+                continue
+            destination = None
+            if quarantine is not None:
+                destination = os.path.join(quarantine, os.path.relpath(member["path"], group["root"]))
+            removals.append((member, destination))
+        resolved.append((keeper, removals))
+    return resolved
+
+
+def remove(removal):
+    """delete or quarantine one copy; returns None, or why it was left alone"""
+    member, destination = removal
+    try:
+        if os.path.getsize(member["path"]) != member["size"]:
+            return "changed since the scan"
+        if destination is None:
+            with metrics.stage("delete"):
+                os.remove(member["path"])
+        else:
+            if os.path.exists(destination):
+                return f"{destination} already exists"
+            with metrics.stage("move"):
+                shutil.move(member["path"], destination)
+    except OSError as e:
+        return str(e)
+    return None
+
+
+def describe(member):
+    bitrate = f"{member['bitrate']:.0f} kbps" if member.get("bitrate") else "? kbps"
+    tagged = sum(1 for field in TAG_FIELDS if member.get(field))
+    return f"{member['path']} ({bitrate}, {member['size'] / 1e6:.1f} MB, {tagged}/{len(TAG_FIELDS)} tags)"
+
+
+def resolve(args):
+    policies = [p.strip() for p in args.keep.split(",") if p.strip()]
+    unknown = [p for p in policies if p not in POLICIES]
+    if unknown:
+        raise SystemExit(f"--keep: unknown policy {', '.join(unknown)} (choose from {', '.join(POLICIES)})")
+    quarantine = os.path.abspath(args.quarantine) if args.quarantine else None
+
+    resolved = plan(read_report(args.report), policies, args.prefer, quarantine)
+    removals = [removal for keeper, group_removals in resolved for removal in group_removals]
+    action = "delete" if quarantine is None else "quarantine"
+    if args.dry_run or args.verbose:
+        for keeper, group_removals in resolved:
+            print(f"keep       {describe(keeper)}")
+            for member, destination in group_removals:
+                print(f"{action:<10} {describe(member)}" + (f" -> {destination}" if destination else ""))
+    total_bytes = sum(member["size"] for member, destination in removals)
+    if args.dry_run:
+        print(f"[dry-run] Would {action} {len(removals)} files ({total_bytes / 1e6:.1f} MB) from {len(resolved)} groups")
+        return
+
+    if quarantine is not None:
+        # one makedirs per folder, before the moves start
+        for folder in sorted({os.path.dirname(destination) for member, destination in removals}):
+            os.makedirs(folder, exist_ok=True)
+    done = failed = 0
+    for (member, destination), error in zip(removals, ordered_map(remove, removals, args.workers)):
+        if error is None:
+            done += 1
+            metrics.count("removed")
+        else:
+            failed += 1
+            metrics.count("remove_errors")
+            print(f"Left {member['path']}: {error}")
+    verb = "Deleted" if quarantine is None else f"Moved to {quarantine}:"
+    print(f"[done] {verb} {done} files from {len(resolved)} groups, {failed} left in place")
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Keep one copy of each group in a find_duplicates.py report and remove the rest.")
+    ap.add_argument("report", help="Report written by find_duplicates.py (JSON lines)")
+    ap.add_argument("--keep", default=DEFAULT_POLICIES,
+                    help=f"Keep-policies, tried in order until one prefers a copy: {', '.join(POLICIES)} (default: {DEFAULT_POLICIES})")
+    ap.add_argument("--prefer", action="append", default=[],
+                    help="Folder whose copies the folder policy keeps; absolute, or relative to the library root (repeatable, first wins)")
+    ap.add_argument("--quarantine", help="Move the other copies under this folder instead of deleting them")
+    ap.add_argument("--dry-run", action="store_true", help="Only show what would be kept and removed")
+    ap.add_argument("--verbose", action="store_true", help="Also list every group when not in --dry-run")
+    ap.add_argument("--workers", type=int, default=8, help="Deletes or moves in flight at once (default: 8)")
+    add_metrics_arguments(ap)
+    args = ap.parse_args()
+    with instrumented(args):
+        resolve(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,442 @@
+"""
+Columnar snapshot of a music library, and the reports computed from it
+
+What it does:
+
+- Saves one row per file to a single .npz: size, duration and bitrate as NumPy arrays, and every
+  text field (folder, category, artist, album, genre, extension, ...) as integer codes into a
+  dictionary of distinct values, so a million tracks take tens of MB and load in a fraction of a second
+- Builds the snapshot from a walk (parsing through the tag index when --index is given), or straight
+  from the tag index with --from-index, without touching the library
+- Computes reports with vectorized group-bys over the codes instead of per-file Python loops:
+  the music_report.py sections, the genre_census.py histograms and bucket rollup, and files, size,
+  duration and bitrate per category, genre bucket and bitrate band
+- music_report.py and genre_census.py take --snapshot to report from a snapshot instead of the
+  library, so reports still work while the NAS is offline
+
+Usage:
+    python3 snapshot.py build /path/to/music/files --out library.npz --ext flac --ext m4a --workers 8
+    python3 snapshot.py build /path/to/music/files --out library.npz --index tags.sqlite --from-index
+    python3 snapshot.py report library.npz
+    python3 snapshot.py report library.npz --by category --by bitrate
+
+    python3 music_report.py /path/to/music/files --snapshot library.npz
+    python3 genre_census.py /path/to/music/files --snapshot library.npz --withbuckets
+"""
+
+import argparse
+import os
+import time
+from functools import partial
+
+import numpy as np
+
+from parallel import chunked, ordered_map
+from tag_index import Tags, open_index, parse_tags
+from walker import walk
+
+# text columns, stored dictionary-encoded
+TEXT_COLUMNS = ("dir", "name", "ext", "category", "subcategory", "folder", "artist", "title", "album", "genre")
+
+# numeric columns and their dtypes; a missing duration or bitrate is NaN
+NUMERIC_COLUMNS = {"size": np.int64, "duration": np.float32, "bitrate": np.float32}
+
+# lower bounds of the bitrate bands in the reports, in kbps
+BITRATE_BANDS = (0, 128, 192, 256, 320)
+
+FORMAT_VERSION = 1
+
+
+def pack_strings(values):
+    """a list of strings as one utf-8 buffer plus end offsets, so the .npz needs no pickling"""
+    encoded = [v.encode("utf-8", "surrogateescape") for v in values]
+    ends = np.cumsum([len(b) for b in encoded], dtype=np.int64)
+    return np.frombuffer(b"".join(encoded), dtype=np.uint8), ends
+
+
+def unpack_strings(data, ends):
+    buf = data.tobytes()
+    starts = [0] + ends[:-1].tolist()
+    return [buf[s:e].decode("utf-8", "surrogateescape") for s, e in zip(starts, ends.tolist())]
+
+
+class Snapshot:
+    """
+    the columns of a library snapshot. codes[name][i] indexes dictionary(name)
+    for row i; rows are in the order the files were walked
+    """
+
+    def __init__(self, root, codes, dictionaries, numbers, created=None):
+        self.root = root
+        self.codes = codes
+        self.numbers = numbers
+        self.created = created if created is not None else time.time()
+        # text dictionaries are decoded on first use; the group-bys only need the codes
+        self._dictionaries = dictionaries
+
+    def __len__(self):
+        return len(self.numbers["size"])
+
+    def dictionary(self, name):
+        values = self._dictionaries[name]
+        if isinstance(values, tuple):
+            values = self._dictionaries[name] = unpack_strings(*values)
+        return values
+
+    def path(self, i):
+        folder = self.dictionary("dir")[self.codes["dir"][i]]
+        return os.path.join(self.root, folder, self.dictionary("name")[self.codes["name"][i]])
+
+    def save(self, out_path):
+        arrays = {"root": np.frombuffer(self.root.encode("utf-8", "surrogateescape"), dtype=np.uint8),
+                  "version": np.array(FORMAT_VERSION), "created": np.array(self.created)}
+        for name in TEXT_COLUMNS:
+            arrays[f"codes_{name}"] = self.codes[name]
+            arrays[f"dict_{name}"], arrays[f"ends_{name}"] = pack_strings(self.dictionary(name))
+        for name in NUMERIC_COLUMNS:
+            arrays[f"num_{name}"] = self.numbers[name]
+        tmp = f"{out_path}.{os.getpid()}.tmp.npz"
+        np.savez_compressed(tmp, **arrays)
+        os.replace(tmp, out_path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            if int(data["version"]) != FORMAT_VERSION:
+                raise ValueError(f"{path}: snapshot format {int(data['version'])}, expected {FORMAT_VERSION}")
+            root = data["root"].tobytes().decode("utf-8", "surrogateescape")
+            codes = {name: data[f"codes_{name}"] for name in TEXT_COLUMNS}
+            dictionaries = {name: (data[f"dict_{name}"], data[f"ends_{name}"]) for name in TEXT_COLUMNS}
+            numbers = {name: data[f"num_{name}"] for name in NUMERIC_COLUMNS}
+            created = float(data["created"])
+        return cls(root, codes, dictionaries, numbers, created)
+
+
+class SnapshotBuilder:
+    """collects rows one file at a time, assigning each new text value the next code"""
+
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+        self.lookup = {name: {} for name in TEXT_COLUMNS}
+        self.codes = {name: [] for name in TEXT_COLUMNS}
+        self.numbers = {name: [] for name in NUMERIC_COLUMNS}
+
+    def add(self, path, size, tags):
+        rel = os.path.relpath(path, self.root)
+        parts = rel.split(os.sep)
+        values = {
+            "dir": os.path.dirname(rel),
+            "name": parts[-1],
+            "ext": os.path.splitext(path)[1].lower(),
+            # the same layout music_report.py assumes: Category/[Subcategory/]Artist/track
+            "category": parts[0] if len(parts) >= 2 else "",
+            "subcategory": parts[1] if len(parts) >= 3 else "",
+            "folder": os.path.basename(os.path.dirname(path)),
+            "artist": (tags.artist or "").strip(),
+            "title": (tags.title or "").strip(),
+            "album": (tags.album or "").strip(),
+            "genre": (tags.genre or "").strip(),
+        }
+        for name, value in values.items():
+            lookup = self.lookup[name]
+            code = lookup.get(value)
+            if code is None:
+                code = lookup[value] = len(lookup)
+            self.codes[name].append(code)
+        self.numbers["size"].append(size)
+        self.numbers["duration"].append(tags.duration if tags.duration is not None else np.nan)
+        self.numbers["bitrate"].append(tags.bitrate if tags.bitrate is not None else np.nan)
+
+    def finish(self):
+        codes = {name: np.array(self.codes[name], dtype=np.int32) for name in TEXT_COLUMNS}
+        dictionaries = {name: list(self.lookup[name]) for name in TEXT_COLUMNS}
+        numbers = {name: np.array(self.numbers[name], dtype=dtype) for name, dtype in NUMERIC_COLUMNS.items()}
+        return Snapshot(self.root, codes, dictionaries, numbers)
+
+
+def read_file(path, index=None):
+    """(path, size, Tags) for one file; a file that can't be parsed still counts, with empty tags"""
+    st = os.stat(path)
+    try:
+        tags = index.get(path, st) if index is not None else parse_tags(path)
+    except Exception:
+        tags = Tags(None, None, None, None, None, None)
+    return path, st.st_size, tags
+
+
+def read_chunk(paths, index=None):
+    rows = []
+    for path in paths:
+        try:
+            rows.append(read_file(path, index))
+        except OSError:
+            pass  # gone since the walk
+    return rows
+
+
+def build(root, exts, workers=1, index=None, from_index=False):
+    builder = SnapshotBuilder(root)
+    if from_index:
+        for path, size, tags in index.records(builder.root):
+            if os.path.splitext(path)[1].lower().lstrip(".") in exts:
+                builder.add(path, size, tags)
+        return builder.finish()
+
+    paths = walk(builder.root, exts=exts)
+    if index is not None:
+        rows = (row for chunk in map(partial(read_chunk, index=index), chunked(paths, 256)) for row in chunk)
+    elif workers > 1:
+        rows = (row for chunk in ordered_map(read_chunk, chunked(paths, 256), workers, processes=True) for row in chunk)
+    else:
+        rows = (row for chunk in map(read_chunk, chunked(paths, 256)) for row in chunk)
+    for count, (path, size, tags) in enumerate(rows, 1):
+        builder.add(path, size, tags)
+        if count % 10000 == 0:
+            print(f"[progress] {count} files")
+    return builder.finish()
+
+
+# --- report engine ---
+
+def recode(dictionary, fn, into=None):
+    """
+    apply fn to each distinct value of a column (not to each row). returns an
+    array mapping old codes to codes in the new dictionary, and that dictionary
+    """
+    lookup = {} if into is None else {value: i for i, value in enumerate(into)}
+    values = [] if into is None else into
+    mapping = np.empty(len(dictionary), dtype=np.int32)
+    for code, value in enumerate(dictionary):
+        value = fn(value)
+        new = lookup.get(value)
+        if new is None:
+            new = lookup[value] = len(values)
+            values.append(value)
+        mapping[code] = new
+    return mapping, values
+
+
+def code_of(dictionary, value):
+    """the code of value in a column's dictionary, or -1 if no row has it"""
+    try:
+        return dictionary.index(value)
+    except ValueError:
+        return -1
+
+
+def ranked(keys):
+    """
+    distinct keys with their counts, most common first; ties keep the order
+    in which the keys first appear, as sorting a Counter would
+    """
+    unique, first, counts = np.unique(keys, return_index=True, return_counts=True)
+    order = np.lexsort((first, -counts))
+    return unique[order], counts[order]
+
+
+def count_rows(keys, dictionary):
+    """[(value, count)] for a code array, most common first"""
+    unique, counts = ranked(keys)
+    return [(dictionary[k], int(n)) for k, n in zip(unique.tolist(), counts.tolist())]
+
+
+def ext_mask(snapshot, exts):
+    wanted = np.array([value.lstrip(".") in exts for value in snapshot.dictionary("ext")], dtype=bool)
+    return wanted[snapshot.codes["ext"]]
+
+
+def music_report(snapshot):
+    """the music_report.py sections: (mp3 count, per category, per artist, per category|artist, holidays)"""
+    categories = snapshot.dictionary("category")
+    folders = snapshot.dictionary("folder")
+    mp3 = ext_mask(snapshot, {"mp3"})
+    # files directly under the root have no category and only count towards the total
+    mask = mp3 & (snapshot.codes["category"] != code_of(categories, ""))
+    category = snapshot.codes["category"][mask]
+    folder = snapshot.codes["folder"][mask]
+
+    pairs, counts = ranked(category.astype(np.int64) * len(folders) + folder)
+    cat_artists = [(f"{categories[p // len(folders)]}|{folders[p % len(folders)]}", int(n))
+                   for p, n in zip(pairs.tolist(), counts.tolist())]
+
+    holidays = []
+    if "Holidays" in categories:
+        subcategory = snapshot.codes["subcategory"][mask][category == categories.index("Holidays")]
+        holidays = [(sub, n) for sub, n in count_rows(subcategory, snapshot.dictionary("subcategory")) if sub]
+    return int(mp3.sum()), count_rows(category, categories), count_rows(folder, folders), cat_artists, holidays
+
+
+def census_keys(snapshot, exts):
+    """
+    the artist and genre genre_census.py keys each file on, as codes for the rows
+    with one of exts, and their dictionaries
+    """
+    mask = ext_mask(snapshot, exts)
+    artist_map, artists = recode(snapshot.dictionary("artist"), str)
+    # no artist tag: the folder name stands in, as it does in genre_census.py
+    folder_map, artists = recode(snapshot.dictionary("folder"), str.strip, into=artists)
+    artist_codes = snapshot.codes["artist"][mask]
+    artist = np.where(artist_codes == code_of(snapshot.dictionary("artist"), ""),
+                      folder_map[snapshot.codes["folder"][mask]], artist_map[artist_codes])
+    genre_map, genres = recode(snapshot.dictionary("genre"), lambda g: g or "Unknown")
+    return artist, artists, genre_map[snapshot.codes["genre"][mask]], genres
+
+
+def genre_census(snapshot, exts, bucket_for=None):
+    """
+    the genre_census.py reports: ([(artist, majority genre)], [(genre, files)],
+    and [(bucket, files)] when bucket_for is given)
+    """
+    artist, artists, genre, genres = census_keys(snapshot, exts)
+    genre_rows = count_rows(genre, genres)
+
+    has_artist = artist != code_of(artists, "")
+    pairs, first, counts = np.unique(artist[has_artist].astype(np.int64) * len(genres) + genre[has_artist],
+                                     return_index=True, return_counts=True)
+    pair_artist = pairs // len(genres)
+    majority = []
+    if len(pairs):
+        # per artist, the genre with the most files; ties go to the genre that artist had first
+        order = np.lexsort((first, -counts, pair_artist))
+        best = order[np.r_[True, pair_artist[order][1:] != pair_artist[order][:-1]]]
+        majority = [(artists[a], genres[g]) for a, g in zip(pair_artist[best].tolist(), (pairs[best] % len(genres)).tolist())]
+
+    bucket_rows = None
+    if bucket_for is not None:
+        bucket_map, buckets = recode(genres, bucket_for)
+        bucket_rows = count_rows(bucket_map[genre], buckets)
+    return majority, genre_rows, bucket_rows
+
+
+def bitrate_bands(bitrate):
+    """band index per row (see BITRATE_BANDS), or -1 where the bitrate is unknown"""
+    bands = np.searchsorted(np.array(BITRATE_BANDS, dtype=np.float32), bitrate, side="right") - 1
+    return np.where(np.isnan(bitrate), -1, bands)
+
+
+def band_label(i):
+    if i < 0:
+        return "unknown"
+    if i + 1 < len(BITRATE_BANDS):
+        return f"{BITRATE_BANDS[i]}-{BITRATE_BANDS[i + 1] - 1} kbps"
+    return f"{BITRATE_BANDS[i]}+ kbps"
+
+
+def group_keys(snapshot, by, bucket_for=None):
+    """per-row group codes and their labels for a report dimension"""
+    if by == "bitrate":
+        bands = bitrate_bands(snapshot.numbers["bitrate"])
+        return bands + 1, [band_label(i) for i in range(-1, len(BITRATE_BANDS))]
+    if by == "bucket":
+        bucket_map, buckets = recode(snapshot.dictionary("genre"), bucket_for)
+        return bucket_map[snapshot.codes["genre"]], buckets
+    return snapshot.codes[by], snapshot.dictionary(by)
+
+
+def aggregate(snapshot, by, bucket_for=None, mask=None):
+    """
+    files, bytes, hours of audio and mean bitrate per group of a dimension
+    (any text column, "bucket" or "bitrate"), largest first
+    """
+    keys, labels = group_keys(snapshot, by, bucket_for)
+    size = snapshot.numbers["size"].astype(np.float64)
+    duration = snapshot.numbers["duration"].astype(np.float64)
+    bitrate = snapshot.numbers["bitrate"].astype(np.float64)
+    if mask is not None:
+        keys, size, duration, bitrate = keys[mask], size[mask], duration[mask], bitrate[mask]
+    n = len(labels)
+    files = np.bincount(keys, minlength=n)
+    total_size = np.bincount(keys, weights=size, minlength=n)
+    known_duration = ~np.isnan(duration)
+    hours = np.bincount(keys[known_duration], weights=duration[known_duration], minlength=n) / 3600
+    known_bitrate = ~np.isnan(bitrate)
+    rated = np.bincount(keys[known_bitrate], minlength=n)
+    kbps = np.bincount(keys[known_bitrate], weights=bitrate[known_bitrate], minlength=n)
+    mean_kbps = np.divide(kbps, rated, out=np.zeros(n), where=rated > 0)
+    order = np.lexsort((np.arange(n), -total_size))
+    return [(labels[i], int(files[i]), int(total_size[i]), float(hours[i]), float(mean_kbps[i]))
+            for i in order.tolist() if files[i]]
+
+
+def crosstab(snapshot, rows, columns, bucket_for=None):
+    """file counts for every (row group, column group) pair, e.g. genre bucket x bitrate band"""
+    row_keys, row_labels = group_keys(snapshot, rows, bucket_for)
+    col_keys, col_labels = group_keys(snapshot, columns, bucket_for)
+    table = np.bincount(row_keys.astype(np.int64) * len(col_labels) + col_keys,
+                        minlength=len(row_labels) * len(col_labels)).reshape(len(row_labels), len(col_labels))
+    totals = table.sum(axis=1)
+    used_rows = np.lexsort((np.arange(len(totals)), -totals))[:np.count_nonzero(totals)]
+    used_cols = np.flatnonzero(table.sum(axis=0))
+    return ([row_labels[i] for i in used_rows], [col_labels[j] for j in used_cols],
+            table[np.ix_(used_rows, used_cols)])
+
+
+def print_aggregate(title, rows, top=None):
+    print(f"-- {title} --")
+    print(f"{'files':>9} {'GB':>9} {'hours':>9} {'kbps':>6}  group")
+    for label, files, size, hours, kbps in rows[:top]:
+        print(f"{files:9d} {size / 1e9:9.2f} {hours:9.1f} {kbps:6.0f}  {label or '(none)'}")
+    print()
+
+
+def print_crosstab(title, labels, columns, table):
+    print(f"-- {title} --")
+    width = max([len(label) for label in labels] + [5])
+    print(f"{'':<{width}}  " + " ".join(f"{c:>14}" for c in columns))
+    for label, row in zip(labels, table.tolist()):
+        print(f"{label:<{width}}  " + " ".join(f"{n:>14d}" for n in row))
+    print()
+
+
+def report(args):
+    from genres import bucket_for
+
+    started = time.perf_counter()
+    snapshot = Snapshot.load(args.snapshot)
+    loaded = time.perf_counter()
+    print("== Library Snapshot Report ==")
+    print(f"Root: {snapshot.root}")
+    print(f"Taken: {time.strftime('%Y-%m-%d %H:%M', time.localtime(snapshot.created))}, {len(snapshot)} files\n")
+    for by in args.by or ("category", "ext", "bucket", "bitrate"):
+        print_aggregate(f"By {by}", aggregate(snapshot, by, bucket_for), args.top)
+    labels, columns, table = crosstab(snapshot, "bucket", "bitrate", bucket_for)
+    print_crosstab("Genre bucket x bitrate", labels, columns, table)
+    print(f"[info] loaded in {loaded - started:.2f}s, reports in {time.perf_counter() - loaded:.2f}s")
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Build a columnar library snapshot, or report from one.")
+    sub = ap.add_subparsers(dest="command", required=True)
+
+    b = sub.add_parser("build", help="Walk (or read the tag index for) a library and save a snapshot")
+    b.add_argument("root", help="Root folder (e.g., /path/to/music/files)")
+    b.add_argument("--out", required=True, help="Snapshot file to write (.npz)")
+    b.add_argument("--ext", action="append", default=["mp3"], help="File extensions to include (default: mp3).")
+    b.add_argument("--workers", type=int, default=1, help="Parse tags on N processes (0 = one per CPU, default: 1).")
+    b.add_argument("--index", help="Tag index database (see tag_index.py); only new or changed files are re-parsed.")
+    b.add_argument("--from-index", action="store_true", help="Build from the tag index alone, without touching the library.")
+
+    r = sub.add_parser("report", help="Files, size, duration and bitrate per group from a snapshot")
+    r.add_argument("snapshot", help="Snapshot file (.npz)")
+    r.add_argument("--by", action="append", choices=("category", "subcategory", "folder", "artist", "album", "genre", "ext", "bucket", "bitrate"),
+                   help="Group by this column (repeatable; default: category, ext, bucket, bitrate)")
+    r.add_argument("--top", type=int, default=50, help="Rows to show per report (default: 50)")
+    args = ap.parse_args()
+
+    if args.command == "report":
+        return report(args)
+
+    exts = set(e.lower().lstrip(".") for e in args.ext)
+    index = open_index(args.index)
+    if args.from_index and index is None:
+        ap.error("--from-index needs --index")
+    started = time.perf_counter()
+    snapshot = build(args.root, exts, args.workers or os.cpu_count() or 1, index, args.from_index)
+    if index is not None:
+        index.close()
+    snapshot.save(args.out)
+    print(f"[done] {len(snapshot)} files in {time.perf_counter() - started:.1f}s; snapshot written to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,33 +1,96 @@
 """
 Rename all files in a given folder using artist and title tags
 
+What it does:
+
+- Prefixes each mp3's file name with its artist tag ("Song.mp3" -> "Artist-Song.mp3"), unless it
+  already starts with it, and drops a trailing artist from the old name
+- Reads every file's tags first (--workers processes, or --io-depth reads in flight on a NAS), then
+  plans all the new names at once: names that two files would get, or that are already taken, are
+  reported and left alone (see rename_plan.py)
+- Renames in one pass and records each rename in a journal, so --rollback can undo the run
+- With --recursive, renames the files in every subfolder too
+
 Usage:
+    python3 song_rename.py /path/to/music/files --dry-run
     python3 song_rename.py /path/to/music/files
+    python3 song_rename.py /path/to/music/files --recursive --workers 8 --journal renames.jsonl
+    python3 song_rename.py --rollback --journal renames.jsonl
 """
 
+import argparse
 import os
-from os import listdir
-from os.path import isfile, join
-import sys
 
-from tinytag import TinyTag
+from metrics import add_metrics_arguments, instrumented
+from rename_plan import apply_plan, check_plan, read_all, rollback
+from tag_index import open_index
+from walker import scan_dir, walk
+
+
+def new_filename(mp3, artist):
+    """the file name mp3 gets for artist, or None to leave it as it is"""
+    if not artist:
+        return None
+    # a file name can't hold a path separator
+    artist = artist.replace(os.sep, "-")
+    if mp3.startswith(artist):
+        return None
+    new_filename = artist + "-" + mp3
+    if new_filename.endswith(artist + ".mp3"):
+        new_filename = new_filename[:-len(artist + ".mp3")] + ".mp3"
+        new_filename = new_filename.replace(" - .mp3", ".mp3")
+    return new_filename
+
+
+def mp3_files(directory, recursive=False):
+    if recursive:
+        return walk(directory, exts={"mp3"})
+    files, subdirs = scan_dir(directory)
+    return [os.path.join(directory, f) for f in files if f.endswith(".mp3")]
+
+
+def plan_renames(directory, recursive=False, index=None, index_path=None, workers=1, io_depth=0):
+    tags = read_all(mp3_files(directory, recursive), index, index_path, workers, io_depth=io_depth)
+    moves = []
+    for path, tag in tags:
+        folder, mp3 = os.path.split(path)
+        name = new_filename(mp3, tag.artist)
+        if name is not None:
+            moves.append((path, os.path.join(folder, name)))
+    print(f"[info] Read {len(tags)} files, {len(moves)} to rename")
+    return check_plan(moves)
 
-inpath = sys.argv[1]
 
-mp3files = [f for f in listdir(inpath) if isfile(join(inpath, f)) and f.endswith(".mp3")]
-for mp3 in mp3files:
-    tag: TinyTag = TinyTag.get(inpath+mp3)
+def main():
+    ap = argparse.ArgumentParser(description="Prefix mp3 file names with their artist tag.")
+    ap.add_argument("directory", nargs="?", help="Folder to rename (e.g., /path/to/music/files)")
+    ap.add_argument("--recursive", action="store_true", help="Also rename the files in every subfolder.")
+    ap.add_argument("--dry-run", action="store_true", help="Only show the renames.")
+    ap.add_argument("--journal", default="song_rename_journal.jsonl", help="Where renames are recorded for --rollback (default: song_rename_journal.jsonl).")
+    ap.add_argument("--rollback", action="store_true", help="Undo the renames recorded in --journal.")
+    ap.add_argument("--index", help="Tag index database (see tag_index.py)")
+    ap.add_argument("--workers", type=int, default=1, help="Read tags on N processes (0 = one per CPU, default: 1).")
+    ap.add_argument("--io-depth", type=int, default=0, help="Header reads kept in flight at once, for libraries on a NAS (default: 0, one at a time).")
+    add_metrics_arguments(ap)
+    args = ap.parse_args()
 
-    title = tag.title
-    artist = tag.artist
+    with instrumented(args):
+        if args.rollback:
+            if not os.path.exists(args.journal):
+                ap.error(f"no journal at {args.journal}")
+            rollback(args.journal, args.dry_run)
+            return
+        if not args.directory:
+            ap.error("the folder is required unless --rollback is given")
+        workers = args.workers or os.cpu_count() or 1
+        index = open_index(args.index) if workers == 1 else None
+        plan = plan_renames(args.directory, args.recursive, index, args.index, workers, args.io_depth)
+        if index is not None:
+            index.close()
+        plan.report(verbose=args.dry_run)
+        if not args.dry_run and plan.moves:
+            apply_plan(plan, args.journal)
 
-    print(mp3, artist)
 
-    if artist and not mp3.startswith(artist):
-        new_filename = artist + "-" + mp3
-        if new_filename.endswith(artist+".mp3"):
-            print(new_filename, "ENDS WITH", artist)
-            new_filename = new_filename[:-len(artist+".mp3")] +".mp3"
-            new_filename = new_filename.replace(" - .mp3", ".mp3")
-        print("NEW FILENAME", new_filename)
-        os.rename(inpath+mp3, inpath+new_filename)
+if __name__ == "__main__":
+    main()
@@ -2,27 +2,57 @@
 """
 mutagen-based music tag fixer
 
+files stream through a pipeline: the walk feeds worker processes that parse each file once (flac
+and mp4 through fast_tags, which reads only the tag blocks) and compute suggestions, the main loop
+applies folder overrides and prompts in path order, and a writer stage applies the tags. output
+starts immediately and memory stays flat on big libraries.
+
+with --backup, every change is appended to a json-lines journal as it is made (original and new
+tags), so a crash mid-run keeps everything written so far. `undo` replays a journal backwards,
+restoring the original artist/title of each file without rescanning the library.
+
 usage:
     python tagfixer.py /path/to/music --dry-run
-    python tagfixer.py /path/to/music --auto --backup backup.json
+    python tagfixer.py /path/to/music --auto --backup backup.jsonl
+    python tagfixer.py /path/to/music --auto --workers 8 --write-workers 4
+    python tagfixer.py undo backup.jsonl
+    python tagfixer.py /path/to/music --auto --metrics tagfixer.json --profile tagfixer.prof
 """
 
 import argparse
 import json
+import os
 import re
+import sys
+import time
+from functools import partial
 from pathlib import Path
 from typing import Optional, Tuple, Dict
 
 from mutagen import File as MutagenFile
 from mutagen.easyid3 import EasyID3
+from mutagen.id3 import ID3NoHeaderError
 from mutagen.flac import FLAC
 from mutagen.mp4 import MP4
 
-# heuristics
-# TRACKNUM_RE = re.compile(r'^\s*\d+\s*[-._\s]\s*')
-TRACKNUM_RE = re.compile(r'^\d{1,2}[-.]\s*|\d+\s*-\s*')
-BRACKET_RE = re.compile(r'[\[\(\{].*?[\]\)\}]')  # remove bracketed bits
-UNDERSCORE_RE = re.compile(r'_+')
+import fast_tags
+from metrics import add_metrics_arguments, instrumented, metrics
+from parallel import ordered_map
+from track_names import BRACKET_RE, TRACKNUM_RE, UNDERSCORE_RE  # heuristics shared with find_duplicates.py
+from walker import walk
+
+# the keys each container stores artist/title under, as read_tags reports them
+FIELD_KEYS = {
+    'artist': ('artist', 'ARTIST', '\xa9ART'),
+    'title': ('title', 'TITLE', '\xa9nam'),
+}
+MP4_KEYS = {'artist': '\xa9ART', 'title': '\xa9nam'}
+
+# containers read with fast_tags (metadata blocks/atoms only) instead of a full mutagen load
+FAST_SUFFIXES = ('.flac', '.m4a', '.mp4', '.m4b')
+
+# fsync the journal after this many records (each record is flushed to the os as it is written)
+JOURNAL_SYNC_EVERY = 256
 
 def parse_artist_from_path(path: Path, base: Path) -> Optional[str]:
     """
@@ -53,25 +83,31 @@ def parse_title_from_filename(fname: str) -> str:
     return name
 
 def read_tags(path: Path) -> Dict[str, str]:
-    mf = MutagenFile(path)
+    suffix = path.suffix.lower()
+    if suffix in FAST_SUFFIXES:
+        # only the VORBIS_COMMENT block / ilst atom is read; the audio is never touched
+        try:
+            return {k: v for k, v in fast_tags.read_tags(str(path))._asdict().items() if v}
+        except ValueError:
+            pass  # not what the suffix says; let mutagen sort it out
+    # a single parse: mp3s are opened with easy=True so their tags come back as EasyID3 keys
+    mf = MutagenFile(path, easy=suffix == '.mp3')
     if mf is None:
         return {}
     tags = {}
     # handle common containers
     try:
-        if path.suffix.lower() == '.mp3':
-            tags_obj = EasyID3(path)
+        if suffix == '.mp3':
+            tags_obj = mf.tags
             for k in tags_obj.keys():
                 tags[k] = ','.join(tags_obj.get(k, []))
-        elif path.suffix.lower() == '.flac':
-            f = FLAC(path)
-            for k, v in f.tags.items():
+        elif suffix == '.flac':
+            for k, v in mf.tags.items():
                 tags[k] = ','.join(v)
-        elif path.suffix.lower() in ('.m4a', '.mp4', '.m4b'):
-            f = MP4(path)
+        elif suffix in ('.m4a', '.mp4', '.m4b'):
             # mp4 tags are keyed differently; use common keys where possible
-            for k, v in f.tags.items():
-                tags[k] = str(v)
+            for k, v in mf.tags.items():
+                tags[k] = ','.join(map(str, v)) if isinstance(v, list) else str(v)
         else:
             # generic fallback: list what's present
             for k, v in mf.tags.items() if mf.tags else []:
@@ -84,7 +120,11 @@ def read_tags(path: Path) -> Dict[str, str]:
 def write_tags(path: Path, artist: Optional[str], title: Optional[str]):
     suffix = path.suffix.lower()
     if suffix == '.mp3':
-        tags = EasyID3()
+        # load the existing tag, so album, genre, track number etc. survive the write
+        try:
+            tags = EasyID3(path)
+        except ID3NoHeaderError:
+            tags = EasyID3()
         if artist:
             tags['artist'] = artist
         if title:
@@ -116,6 +156,159 @@ def write_tags(path: Path, artist: Optional[str], title: Optional[str]):
                 mf['title'] = title
             mf.save()
 
+def field_value(tags: Dict[str, str], field: str) -> Optional[str]:
+    for key in FIELD_KEYS[field]:
+        if tags.get(key):
+            return tags[key]
+    return None
+
+def restore_tags(path: Path, values: Dict[str, Optional[str]]):
+    """
+    put fields back to the given values, removing the ones that are None.
+    unlike write_tags, the file's other tags are left alone
+    """
+    suffix = path.suffix.lower()
+    if suffix == '.mp3':
+        try:
+            f = EasyID3(path)
+        except ID3NoHeaderError:
+            f = EasyID3()
+    elif suffix == '.flac':
+        f = FLAC(path)
+        if f.tags is None:
+            f.add_tags()
+    elif suffix in ('.m4a', '.mp4', '.m4b'):
+        f = MP4(path)
+        if f.tags is None:
+            f.add_tags()
+        for field, value in values.items():
+            key = MP4_KEYS[field]
+            if value:
+                f.tags[key] = [value]
+            elif key in f.tags:
+                del f.tags[key]
+        f.save()
+        return
+    else:
+        f = MutagenFile(path, easy=True)
+        if f is None:
+            raise ValueError(f"unsupported file: {path}")
+        if f.tags is None:
+            f.add_tags()
+    tags = f if suffix == '.mp3' else f.tags
+    for field, value in values.items():
+        if value:
+            tags[field] = value
+        elif field in tags:
+            del tags[field]
+    if suffix == '.mp3':
+        f.save(path)
+    else:
+        f.save()
+
+class TagJournal:
+    """
+    append-only json-lines record of tag changes. each record is written before
+    the change is applied and flushed to the os straight away; fsync is batched
+    """
+    def __init__(self, path: Path, sync_every: int = JOURNAL_SYNC_EVERY):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.path = path
+        self.sync_every = sync_every
+        self.fh = open(path, 'a', encoding='utf8')
+        self.unsynced = 0
+        self.records = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def record(self, path: Path, before: Dict[str, str], after: Dict[str, Optional[str]]):
+        self.fh.write(json.dumps({'path': str(path), 'before': before, 'after': after}, ensure_ascii=False) + '\n')
+        self.fh.flush()
+        self.records += 1
+        self.unsynced += 1
+        if self.unsynced >= self.sync_every:
+            self.sync()
+
+    def sync(self):
+        with metrics.stage("journal_sync"):
+            self.fh.flush()
+            os.fsync(self.fh.fileno())
+        self.unsynced = 0
+
+    def close(self):
+        self.sync()
+        self.fh.close()
+
+def read_journal(journal_path: Path):
+    """(path, original values of the changed fields, values written) for every file, most recent change first"""
+    first = {}
+    latest = {}
+    with open(journal_path, encoding='utf8') as fh:
+        for line in fh:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # a line cut short by a crash
+                continue
+            path = record['path']
+            after = record['after']
+            # the first change to a field holds its original value; later changes only move the file
+            # to the front of the replay order
+            original = first.setdefault(path, {})
+            for field in after:
+                original.setdefault(field, field_value(record['before'], field))
+            written = latest.pop(path, {})
+            written.update(after)
+            latest[path] = written
+    for path in reversed(latest):
+        yield Path(path), first[path], latest[path]
+
+def undo_entry(entry, force=False):
+    path, original, written = entry
+    try:
+        if not force:
+            with metrics.stage("parse"):
+                current = read_tags(path)
+            for field, value in written.items():
+                if value and field_value(current, field) != value:
+                    return path, 'skipped', f"{field} changed since the run"
+        with metrics.stage("write"):
+            restore_tags(path, original)
+    except Exception as exc:
+        return path, 'failed', exc
+    return path, 'restored', None
+
+def undo(argv):
+    p = argparse.ArgumentParser(prog='tagfixer.py undo', description="restore the tags recorded in a tag-fixer journal")
+    p.add_argument('journal', type=Path, help="journal written with --backup")
+    p.add_argument('--workers', type=int, default=8, help="threads restoring files (default: 8)")
+    p.add_argument('--force', action='store_true', help="restore even files whose tags changed after the run")
+    p.add_argument('--dry-run', action='store_true', help="don't write anything, just show")
+    add_metrics_arguments(p)
+    args = p.parse_args(argv)
+    with instrumented(args, 'tag-fixer-undo'):
+        replay(args)
+
+def replay(args):
+    entries = read_journal(args.journal)
+    if args.dry_run:
+        for path, original, written in entries:
+            print("(dry-run) would restore:", path, original)
+        return
+
+    counts = {'restored': 0, 'skipped': 0, 'failed': 0}
+    for path, outcome, detail in ordered_map(partial(undo_entry, force=args.force), entries, max(args.workers, 1)):
+        counts[outcome] += 1
+        if outcome == 'skipped':
+            print("skipped:", path, ":", detail)
+        elif outcome == 'failed':
+            print("failed to restore tags for", path, ":", detail)
+    print(f"[done] {counts['restored']} restored, {counts['skipped']} skipped, {counts['failed']} failed")
+
 def interactive_confirm(path: Path, current: Dict[str, str], suggested_artist: Optional[str],
                         suggested_title: Optional[str]) -> Tuple[Optional[str], Optional[str]]:
     print("\nfile:", path)
@@ -142,34 +335,43 @@ def interactive_confirm(path: Path, current: Dict[str, str], suggested_artist: O
             return suggested_artist, suggested_title
         print("please enter one of y/a/e/s/f")
 
-def is_supported_file(path: Path) -> bool:
-    return path.suffix.lower() in ('.mp3', '.flac', '.m4a', '.mp4', '.m4b')
+SUPPORTED_EXTS = ('mp3', 'flac', 'm4a', 'mp4', 'm4b')
+ARTIST_TITLE_RE = re.compile(r'^(?P<artist>[^-–—]+)\s*[-–—]\s*(?P<title>.+)$')
 
-def main():
-    p = argparse.ArgumentParser()
-    p.add_argument('base', type=Path, help="base folder for your music")
-    p.add_argument('--dry-run', action='store_true', help="don't write anything, just show")
-    p.add_argument('--auto', action='store_true', help="auto accept suggestions without prompting")
-    p.add_argument('--backup', type=Path, default=None, help="json backup file for original tags")
-    args = p.parse_args()
-
-    base: Path = args.base.expanduser().resolve()
-    backup = {}
-    folder_artist_cache = {}
+def is_supported_file(path: Path) -> bool:
+    return path.suffix.lower().lstrip('.') in SUPPORTED_EXTS
 
-    for path in sorted(base.rglob('*')):
-        if not path.is_file() or not is_supported_file(path):
-            continue
+def suggest(file_path: str, base: Path):
+    """
+    parse one file and work out the artist/title to suggest for it.
+    runs in the worker processes, so it only depends on the file itself;
+    the parse time is handed back for the metrics
+    """
+    path = Path(file_path)
+    started = time.perf_counter()
+    current_tags = read_tags(path)
+    parse_seconds = time.perf_counter() - started
+    suggested_artist = current_tags.get('artist') or current_tags.get('ARTIST') or parse_artist_from_path(path, base)
+    suggested_title = current_tags.get('title') or current_tags.get('TITLE') or parse_title_from_filename(path.name)
 
-        current_tags = read_tags(path)
-        suggested_artist = current_tags.get('artist') or current_tags.get('ARTIST') or parse_artist_from_path(path, base)
-        suggested_title = current_tags.get('title') or current_tags.get('TITLE') or parse_title_from_filename(path.name)
+    # more heuristics: if filename contains "artist - title" pattern, respect that
+    m = ARTIST_TITLE_RE.match(path.stem)
+    if m:
+        suggested_artist = m.group('artist').strip()
+        suggested_title = m.group('title').strip()
+    return path, current_tags, suggested_artist, suggested_title, parse_seconds
 
-        # more heuristics: if filename contains "artist - title" pattern, respect that
-        m = re.match(r'^(?P<artist>[^-–—]+)\s*[-–—]\s*(?P<title>.+)$', Path(path).stem)
-        if m:
-            suggested_artist = m.group('artist').strip()
-            suggested_title = m.group('title').strip()
+def decide(suggestions, args, journal=None):
+    """
+    the in-order stage: folder overrides, prompts and the journal. yields the
+    (path, artist, title) writes for the writer stage
+    """
+    folder_artist_cache = {}
+    for count, (path, current_tags, suggested_artist, suggested_title, parse_seconds) in enumerate(suggestions, 1):
+        metrics.observe("parse", parse_seconds)
+        metrics.count("files")
+        if count % 1000 == 0:
+            print(f"[progress] {count} files")
 
         # folder-level override
         folder_key = str(path.parent)
@@ -186,29 +388,73 @@ def main():
                 # note: interactive_confirm could be expanded to detect "apply to folder"
                 pass
 
-        # backup original tags
-        backup[str(path)] = current_tags
-
         if chosen_artist is None and chosen_title is None:
             print("skipping", path)
+            metrics.count("skipped")
             continue
 
         if args.dry_run:
             print("(dry-run) would set:", chosen_artist, "|", chosen_title)
             continue
 
-        try:
-            write_tags(path, chosen_artist, chosen_title)
-            print("updated:", path)
-        except Exception as exc:
-            print("failed to write tags for", path, ":", exc)
+        # journal the original tags before the write is queued
+        if journal is not None:
+            after = {field: value for field, value in (('artist', chosen_artist), ('title', chosen_title)) if value}
+            journal.record(path, current_tags, after)
+
+        yield path, chosen_artist, chosen_title
+
+def apply_write(job):
+    path, artist, title = job
+    try:
+        with metrics.stage("write"):
+            write_tags(path, artist, title)
+    except Exception as exc:
+        metrics.count("write_errors")
+        return path, exc
+    return path, None
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == 'undo':
+        return undo(sys.argv[2:])
+
+    p = argparse.ArgumentParser()
+    p.add_argument('base', type=Path, help="base folder for your music")
+    p.add_argument('--dry-run', action='store_true', help="don't write anything, just show")
+    p.add_argument('--auto', action='store_true', help="auto accept suggestions without prompting")
+    p.add_argument('--backup', type=Path, default=None, help="json-lines journal of original and new tags, for undo")
+    p.add_argument('--workers', type=int, default=os.cpu_count() or 1, help="processes reading tags ahead of the main loop (default: one per cpu)")
+    p.add_argument('--write-workers', type=int, default=4, help="threads writing tags (default: 4)")
+    add_metrics_arguments(p)
+    args = p.parse_args()
+    with instrumented(args, 'tag-fixer'):
+        fix(args)
+
+def fix(args):
+    base: Path = args.base.expanduser().resolve()
+    journal = TagJournal(args.backup) if args.backup and not args.dry_run else None
 
-    if args.backup:
-        args.backup.parent.mkdir(parents=True, exist_ok=True)
-        with open(args.backup, 'w', encoding='utf8') as fh:
-            json.dump(backup, fh, ensure_ascii=False, indent=2)
-        print("backup saved to", args.backup)
+    # walk -> parse + suggest (worker processes) -> decide (in order) -> write (threads);
+    # every stage streams with a bounded queue, so output starts at once and memory stays flat
+    paths = metrics.timed("walk", walk(str(base), exts=SUPPORTED_EXTS, sort=True))
+    if args.workers > 1:
+        suggestions = ordered_map(partial(suggest, base=base), paths, args.workers, processes=True)
+    else:
+        suggestions = (suggest(file_path, base) for file_path in paths)
+    # when prompting, write each answer before asking the next question
+    depth = None if args.auto else 1
+    writes = ordered_map(apply_write, decide(suggestions, args, journal), max(args.write_workers, 1), depth=depth)
+
+    try:
+        for path, exc in writes:
+            if exc is None:
+                print("updated:", path)
+            else:
+                print("failed to write tags for", path, ":", exc)
+    finally:
+        if journal is not None:
+            journal.close()
+            print(f"journal: {journal.records} changes recorded in {args.backup}")
 
 if __name__ == '__main__':
     main()
-
@@ -0,0 +1,277 @@
+"""
+Persistent, incremental tag index for a music library
+
+What it does:
+
+- Stores artist, title, album, genre, duration and bitrate for every file in a SQLite database
+- Keys each row on path + size + mtime + inode, so only new or changed files get re-parsed
+- Lets the other scripts read tags from the index instead of calling TinyTag.get on every run
+- Drops rows for files that have disappeared from the library
+- prefetch_tags() keeps several header reads in flight for the scripts' --io-depth, for libraries on
+  a NAS where every read waits on the network
+- Parses with TinyTag, or with mutagen (as tag-fixer.py does) when TinyTag isn't available or --reader mutagen is given
+
+Usage:
+    python3 tag_index.py /path/to/music/files --index /path/to/tags.sqlite
+
+    The other scripts accept the same index with --index, e.g.:
+    python3 genre_census.py /path/to/music/files --index /path/to/tags.sqlite
+"""
+
+import argparse
+import os
+import sqlite3
+from collections import namedtuple
+
+from parallel import ordered_map
+from walker import walk
+
+FIELDS = ("artist", "title", "album", "genre", "duration", "bitrate")
+
+# Same attribute names as a TinyTag object, so callers can use either one
+Tags = namedtuple("Tags", FIELDS)
+
+DEFAULT_INDEX = os.path.expanduser("~/.cache/music-analysis/tags.sqlite")
+
+# Commit after this many re-parsed files, so an interrupted scan keeps its progress
+COMMIT_EVERY = 500
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tags (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    inode INTEGER NOT NULL,
+    artist TEXT,
+    title TEXT,
+    album TEXT,
+    genre TEXT,
+    duration REAL,
+    bitrate REAL
+)
+"""
+
+
+def parse_tags_tinytag(path):
+    from tinytag import TinyTag
+
+    tag = TinyTag.get(path)
+    return Tags(*(getattr(tag, field, None) for field in FIELDS))
+
+
+def parse_tags_mutagen(path):
+    from mutagen import File as MutagenFile
+
+    f = MutagenFile(path, easy=True)
+    if f is None:
+        raise ValueError(f"unsupported file: {path}")
+    values = []
+    for key in ("artist", "title", "album", "genre"):
+        v = f.tags.get(key) if f.tags else None
+        values.append(v[0] if v else None)
+    info = getattr(f, "info", None)
+    duration = getattr(info, "length", None)
+    bitrate = getattr(info, "bitrate", None)
+    return Tags(*values, duration, bitrate / 1000 if bitrate else None)
+
+
+def parse_tags(path):
+    """parse with TinyTag, or with mutagen when TinyTag isn't installed"""
+    try:
+        import tinytag  # noqa: F401
+    except ImportError:
+        return parse_tags_mutagen(path)
+    return parse_tags_tinytag(path)
+
+
+PARSERS = {"auto": parse_tags, "tinytag": parse_tags_tinytag, "mutagen": parse_tags_mutagen}
+
+
+class TagIndex:
+    def __init__(self, db_path, parser=parse_tags):
+        db_dir = os.path.dirname(os.path.abspath(db_path))
+        os.makedirs(db_dir, exist_ok=True)
+        self.db_path = db_path
+        self.parser = parser
+        self.conn = sqlite3.connect(db_path, timeout=60)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(SCHEMA)
+        self.conn.commit()
+        self.hits = 0
+        self.misses = 0
+        self._pending = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def get(self, path, st=None):
+        """
+        return the Tags for path, re-parsing the file only if it is new or
+        its size, mtime or inode changed since it was indexed
+        """
+        path = os.path.abspath(path)
+        if st is None:
+            st = os.stat(path)
+        row = self._row(path)
+        if row and row[:3] == (st.st_size, st.st_mtime_ns, st.st_ino):
+            self.hits += 1
+            return Tags(*row[3:])
+
+        tags = self.parser(path)
+        self._store(path, st, tags)
+        return tags
+
+    def get_many(self, paths, io_depth=8):
+        """
+        (path, Tags) for every path, in order, with up to io_depth stats and
+        re-parses in flight on threads. the database is only used from the
+        calling thread: rows are looked up as paths are queued and re-parsed
+        tags are stored as the results come back
+        """
+        def load(item):
+            path, full_path, row = item
+            st = os.stat(full_path)
+            if row and row[:3] == (st.st_size, st.st_mtime_ns, st.st_ino):
+                return path, full_path, st, Tags(*row[3:]), False
+            return path, full_path, st, self.parser(full_path), True
+
+        queued = ((path, os.path.abspath(path)) for path in paths)
+        items = ((path, full_path, self._row(full_path)) for path, full_path in queued)
+        for path, full_path, st, tags, parsed in ordered_map(load, items, io_depth):
+            if parsed:
+                self._store(full_path, st, tags)
+            else:
+                self.hits += 1
+            yield path, tags
+
+    def _row(self, path):
+        return self.conn.execute(
+            "SELECT size, mtime_ns, inode, artist, title, album, genre, duration, bitrate FROM tags WHERE path = ?",
+            (path,),
+        ).fetchone()
+
+    def _store(self, path, st, tags):
+        self.misses += 1
+        self.conn.execute(
+            "INSERT OR REPLACE INTO tags VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (path, st.st_size, st.st_mtime_ns, st.st_ino) + tuple(tags),
+        )
+        self._pending += 1
+        if self._pending >= COMMIT_EVERY:
+            self.commit()
+
+    def paths(self, root):
+        root = os.path.join(os.path.abspath(root), "")
+        rows = self.conn.execute(
+            "SELECT path FROM tags WHERE substr(path, 1, ?) = ?", (len(root), root)
+        )
+        return [r[0] for r in rows]
+
+    def items(self, root):
+        """(path, Tags) for every indexed file under root, in path order, without touching the files"""
+        root = os.path.join(os.path.abspath(root), "")
+        rows = self.conn.execute(
+            "SELECT path, artist, title, album, genre, duration, bitrate FROM tags WHERE substr(path, 1, ?) = ? ORDER BY path",
+            (len(root), root),
+        )
+        for row in rows:
+            yield row[0], Tags(*row[1:])
+
+    def records(self, root):
+        """(path, size, Tags) for every indexed file under root, in path order, without touching the files"""
+        root = os.path.join(os.path.abspath(root), "")
+        rows = self.conn.execute(
+            "SELECT path, size, artist, title, album, genre, duration, bitrate FROM tags WHERE substr(path, 1, ?) = ? ORDER BY path",
+            (len(root), root),
+        )
+        for row in rows:
+            yield row[0], row[1], Tags(*row[2:])
+
+    def remove(self, path):
+        """forget a file, or every file under a folder"""
+        path = os.path.abspath(path)
+        prefix = os.path.join(path, "")
+        self.conn.execute("DELETE FROM tags WHERE path = ? OR substr(path, 1, ?) = ?", (path, len(prefix), prefix))
+        self._pending += 1
+
+    def prune(self, root, seen):
+        """remove indexed files under root that were not seen on the last walk"""
+        gone = [p for p in self.paths(root) if p not in seen]
+        self.conn.executemany("DELETE FROM tags WHERE path = ?", [(p,) for p in gone])
+        self.commit()
+        return len(gone)
+
+    def commit(self):
+        self.conn.commit()
+        self._pending = 0
+
+    def close(self):
+        self.commit()
+        self.conn.close()
+
+
+def open_index(db_path, reader="auto"):
+    """return a TagIndex for db_path, or None if no index was requested"""
+    if not db_path:
+        return None
+    return TagIndex(db_path, PARSERS[reader])
+
+
+def get_tags(path, index=None):
+    """read tags through the index when there is one, otherwise straight from TinyTag"""
+    if index is not None:
+        return index.get(path)
+    from tinytag import TinyTag
+
+    return TinyTag.get(path)
+
+
+def prefetch_tags(paths, index=None, io_depth=0):
+    """
+    (path, tags) for every path, in order. with io_depth > 0, up to that many
+    header reads are kept in flight on threads, so on a network share the
+    per-file latency overlaps instead of adding up; a slow consumer (e.g. a
+    prompt) holds the read-ahead at twice that many files
+    """
+    if io_depth <= 0:
+        for path in paths:
+            yield path, get_tags(path, index)
+    elif index is not None:
+        yield from index.get_many(paths, io_depth)
+    else:
+        yield from ordered_map(lambda path: (path, get_tags(path)), paths, io_depth)
+
+
+def sync(index, root, exts):
+    """bring the index up to date with everything under root"""
+    seen = set()
+    errors = 0
+    for file_path in walk(os.path.abspath(root), exts=exts):
+        seen.add(file_path)
+        try:
+            index.get(file_path)
+        except Exception as e:
+            errors += 1
+            print(f"Error indexing {file_path}: {e}")
+    removed = index.prune(root, seen)
+    print(f"[done] {len(seen)} files: {index.hits} unchanged, {index.misses} re-parsed, {removed} removed, {errors} errors")
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Build or refresh the on-disk tag index for a music library.")
+    ap.add_argument("root", help="Root folder (e.g., /path/to/music/files)")
+    ap.add_argument("--index", default=DEFAULT_INDEX, help=f"Index database (default: {DEFAULT_INDEX})")
+    ap.add_argument("--ext", action="append", default=["mp3"], help="File extensions to include (default: mp3).")
+    ap.add_argument("--reader", choices=sorted(PARSERS), default="auto", help="Tag parser (default: tinytag, else mutagen).")
+    args = ap.parse_args()
+
+    with TagIndex(args.index, PARSERS[args.reader]) as index:
+        sync(index, args.root, args.ext)
+
+
+if __name__ == "__main__":
+    main()
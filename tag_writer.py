@@ -0,0 +1,101 @@
+"""
+Queued ID3 tag writes for the genre/artist editors (add_genre.py, find_genre.py, fix_genre.py)
+
+What it does:
+
+- Records a tag edit (genre and/or artist) the moment it is decided, so the prompt never waits on the disk
+- Applies edits on a background thread pool, loading and saving only the ID3 tag instead of the whole MP3
+- Keeps edits to the same file in the order they were made
+- In deferred mode, holds every edit until the end of the session and writes them all in one parallel batch
+- Prints a summary of written and failed files when the queue is closed
+
+Usage:
+    from tag_writer import TagWriteQueue
+    with TagWriteQueue(defer=args.defer_writes) as writes:
+        writes.submit(file_path, genre="Rock")
+"""
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from mutagen.id3 import ID3, ID3NoHeaderError, TCON, TPE1
+
+from metrics import metrics
+
+FRAMES = {"artist": TPE1, "genre": TCON}
+
+
+def write_id3_frames(file_path, **values):
+    """set text frames (artist=..., genre=...) on file_path, touching only its ID3 tag"""
+    try:
+        tags = ID3(file_path)
+    except ID3NoHeaderError:
+        tags = ID3()
+    for key, value in values.items():
+        tags.add(FRAMES[key](encoding=3, text=value))
+    tags.save(file_path)
+
+
+class TagWriteQueue:
+    def __init__(self, workers=4, defer=False):
+        self.workers = workers
+        self.defer = defer
+        self.deferred = {}
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+        self.last_write = {}
+        self.written = 0
+        self.failed = []
+        self.lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def submit(self, file_path, **values):
+        """record an edit; it is written in the background, or at close() when deferred"""
+        if self.defer:
+            self.deferred.setdefault(file_path, {}).update(values)
+            return
+        # chain on the previous write to this file so edits land in order
+        previous = self.last_write.get(file_path)
+        self.last_write[file_path] = self.pool.submit(self._apply, file_path, values, previous)
+
+    def _apply(self, file_path, values, previous=None):
+        if previous is not None:
+            previous.exception()
+        try:
+            with metrics.stage("write"):
+                write_id3_frames(file_path, **values)
+        except Exception as e:
+            print(f'Error processing {file_path}: {e}')
+            metrics.count("write_errors")
+            with self.lock:
+                self.failed.append((file_path, str(e)))
+            return
+        metrics.count("tag_writes")
+        with self.lock:
+            self.written += 1
+
+    def wait(self):
+        """block until every write submitted so far has finished"""
+        for future in list(self.last_write.values()):
+            future.exception()
+        self.last_write.clear()
+
+    def flush(self):
+        """write all deferred edits in one parallel batch"""
+        deferred, self.deferred = self.deferred, {}
+        if deferred:
+            print(f"Writing tags to {len(deferred)} files...")
+        for future in [self.pool.submit(self._apply, path, values) for path, values in deferred.items()]:
+            future.result()
+        self.wait()
+
+    def close(self):
+        self.flush()
+        self.pool.shutdown()
+        print(f"[done] {self.written} tag writes applied, {len(self.failed)} failed")
+        for file_path, error in self.failed:
+            print(f"\tfailed: {file_path}: {error}")
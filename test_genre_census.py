@@ -0,0 +1,44 @@
+import pytest
+
+from genre_census import merge_partials, write_partial
+
+
+def block(name, genre="Rock"):
+    return {"kind": "dir", "name": name, "files": 1, "genres": {genre: 1}, "artists": {name: {genre: 1}}}
+
+
+def partial(tmp_path, name, shard, root="/music", tops=None):
+    path = str(tmp_path / name)
+    write_partial(path, root, {"mp3"}, shard, [block(name)], tops)
+    return path
+
+
+def test_merge_every_shard(tmp_path):
+    paths = [partial(tmp_path, f"s{i}", (i, 3)) for i in range(3)]
+    total_files, genre_counter, artist_genre_counts = merge_partials(paths)
+    assert total_files == 3
+    assert genre_counter == {"Rock": 3}
+
+
+def test_merge_refuses_missing_shard(tmp_path):
+    paths = [partial(tmp_path, "s0", (0, 3)), partial(tmp_path, "s1", (1, 3))]
+    with pytest.raises(SystemExit, match="missing shard 2/3"):
+        merge_partials(paths)
+
+
+def test_merge_refuses_other_split(tmp_path):
+    paths = [partial(tmp_path, "s0", (0, 2)), partial(tmp_path, "s1", (1, 3))]
+    with pytest.raises(SystemExit, match="different splits"):
+        merge_partials(paths)
+
+
+def test_merge_refuses_other_root(tmp_path):
+    paths = [partial(tmp_path, "s0", (0, 2)), partial(tmp_path, "s1", (1, 2), root="/other")]
+    with pytest.raises(SystemExit, match="census of /other"):
+        merge_partials(paths)
+
+
+def test_merge_refuses_top_with_shards(tmp_path):
+    paths = [partial(tmp_path, "s0", (0, 1)), partial(tmp_path, "jazz", None, tops=["jazz"])]
+    with pytest.raises(SystemExit, match="--top partial"):
+        merge_partials(paths)
@@ -0,0 +1,82 @@
+"""
+Shared normalization of track titles and artist names
+
+What it does:
+
+- Holds the filename heuristics tag-fixer.py uses (track number prefixes, bracketed phrases, underscores)
+- Reduces a title to the words that identify the song: "Song (Remastered)", "Song - 2011 Remaster",
+  "01 - Song [Bonus Track]" and "Song" all become "song"
+- Keeps what sets a different recording apart ("live", "remix", "acoustic", ...) as version markers,
+  so "Song (Live)" is not taken for a copy of "Song"
+- Reduces an artist name to a comparable form: "The Band", "Band, The" and "Band" all become "band",
+  and "feat." guests are dropped
+- Used by find_duplicates.py --mode fuzzy
+
+Usage:
+    from track_names import normalize_artist, title_key
+    title_key("Song - 2011 Remaster")     # ("song", frozenset())
+    title_key("Song (Live at Leeds)")     # ("song", frozenset({"live"}))
+    normalize_artist("Band, The feat. X")  # "band"
+"""
+
+import re
+import unicodedata
+
+# filename heuristics (see tag-fixer.py)
+# TRACKNUM_RE = re.compile(r'^\s*\d+\s*[-._\s]\s*')
+TRACKNUM_RE = re.compile(r'^\d{1,2}[-.]\s*|\d+\s*-\s*')
+BRACKET_RE = re.compile(r'[\[\(\{].*?[\]\)\}]')  # remove bracketed bits
+UNDERSCORE_RE = re.compile(r'_+')
+
+# words that make a different recording, not just a different release of the same one
+VERSION_MARKERS = ("live", "remix", "acoustic", "demo", "instrumental", "karaoke", "unplugged", "a cappella")
+MARKER_RE = re.compile(r'\b(' + '|'.join(VERSION_MARKERS) + r')\b')
+
+# a trailing " - ..." that only describes the release: "- 2011 Remaster", "- Mono Version", "- Bonus Track"
+RELEASE_SUFFIX_RE = re.compile(
+    r'\s+[-–—]\s+[^-–—]*\b(remaster(ed)?|version|mono|stereo|bonus|deluxe|anniversary|edition|single|'
+    + '|'.join(VERSION_MARKERS) + r'|\d{4})\b[^-–—]*$'
+)
+
+FEAT_RE = re.compile(r'\s*[\(\[]?\b(feat\.?|ft\.?|featuring)\s.*$')
+THE_SUFFIX_RE = re.compile(r'^(.*),\s*the$')
+NON_WORD_RE = re.compile(r'[\W_]+')
+
+
+def fold(s):
+    """casefold and drop accents, so "Beyoncé" and "BEYONCE" compare equal"""
+    s = unicodedata.normalize("NFKD", s.casefold())
+    return "".join(c for c in s if not unicodedata.combining(c)).replace("&", " and ")
+
+
+def words(s):
+    return " ".join(NON_WORD_RE.sub(" ", s).split())
+
+
+def title_key(title):
+    """(normalized title, version markers) for a title tag"""
+    t = fold(title or "")
+    markers = set()
+    for bracket in BRACKET_RE.findall(t):
+        markers.update(MARKER_RE.findall(bracket))
+    t = BRACKET_RE.sub(" ", t)
+    suffix = RELEASE_SUFFIX_RE.search(t)
+    if suffix:
+        markers.update(MARKER_RE.findall(suffix.group()))
+        t = t[:suffix.start()]
+    t = TRACKNUM_RE.sub("", t.strip())
+    t = UNDERSCORE_RE.sub(" ", t)
+    return words(t), frozenset(markers)
+
+
+def normalize_title(title):
+    return title_key(title)[0]
+
+
+def normalize_artist(artist):
+    a = FEAT_RE.sub("", fold(artist or "").strip())
+    m = THE_SUFFIX_RE.match(a)
+    if m:
+        a = m.group(1)
+    a = words(a)
+    return a[4:] if a.startswith("the ") else a
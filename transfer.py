@@ -0,0 +1,158 @@
+"""
+Verified, parallel file moves between filesystems
+
+What it does:
+
+- Copies with kernel-side copying (copy_file_range, falling back to sendfile, then a plain buffered copy),
+  so file data doesn't pass through Python
+- Keeps several copies in flight at once
+- Copies to a temporary ".part" name, checks a streaming BLAKE2 checksum of the copy against the source,
+  and only then renames it into place and deletes the source
+- Moves a group of files together (e.g. an mp3 and its _300.jpg sidecar) and reports MB/s at the end
+
+Usage:
+    from transfer import TransferEngine, same_filesystem
+    engine = TransferEngine(workers=4)
+    for key, moved, error in engine.move_groups([(src, [(src, dst), (src_jpg, dst_jpg)])]):
+        ...
+    engine.report()
+"""
+
+import errno
+import hashlib
+import os
+import shutil
+import threading
+import time
+
+from metrics import metrics
+from parallel import ordered_map
+
+COPY_CHUNK = 64 * 1024 * 1024
+HASH_BLOCK = 1024 * 1024
+
+
+def existing_ancestor(path):
+    while not os.path.exists(path):
+        parent = os.path.dirname(path)
+        if parent == path:
+            break
+        path = parent
+    return path
+
+
+def same_filesystem(src, dst):
+    """True if a rename from src to dst stays on one filesystem"""
+    return os.stat(src).st_dev == os.stat(existing_ancestor(os.path.dirname(os.path.abspath(dst)))).st_dev
+
+
+def _copy_with(fn, fin, fout, size):
+    copied = 0
+    while copied < size:
+        n = fn(fin, fout, min(COPY_CHUNK, size - copied), copied)
+        if n == 0:
+            break
+        copied += n
+    return copied
+
+
+def kernel_copy(src, dst):
+    """copy src to dst without pulling the data into Python, where the kernel allows it"""
+    with open(src, "rb") as fin, open(dst, "wb") as fout:
+        size = os.fstat(fin.fileno()).st_size
+        try:
+            return _copy_with(lambda i, o, n, off: os.copy_file_range(i.fileno(), o.fileno(), n, off, off), fin, fout, size)
+        except (AttributeError, OSError) as e:
+            if isinstance(e, OSError) and e.errno not in (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP):
+                raise
+        fout.seek(0)
+        fout.truncate()
+        try:
+            return _copy_with(lambda i, o, n, off: os.sendfile(o.fileno(), i.fileno(), off, n), fin, fout, size)
+        except (AttributeError, OSError) as e:
+            if isinstance(e, OSError) and e.errno not in (errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP):
+                raise
+        fin.seek(0)
+        fout.seek(0)
+        fout.truncate()
+        shutil.copyfileobj(fin, fout, HASH_BLOCK)
+        return size
+
+
+def file_checksum(path):
+    digest = hashlib.blake2b()
+    with open(path, "rb") as f:
+        while True:
+            block = f.read(HASH_BLOCK)
+            if not block:
+                break
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def move_file(src, dst):
+    """copy, verify, then delete the source; returns the number of bytes moved"""
+    tmp = dst + ".part"
+    try:
+        with metrics.stage("copy"):
+            size = kernel_copy(src, tmp)
+            shutil.copystat(src, tmp)
+        with metrics.stage("verify"):
+            verified = file_checksum(src) == file_checksum(tmp)
+        if not verified:
+            raise OSError(f"checksum mismatch copying {src} to {dst}")
+        os.replace(tmp, dst)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    os.remove(src)
+    return size
+
+
+class TransferEngine:
+    def __init__(self, workers=4):
+        self.workers = workers
+        self.bytes_moved = 0
+        self.files_moved = 0
+        self.started = None
+        self.lock = threading.Lock()
+
+    def move_group(self, group):
+        """
+        move a group of (src, dst) pairs in order; returns (the pairs moved,
+        error or None), so a group that stops halfway can be finished later
+        """
+        moved = []
+        try:
+            for src, dst in group:
+                os.makedirs(os.path.dirname(dst), exist_ok=True)
+                with metrics.stage("move"):
+                    size = move_file(src, dst)
+                moved.append((src, dst))
+                metrics.count("files_moved")
+                metrics.count("bytes_moved", size)
+                with self.lock:
+                    self.bytes_moved += size
+                    self.files_moved += 1
+        except Exception as e:
+            return moved, e
+        return moved, None
+
+    def move_groups(self, groups):
+        """
+        move every (key, group), several at a time; yields (key, pairs moved,
+        error or None) in the order of groups. the key is the caller's name for
+        the group, which may be empty when there is nothing left to move. only
+        a few groups are queued ahead, so when the caller stops (or is
+        interrupted) the queued ones are cancelled and just the ones already
+        moving finish
+        """
+        self.started = self.started or time.monotonic()
+        return ordered_map(lambda item: (item[0],) + self.move_group(item[1]), groups, self.workers)
+
+    def report(self):
+        elapsed = time.monotonic() - self.started if self.started else 0
+        mb = self.bytes_moved / (1024 * 1024)
+        rate = mb / elapsed if elapsed else 0
+        print(f"[transfer] {self.files_moved} files, {mb:.1f} MB in {elapsed:.1f}s ({rate:.1f} MB/s)")
@@ -0,0 +1,146 @@
+"""
+Shared library walker built on os.scandir
+
+What it does:
+
+- Walks a music library top-down (like os.walk) and yields file paths
+- Uses the d_type from each directory entry, so regular files and folders cost no extra stat
+- Filters by extension and by exclude patterns (e.g. ".*" or "@eaDir")
+- Optionally records each folder's mtime and listing in a state file; on the next walk, a folder
+  whose mtime hasn't changed is answered from the state instead of being read again, so only
+  folders where files were added, removed or renamed get re-listed
+
+Usage:
+    from walker import walk, WalkState
+    for path in walk("/path/to/music/files", exts={"mp3"}):
+        ...
+
+    with WalkState("/path/to/walk_state.sqlite") as state:
+        for path in walk("/path/to/music/files", exts={"mp3"}, state=state):
+            ...
+"""
+
+import fnmatch
+import os
+import sqlite3
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS dirs (
+    path TEXT PRIMARY KEY,
+    mtime_ns INTEGER NOT NULL,
+    files TEXT NOT NULL,
+    subdirs TEXT NOT NULL
+)
+"""
+
+
+def _join_names(names):
+    return "\0".join(names)
+
+
+def _split_names(value):
+    return value.split("\0") if value else []
+
+
+class WalkState:
+    """folder mtimes and listings from the previous walk, kept in SQLite"""
+
+    def __init__(self, db_path):
+        db_dir = os.path.dirname(os.path.abspath(db_path))
+        os.makedirs(db_dir, exist_ok=True)
+        self.conn = sqlite3.connect(db_path, timeout=60)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(SCHEMA)
+        self.conn.commit()
+        self.reused = 0
+        self.scanned = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def get(self, path, mtime_ns):
+        row = self.conn.execute("SELECT mtime_ns, files, subdirs FROM dirs WHERE path = ?", (path,)).fetchone()
+        if row is None or row[0] != mtime_ns:
+            return None
+        self.reused += 1
+        return _split_names(row[1]), _split_names(row[2])
+
+    def put(self, path, mtime_ns, files, subdirs):
+        self.scanned += 1
+        self.conn.execute(
+            "INSERT OR REPLACE INTO dirs VALUES (?, ?, ?, ?)",
+            (path, mtime_ns, _join_names(files), _join_names(subdirs)),
+        )
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
+
+
+def scan_dir(path):
+    """return (files, subdirs) names in path without stat-ing regular entries"""
+    files = []
+    subdirs = []
+    with os.scandir(path) as it:
+        for entry in it:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.name)
+                elif not entry.is_symlink() or entry.is_file():
+                    files.append(entry.name)
+            except OSError:
+                continue
+    return files, subdirs
+
+
+def _list_dir(path, state):
+    if state is None:
+        return scan_dir(path)
+    # take the mtime before listing, so a change made mid-scan is picked up next time
+    mtime_ns = os.stat(path).st_mtime_ns
+    cached = state.get(path, mtime_ns)
+    if cached is not None:
+        return cached
+    files, subdirs = scan_dir(path)
+    state.put(path, mtime_ns, files, subdirs)
+    return files, subdirs
+
+
+def _excluded(name, exclude):
+    name = name.lower()
+    return any(fnmatch.fnmatchcase(name, pattern) for pattern in exclude)
+
+
+def walk(root, exts=None, exclude=None, state=None, sort=False):
+    """
+    yield the path of every file under root, top-down.
+    exts: extensions to keep, without the dot (e.g. {"mp3", "flac"}); None keeps everything
+    exclude: glob patterns for file or folder names to skip, matched case-insensitively
+    state: a WalkState, to reuse the listing of folders whose mtime hasn't changed
+    sort: list each folder in name order, for a deterministic walk
+    """
+    exts = set(e.lower().lstrip(".") for e in exts) if exts else None
+    exclude = [p.lower() for p in exclude] if exclude else []
+    stack = [root]
+    while stack:
+        top = stack.pop()
+        try:
+            files, subdirs = _list_dir(top, state)
+        except OSError:
+            continue
+        if sort:
+            files = sorted(files)
+            subdirs = sorted(subdirs)
+        for name in files:
+            if exts is not None and os.path.splitext(name)[1].lower().lstrip(".") not in exts:
+                continue
+            if exclude and _excluded(name, exclude):
+                continue
+            yield os.path.join(top, name)
+        for name in reversed(subdirs):
+            if exclude and _excluded(name, exclude):
+                continue
+            stack.append(os.path.join(top, name))
@@ -0,0 +1,218 @@
+"""
+Keep the tag index current by watching the library with inotify (Linux only)
+
+What it does:
+
+- Brings the tag index (see tag_index.py) up to date with one walk of the library, then watches every folder
+- Collects create/modify/move/delete events and coalesces bursts: a file is only re-parsed once it
+  has been quiet for a few seconds, so a partial copy isn't read until the copy has finished
+- Re-parses only the affected files (TinyTag, or mutagen with --reader mutagen) and forgets deleted
+  or moved-away files and folders
+- Falls back to a full re-sync if the kernel event queue overflows
+
+With the watcher running, reports can read straight from the index without walking the library:
+    python3 genre_census.py /path/to/music/files --index /path/to/tags.sqlite --from-index
+    python3 no_genre.py /path/to/music/files --index /path/to/tags.sqlite --from-index
+    python3 music_report.py /path/to/music/files --index /path/to/tags.sqlite --from-index
+
+Note: each folder uses one inotify watch; large libraries may need a higher
+/proc/sys/fs/inotify/max_user_watches.
+
+Usage:
+    python3 watch.py /path/to/music/files --index /path/to/tags.sqlite --ext mp3 --ext flac
+"""
+
+import argparse
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import time
+
+from tag_index import DEFAULT_INDEX, PARSERS, TagIndex, sync
+
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_DONT_FOLLOW = 0x02000000
+IN_ISDIR = 0x40000000
+
+WATCH_MASK = (IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+              | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR | IN_DONT_FOLLOW)
+
+EVENT_HEADER = struct.Struct("iIII")
+
+
+class Inotify:
+    def __init__(self):
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.fd = self.libc.inotify_init1(os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+
+    def add_watch(self, path, mask):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), f"inotify_add_watch failed for {path}")
+        return wd
+
+    def remove_watch(self, wd):
+        self.libc.inotify_rm_watch(self.fd, wd)
+
+    def read_events(self):
+        data = os.read(self.fd, 64 * 1024)
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip(b"\0")
+            offset += length
+            yield wd, mask, os.fsdecode(name)
+
+    def close(self):
+        os.close(self.fd)
+
+
+class LibraryWatcher:
+    def __init__(self, root, index, exts, quiet=2.0):
+        self.root = os.path.abspath(root)
+        self.index = index
+        self.exts = set(e.lower().lstrip(".") for e in exts)
+        self.quiet = quiet
+        self.inotify = Inotify()
+        self.folders = {}
+        # path -> (last event time, deleted?) for files waiting to settle
+        self.pending = {}
+
+    def wanted(self, path):
+        return os.path.splitext(path)[1].lower().lstrip(".") in self.exts
+
+    def watch_tree(self, top, queue_files=False):
+        """watch top and every folder below it; optionally queue the files found there"""
+        stack = [top]
+        while stack:
+            folder = stack.pop()
+            try:
+                wd = self.inotify.add_watch(folder, WATCH_MASK)
+                entries = list(os.scandir(folder))
+            except OSError as e:
+                print(f"Cannot watch {folder}: {e}")
+                continue
+            self.folders[wd] = folder
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif queue_files and self.wanted(entry.path):
+                    self.pending[entry.path] = (time.monotonic(), False)
+
+    def unwatch_tree(self, top):
+        """stop watching top and every folder below it"""
+        below = os.path.join(top, "")
+        for wd, folder in list(self.folders.items()):
+            if folder == top or folder.startswith(below):
+                self.inotify.remove_watch(wd)
+                del self.folders[wd]
+
+    def resync(self):
+        print("[watch] syncing index with the library...")
+        sync(self.index, self.root, self.exts)
+        self.pending.clear()
+
+    def handle(self, wd, mask, name):
+        if mask & IN_Q_OVERFLOW:
+            print("[watch] event queue overflowed")
+            self.resync()
+            return
+        folder = self.folders.get(wd)
+        if mask & IN_IGNORED:
+            self.folders.pop(wd, None)
+            return
+        if mask & IN_MOVE_SELF and folder is not None and not os.path.isdir(folder):
+            # moved out of the library (a move inside it re-registers the folder under its new path);
+            # its subfolders get no event of their own, so their watches go too
+            self.unwatch_tree(folder)
+            return
+        if folder is None or not name:
+            return
+        path = os.path.join(folder, name)
+        now = time.monotonic()
+        if mask & IN_ISDIR:
+            if mask & (IN_CREATE | IN_MOVED_TO):
+                self.watch_tree(path, queue_files=True)
+            elif mask & (IN_DELETE | IN_MOVED_FROM):
+                # the folder's own watch goes away with an IN_IGNORED; drop its files now
+                self.pending = {p: v for p, v in self.pending.items() if not p.startswith(os.path.join(path, ""))}
+                self.index.remove(path)
+                # no file event may follow to flush it, so readers would go on seeing the folder
+                self.index.commit()
+                print(f"[watch] removed {path}")
+            return
+        if not self.wanted(path):
+            return
+        deleted = bool(mask & (IN_DELETE | IN_MOVED_FROM))
+        self.pending[path] = (now, deleted)
+
+    def flush(self, force=False):
+        """apply every pending file that has been quiet long enough"""
+        now = time.monotonic()
+        ready = [p for p, (at, _) in self.pending.items() if force or now - at >= self.quiet]
+        updated = removed = 0
+        for path in ready:
+            _, deleted = self.pending.pop(path)
+            if deleted or not os.path.exists(path):
+                self.index.remove(path)
+                removed += 1
+                continue
+            try:
+                self.index.get(path)
+                updated += 1
+            except Exception as e:
+                print(f"Error indexing {path}: {e}")
+        if ready:
+            self.index.commit()
+            print(f"[watch] {updated} updated, {removed} removed")
+
+    def run(self):
+        # watch first, so nothing changed during the resync is missed; a file both
+        # resynced and reported is only indexed again, which is harmless
+        self.watch_tree(self.root)
+        self.resync()
+        print(f"[watch] watching {len(self.folders)} folders under {self.root}")
+        try:
+            while True:
+                timeout = self.quiet if self.pending else None
+                readable, _, _ = select.select([self.inotify.fd], [], [], timeout)
+                if readable:
+                    for wd, mask, name in self.inotify.read_events():
+                        self.handle(wd, mask, name)
+                self.flush()
+        except KeyboardInterrupt:
+            self.flush(force=True)
+        finally:
+            self.inotify.close()
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Keep the tag index current by watching the library with inotify.")
+    ap.add_argument("root", help="Root folder (e.g., /path/to/music/files)")
+    ap.add_argument("--index", default=DEFAULT_INDEX, help=f"Index database (default: {DEFAULT_INDEX})")
+    ap.add_argument("--ext", action="append", default=["mp3"], help="File extensions to include (default: mp3).")
+    ap.add_argument("--reader", choices=sorted(PARSERS), default="auto", help="Tag parser (default: tinytag, else mutagen).")
+    ap.add_argument("--quiet", type=float, default=2.0, help="Seconds a file must be unchanged before it is re-parsed (default: 2).")
+    args = ap.parse_args()
+
+    with TagIndex(args.index, PARSERS[args.reader]) as index:
+        LibraryWatcher(args.root, index, args.ext, args.quiet).run()
+
+
+if __name__ == "__main__":
+    main()